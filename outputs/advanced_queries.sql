@@ -4,6 +4,11 @@
 -- These 10 queries demonstrate advanced data analysis skills:
 -- CTEs, Subqueries, Window Functions, Aggregations, String Manipulations, and Joins.
 -- Run these against 'audit_results.db' or 'high_risk_patients.db'.
+-- Risk is filtered on the typed, indexed columns (codes from scripts/risk.py):
+--   literature_severity: 0 no flag, 1 potential risk, 2 KNOWN RISK (NULL: lookup failed)
+--   structure_severity:  0 low similarity, 1 HIGH STRUCTURAL SIMILARITY (NULL: not scored)
+--   structure_status:    0 scored, 1 biological agent, 2 missing, 3 invalid, 4 unavailable, 5 error
+--   severity:            0 none, 1 needs review, 2 high risk
 -- =================================================================================
 -- 1. DEPARTMENT RISK DISTRIBUTION (Aggregation & Grouping)
 -- Calculates the total number of flagged interactions per department
@@ -11,13 +16,13 @@ SELECT department,
     COUNT(*) as total_interactions_checked,
     SUM(
         CASE
-            WHEN literature_risk LIKE '%KNOWN RISK%' THEN 1
+            WHEN literature_severity = 2 THEN 1
             ELSE 0
         END
     ) as literature_risks,
     SUM(
         CASE
-            WHEN biochem_risk LIKE '%HIGH STRUCTURAL SIMILARITY%' THEN 1
+            WHEN structure_severity = 1 THEN 1
             ELSE 0
         END
     ) as high_chemical_risks
@@ -30,7 +35,7 @@ SELECT drug_1,
     drug_2,
     COUNT(*) as frequency_of_prescription
 FROM patient_safety_audit
-WHERE literature_risk LIKE '%KNOWN RISK%'
+WHERE literature_severity = 2
 GROUP BY drug_1,
     drug_2
 ORDER BY frequency_of_prescription DESC
@@ -42,8 +47,7 @@ WITH PatientInteractions AS (
         department,
         COUNT(*) as interaction_count
     FROM patient_safety_audit
-    WHERE literature_risk LIKE '%KNOWN RISK%'
-        OR biochem_risk LIKE '%HIGH STRUCTURAL SIMILARITY%'
+    WHERE severity = 2
     GROUP BY patient_name,
         department
 )
@@ -61,7 +65,7 @@ SELECT CASE
     END AS age_bracket,
     COUNT(DISTINCT patient_name) as unique_high_risk_patients
 FROM patient_safety_audit
-WHERE literature_risk LIKE '%KNOWN RISK%'
+WHERE literature_severity = 2
 GROUP BY age_bracket
 ORDER BY unique_high_risk_patients DESC;
 -- 5. THE "SILENT KILLER" CHEMICAL SIMILARITIES (Window Function)
@@ -76,8 +80,8 @@ WITH ChemicalRisks AS (
             ORDER BY COUNT(*) DESC
         ) as risk_rank
     FROM patient_safety_audit
-    WHERE biochem_risk LIKE '%HIGH STRUCTURAL SIMILARITY%'
-        AND literature_risk NOT LIKE '%KNOWN RISK%'
+    WHERE structure_severity = 1
+        AND literature_severity IS NOT 2
     GROUP BY drug_1,
         drug_2,
         biochem_risk
@@ -90,20 +94,20 @@ WHERE risk_rank <= 3;
 SELECT department,
     COUNT(
         CASE
-            WHEN literature_risk LIKE '%KNOWN RISK%' THEN 1
+            WHEN literature_severity = 2 THEN 1
         END
     ) * 100.0 / COUNT(*) as risk_percentage
 FROM patient_safety_audit
 GROUP BY department
 ORDER BY risk_percentage DESC;
--- 7. BIOLOGICAL AGENT PREVALENCE (String Matching / LIKE)
+-- 7. BIOLOGICAL AGENT PREVALENCE (Status Codes)
 -- Finds all interactions involving a biological agent (like Insulin)
 SELECT department,
     patient_name,
     drug_1,
     drug_2
 FROM patient_safety_audit
-WHERE biochem_risk LIKE '%Biological Agent%'
+WHERE structure_status = 1
 ORDER BY department;
 -- 8. PATIENTS REQUIRING IMMEDIATE INTERVENTION (Multiple Conditions)
 -- Identifies specific, highly vulnerable patients (Elderly + Known Interaction)
@@ -113,18 +117,18 @@ SELECT DISTINCT patient_name,
     diagnosis
 FROM patient_safety_audit
 WHERE age > 65
-    AND literature_risk LIKE '%KNOWN RISK%'
+    AND literature_severity = 2
 ORDER BY age DESC;
 -- 9. DRUG INVOLVEMENT FREQUENCY (UNION ALL)
 -- Determines which single drug is most frequently involved in ANY flagged interaction
 WITH AllDrugs AS (
     SELECT drug_1 as drug_name
     FROM patient_safety_audit
-    WHERE literature_risk LIKE '%KNOWN RISK%'
+    WHERE literature_severity = 2
     UNION ALL
     SELECT drug_2 as drug_name
     FROM patient_safety_audit
-    WHERE literature_risk LIKE '%KNOWN RISK%'
+    WHERE literature_severity = 2
 )
 SELECT drug_name,
     COUNT(*) as times_involved_in_risk
@@ -1,7 +1,10 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
 import plotly.express as px
+import os
+
+import risk
+import audit_schema
 
 # ==========================================
 # STREAMLIT DASHBOARD: AUTONOMOUS DDI AUDITOR
@@ -15,63 +18,103 @@ st.set_page_config(page_title="DDI Auditor Dashboard", page_icon="🏥", layout=
 st.title("🏥 Autonomous DDI Auditor - Safety Dashboard")
 st.markdown("---")
 
-# Function to load data from SQLite
-@st.cache_data
-def load_data():
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_PATH = os.path.join(BASE_DIR, "outputs", "audit_results.db")
+
+# Rows shown in the detailed log (a large audit has millions)
+MAX_TABLE_ROWS = 5000
+
+# Function to run one query against the audit database
+def run_query(query, params=()):
     try:
-        import os
-        BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        DB_PATH = os.path.join(BASE_DIR, "outputs", "audit_results.db")
-        
         if not os.path.exists(DB_PATH):
             return pd.DataFrame()
 
-        conn = sqlite3.connect(DB_PATH)
-        # We need to loop through all tables and combine them for the dashboard
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = [row[0] for row in cursor.fetchall() if row[0] != "sqlite_sequence"]
-        
-        if not tables:
-            conn.close()
-            return pd.DataFrame()
-
-        df_list = []
-        for table in tables:
-            query = f"SELECT *, '{table}' as Department FROM {table}"
-            df_temp = pd.read_sql_query(query, conn)
-            df_list.append(df_temp)
-            
-        df = pd.concat(df_list, ignore_index=True)
+        conn = audit_schema.connect_readonly(DB_PATH)
+        df = pd.read_sql_query(query, conn, params=params)
         conn.close()
         return df
     except Exception as e:
         # Don't show technical error to user here, handled by df.empty check
         return pd.DataFrame()
 
+# Each section filters in SQL on the indexed department / severity
+# columns instead of loading the whole audit into pandas
+@st.cache_data
+def load_summary():
+    return run_query('''
+        SELECT
+            COUNT(DISTINCT patient_id) AS patients,
+            COUNT(*) AS interactions,
+            COALESCE(SUM(severity >= :high), 0) AS high_risk_interactions,
+            COUNT(DISTINCT CASE WHEN severity >= :high THEN patient_id END) AS high_risk_patients
+        FROM patient_pairs
+    ''', {"high": risk.Severity.HIGH})
+
+@st.cache_data
+def load_high_risk_by_department():
+    return run_query('''
+        SELECT d.name AS Department, COUNT(*) AS Count
+        FROM patient_pairs pp
+        JOIN departments d ON d.id = pp.department_id
+        WHERE pp.severity >= ?
+        GROUP BY d.name
+    ''', (risk.Severity.HIGH,))
+
+@st.cache_data
+def load_top_risk_drugs():
+    return run_query('''
+        SELECT drug AS "Drug Name", COUNT(*) AS "Involvement Count"
+        FROM (
+            SELECT drug_1 AS drug FROM patient_safety_audit WHERE severity >= :high
+            UNION ALL
+            SELECT drug_2 FROM patient_safety_audit WHERE severity >= :high
+        )
+        GROUP BY drug
+        ORDER BY "Involvement Count" DESC
+        LIMIT 10
+    ''', {"high": risk.Severity.HIGH})
+
+@st.cache_data
+def load_departments():
+    df = run_query("SELECT name FROM departments ORDER BY name")
+    return df['name'].tolist() if not df.empty else []
+
+@st.cache_data
+def load_audit_log(department):
+    query = '''
+        SELECT patient_name, age, department AS Department, diagnosis, drug_1, drug_2, literature_risk, biochem_risk
+        FROM patient_safety_audit
+    '''
+    if department == "All":
+        return run_query(query + " LIMIT ?", (MAX_TABLE_ROWS,))
+    return run_query(query + " WHERE department = ? LIMIT ?", (department, MAX_TABLE_ROWS))
+
+# Read-only: an out-of-date file is reported, not upgraded under a running audit
+if os.path.exists(DB_PATH):
+    try:
+        audit_schema.connect_readonly(DB_PATH).close()
+    except audit_schema.SchemaOutdatedError as e:
+        st.error(str(e))
+        st.stop()
+
 # Load the data
-df = load_data()
+summary = load_summary()
 
-if df.empty:
+if summary.empty or summary.iloc[0]['interactions'] == 0:
     st.warning("No audit data found. Please run `main.py` first to generate the database.")
 else:
     # Top Level Metrics
     st.subheader("📊 Executive Summary")
     
-    # Calculate Metrics
-    total_patients_audited = df['patient_name'].nunique()
-    total_interactions_checked = len(df)
-    
-    # Identify HIGH RISK (Literature FLAG or Chemical FLAG)
-    df['Is_High_Risk'] = df['literature_risk'].str.contains('KNOWN RISK', na=False) | df['biochem_risk'].str.contains('HIGH STRUCTURAL SIMILARITY', na=False)
-    high_risk_interactions = df['Is_High_Risk'].sum()
-    unique_high_risk_patients = df[df['Is_High_Risk']]['patient_name'].nunique()
+    # Metrics (HIGH RISK: Literature FLAG or Chemical FLAG)
+    metrics = summary.iloc[0]
 
     col1, col2, col3, col4 = st.columns(4)
-    col1.metric("Total Patients Audited", total_patients_audited)
-    col2.metric("Drug Pairs Checked", total_interactions_checked)
-    col3.metric("High-Risk Interactions", high_risk_interactions, delta_color="inverse")
-    col4.metric("Patients at Risk", unique_high_risk_patients, delta_color="inverse")
+    col1.metric("Total Patients Audited", int(metrics['patients']))
+    col2.metric("Drug Pairs Checked", int(metrics['interactions']))
+    col3.metric("High-Risk Interactions", int(metrics['high_risk_interactions']), delta_color="inverse")
+    col4.metric("Patients at Risk", int(metrics['high_risk_patients']), delta_color="inverse")
 
     st.markdown("---")
 
@@ -80,10 +123,8 @@ else:
     
     with col_chart1:
         st.subheader("📈 High-Risk Interactions by Department")
-        # Filter only high risk
-        df_risk = df[df['Is_High_Risk']]
-        if not df_risk.empty:
-            risk_by_dept = df_risk.groupby("Department").size().reset_index(name="Count")
+        risk_by_dept = load_high_risk_by_department()
+        if not risk_by_dept.empty:
             fig1 = px.bar(risk_by_dept, x="Department", y="Count", color="Department", 
                           title="Count of Critical Drug-Drug Interactions")
             st.plotly_chart(fig1, use_container_width=True)
@@ -92,12 +133,9 @@ else:
 
     with col_chart2:
         st.subheader("💊 Most Common Interacting Drugs")
-        if not df_risk.empty:
-            # Combine drug 1 and drug 2 from the risk dataframe to see which is most common
-            drugs = pd.concat([df_risk['drug_1'], df_risk['drug_2']])
-            top_drugs = drugs.value_counts().head(10).reset_index()
-            top_drugs.columns = ['Drug Name', 'Involvement Count']
-            
+        # Drug 1 and drug 2 of every high-risk interaction, counted together
+        top_drugs = load_top_risk_drugs()
+        if not top_drugs.empty:
             fig2 = px.pie(top_drugs, values='Involvement Count', names='Drug Name', 
                           title="Top 10 Drugs Causing Alerts")
             st.plotly_chart(fig2, use_container_width=True)
@@ -108,12 +146,10 @@ else:
     st.subheader("📋 Detailed Safety Audit Log")
     
     # Interactive filtering
-    dept_filter = st.selectbox("Filter by Department:", ["All"] + list(df['Department'].unique()))
-    
-    if dept_filter != "All":
-        filtered_df = df[df['Department'] == dept_filter]
-    else:
-        filtered_df = df
+    dept_filter = st.selectbox("Filter by Department:", ["All"] + load_departments())
+    filtered_df = load_audit_log(dept_filter)
+    if len(filtered_df) == MAX_TABLE_ROWS:
+        st.caption(f"Showing the first {MAX_TABLE_ROWS} rows.")
         
     st.dataframe(filtered_df[['patient_name', 'age', 'Department', 'diagnosis', 'drug_1', 'drug_2', 'literature_risk', 'biochem_risk']], 
                  use_container_width=True, hide_index=True)
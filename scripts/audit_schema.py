@@ -0,0 +1,479 @@
+import os
+import sqlite3
+import pathlib
+import datetime
+
+import risk
+
+# ==========================================
+# AUDIT DATABASE SCHEMA
+# ==========================================
+# Role: Own the layout of outputs/audit_results.db and upgrade older files.
+#   audit_runs        one row per audit run (metadata, counts, the
+#                     patients.db change-log watermark it covers and the
+#                     last patient committed, to resume an interrupted run)
+#   pair_results      one row per unique drug pair: citation count,
+#                     similarity, severity / structure-status codes
+#                     (see risk.py) and summary
+#   audited_patients  one row per audited patient
+#   departments       dictionary of department names
+#   patient_pairs     narrow fact table: (patient id, pair id), plus the
+#                     department id and overall severity it is filtered on
+# Pair results are stored once instead of once per patient, as typed
+# columns. The `patient_safety_audit` view joins the tables into one row
+# per patient and pair and renders the display strings (literature_risk,
+# biochem_risk) from those columns; composite indexes on patient_pairs and
+# pair_results serve the department, severity and drug filters. One view
+# per department (e.g. `General_Medicine`) reproduces the former
+# per-department tables.
+# A full run writes into `staging_` copies of the result tables and swaps
+# them in when it completes, so readers keep the last completed results
+# while it runs and after it fails.
+# The schema version lives in PRAGMA user_version.
+# ==========================================
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AUDIT_DB_PATH = os.path.join(BASE_DIR, "outputs", "audit_results.db")
+
+# Version 0: one table per department
+# Version 1: normalized pair_results / patient_pairs store
+# Version 2: departments dictionary, department and severity on
+#            patient_pairs, patient_safety_audit view
+# Version 3: typed pair_results columns only, display strings rendered by
+#            the views
+# Version 4: run mode and change-log watermark on audit_runs
+# Version 5: run checkpoints on audit_runs
+SCHEMA_VERSION = 5
+
+# audit_runs columns added after version 1 (the table is kept across resets)
+RUN_COLUMNS = {
+    "mode": "TEXT NOT NULL DEFAULT 'full'",
+    "change_id": "INTEGER",
+    "checkpoint_department": "TEXT",
+    "checkpoint_patient_id": "INTEGER",
+}
+
+# Tables rebuilt by every full run (audit_runs keeps its history)
+RESULT_TABLES = ["pair_results", "audited_patients", "departments", "patient_pairs"]
+
+# Prefix of the result tables a full run writes until it completes
+STAGING_PREFIX = "staging_"
+
+INDEXES = {
+    "idx_pair_results_drugs": "pair_results (drug_1, drug_2)",
+    "idx_pair_results_drug_2": "pair_results (drug_2)",
+    "idx_pair_results_literature": "pair_results (literature_severity, citation_count)",
+    "idx_pair_results_structure": "pair_results (structure_severity, similarity)",
+    "idx_pair_results_structure_status": "pair_results (structure_status)",
+    "idx_audited_patients_name": "audited_patients (name)",
+    "idx_patient_pairs_pair": "patient_pairs (pair_id)",
+    "idx_patient_pairs_department": "patient_pairs (department_id, severity)",
+    "idx_patient_pairs_severity": "patient_pairs (severity, department_id)",
+}
+
+def department_table(department):
+    """Format department name for SQL table (e.g., General Medicine -> General_Medicine)."""
+    return department.replace(" ", "_").replace("-", "_")
+
+PAIR_COLUMNS = [
+    "id", "drug_1", "drug_2",
+    "citation_count", "literature_severity", "literature_error", "summary",
+    "similarity", "structure_status", "structure_severity", "structure_error",
+]
+
+def insert_pair_sql(prefix=""):
+    """INSERT statement for a pair_row() into the (staging) pair_results table."""
+    return (f"INSERT INTO {prefix}pair_results ({', '.join(PAIR_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(PAIR_COLUMNS))})")
+
+INSERT_PAIR = insert_pair_sql()
+
+def pair_row(pair_id, drug_1, drug_2, literature, structure):
+    """pair_results row (PAIR_COLUMNS order) for a LiteratureResult and a StructureResult."""
+    return (
+        pair_id, drug_1, drug_2,
+        literature.citation_count, literature.severity, literature.error, literature.summary,
+        structure.similarity, structure.status, structure.severity, structure.error,
+    )
+
+def results_from_row(row):
+    """(LiteratureResult, StructureResult) of a pair_results row in PAIR_COLUMNS order."""
+    (_, _, _, citation_count, literature_severity, literature_error, summary,
+     similarity, structure_status, structure_severity, structure_error) = row
+    return (
+        risk.LiteratureResult(literature_severity, citation_count, summary, literature_error),
+        risk.StructureResult(structure_status, similarity, structure_error, structure_severity),
+    )
+
+def create_result_tables(conn, prefix=""):
+    """Creates the RESULT_TABLES (named with `prefix`) if they do not exist."""
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {prefix}pair_results (
+            id INTEGER PRIMARY KEY,
+            drug_1 TEXT NOT NULL,
+            drug_2 TEXT NOT NULL,
+            citation_count INTEGER,
+            literature_severity INTEGER,
+            literature_error TEXT,
+            summary TEXT,
+            similarity REAL,
+            structure_status INTEGER NOT NULL,
+            structure_severity INTEGER,
+            structure_error TEXT
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {prefix}audited_patients (
+            id INTEGER PRIMARY KEY,
+            run_id INTEGER REFERENCES audit_runs (id),
+            name TEXT,
+            age INTEGER,
+            department TEXT,
+            diagnosis TEXT,
+            medication_list TEXT
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {prefix}departments (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+    ''')
+    # Clustered on the key; department and severity are copies kept here
+    # (as small integers) so the common filters are one index range scan
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {prefix}patient_pairs (
+            patient_id INTEGER NOT NULL REFERENCES {prefix}audited_patients (id),
+            pair_id INTEGER NOT NULL REFERENCES {prefix}pair_results (id),
+            department_id INTEGER REFERENCES {prefix}departments (id),
+            severity INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (patient_id, pair_id)
+        ) WITHOUT ROWID
+    ''')
+
+def create_tables(conn):
+    """Creates the tables and the patient_safety_audit view if they do not exist."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS audit_runs (
+            id INTEGER PRIMARY KEY,
+            started_at TEXT NOT NULL,
+            finished_at TEXT,
+            status TEXT NOT NULL,
+            mode TEXT NOT NULL DEFAULT 'full',
+            change_id INTEGER,
+            literature_mode TEXT,
+            min_drugs INTEGER,
+            patients INTEGER,
+            pairs INTEGER,
+            rows INTEGER,
+            checkpoint_department TEXT,
+            checkpoint_patient_id INTEGER
+        )
+    ''')
+    create_result_tables(conn)
+    conn.execute(f'''
+        CREATE VIEW IF NOT EXISTS patient_safety_audit AS
+        SELECT
+            pp.patient_id,
+            pp.pair_id,
+            p.run_id,
+            d.name AS department,
+            pp.severity,
+            p.name AS patient_name,
+            p.age,
+            p.diagnosis,
+            p.medication_list,
+            r.drug_1,
+            r.drug_2,
+            r.citation_count,
+            r.literature_severity,
+            r.similarity,
+            r.structure_status,
+            r.structure_severity,
+            r.summary,
+            {risk.literature_sql("r.")} AS literature_risk,
+            {risk.structure_sql("r.")} AS biochem_risk
+        FROM patient_pairs pp
+        JOIN audited_patients p ON p.id = pp.patient_id
+        JOIN pair_results r ON r.id = pp.pair_id
+        JOIN departments d ON d.id = pp.department_id
+    ''')
+
+def create_indexes(conn):
+    """Builds the secondary indexes (cheaper after a bulk load than during it)."""
+    for name, target in INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+
+def _department_objects(conn):
+    """Department views, and department tables left by version 0 files."""
+    keep = set(RESULT_TABLES) | {STAGING_PREFIX + name for name in RESULT_TABLES}
+    keep |= {"audit_runs", "sqlite_sequence", "patient_safety_audit"}
+    return [
+        (name, kind)
+        for name, kind in conn.execute("SELECT name, type FROM sqlite_master WHERE type IN ('table', 'view')")
+        if name not in keep
+    ]
+
+def _upgrade_audit_runs(conn):
+    """Adds the RUN_COLUMNS missing from an older audit_runs table."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(audit_runs)")}
+    if not columns:
+        return
+    for name, definition in RUN_COLUMNS.items():
+        if name not in columns:
+            conn.execute(f"ALTER TABLE audit_runs ADD COLUMN {name} {definition}")
+
+def create_staging_tables(conn):
+    """Empty staging copies of the result tables, for a new full run."""
+    drop_staging_tables(conn)
+    create_result_tables(conn, STAGING_PREFIX)
+
+def drop_staging_tables(conn):
+    """Drops the staging tables of an abandoned full run."""
+    for name in RESULT_TABLES:
+        conn.execute(f"DROP TABLE IF EXISTS {STAGING_PREFIX}{name}")
+
+def has_staging_tables(conn):
+    """Whether a full run's staging tables exist (it has not completed)."""
+    return conn.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?", (f"{STAGING_PREFIX}pair_results",)
+    ).fetchone()[0] > 0
+
+def swap_in_staging(conn):
+    """
+    Replaces the result tables, their views and indexes by the staging
+    tables of a finished full run (in the caller's transaction, so readers
+    see either the old or the new results). Indexes and department views
+    are rebuilt by the caller.
+    """
+    for name, kind in _department_objects(conn):
+        conn.execute(f'DROP {kind.upper()} IF EXISTS "{name}"')
+    conn.execute("DROP VIEW IF EXISTS patient_safety_audit")
+    for name in RESULT_TABLES:
+        conn.execute(f"DROP TABLE IF EXISTS {name}")
+    for name in RESULT_TABLES:
+        conn.execute(f"ALTER TABLE {STAGING_PREFIX}{name} RENAME TO {name}")
+    create_tables(conn)
+
+def get_run(conn, run_id):
+    """An audit_runs row as a dict (None if there is no such run)."""
+    cursor = conn.execute("SELECT * FROM audit_runs WHERE id = ?", (run_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return dict(zip([column[0] for column in cursor.description], row))
+
+def latest_full_run(conn, completed=False):
+    """
+    The newest full run, or None. With `completed`, the newest one that
+    finished: the one the stored results belong to (a running or failed
+    run only has staging tables).
+    """
+    row = conn.execute(f'''
+        SELECT id FROM audit_runs WHERE mode = 'full' {"AND status = 'completed'" if completed else ""}
+        ORDER BY id DESC LIMIT 1
+    ''').fetchone()
+    return get_run(conn, row[0]) if row else None
+
+def last_completed_run(conn):
+    """
+    The newest completed run that recorded a change-log watermark.
+
+    Returns:
+        dict: id, change_id and min_drugs, or None.
+    """
+    row = conn.execute('''
+        SELECT id, change_id, min_drugs FROM audit_runs
+        WHERE status = 'completed' AND change_id IS NOT NULL
+        ORDER BY id DESC LIMIT 1
+    ''').fetchone()
+    if row is None:
+        return None
+    return {"id": row[0], "change_id": row[1], "min_drugs": row[2]}
+
+def create_department_views(conn):
+    """
+    One view per audited department with the columns of the former
+    department tables.
+
+    Returns:
+        list: View names.
+    """
+    views = []
+    departments = [row[0] for row in conn.execute(
+        "SELECT name FROM departments ORDER BY name"
+    )]
+    for department in departments:
+        view = department_table(department)
+        literal = department.replace("'", "''")
+        conn.execute(f'DROP VIEW IF EXISTS "{view}"')
+        conn.execute(f'''
+            CREATE VIEW "{view}" AS
+            SELECT
+                ROW_NUMBER() OVER (ORDER BY patient_id, pair_id) AS id,
+                patient_name,
+                age,
+                diagnosis,
+                medication_list,
+                drug_1,
+                drug_2,
+                literature_risk,
+                biochem_risk
+            FROM patient_safety_audit
+            WHERE department = '{literal}'
+        ''')
+        views.append(view)
+    return views
+
+def department_views(conn):
+    """Names of the department views in an audit database."""
+    return [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'view' AND name != 'patient_safety_audit' ORDER BY name"
+    )]
+
+def _import_department_tables(conn, tables):
+    """Moves the rows of version 0 department tables into the normalized store."""
+    now = datetime.datetime.now().isoformat(timespec="seconds")
+    run_id = conn.execute(
+        "INSERT INTO audit_runs (started_at, finished_at, status) VALUES (?, ?, 'imported')", (now, now)
+    ).lastrowid
+    pair_ids = {}
+    severities = {}
+    patient_ids = {}
+    department_ids = dict(conn.execute("SELECT name, id FROM departments"))
+    next_pair = conn.execute("SELECT COALESCE(MAX(id), 0) FROM pair_results").fetchone()[0]
+    next_patient = conn.execute("SELECT COALESCE(MAX(id), 0) FROM audited_patients").fetchone()[0]
+
+    for table in tables:
+        department = table.replace("_", " ")
+        if department not in department_ids:
+            department_ids[department] = conn.execute(
+                "INSERT INTO departments (name) VALUES (?)", (department,)
+            ).lastrowid
+        for name, age, diagnosis, medication_list, drug_1, drug_2, literature, structure in conn.execute(f'''
+            SELECT patient_name, age, diagnosis, medication_list, drug_1, drug_2, literature_risk, biochem_risk
+            FROM "{table}" ORDER BY id
+        ''').fetchall():
+            pair = tuple(sorted([drug_1, drug_2]))
+            if pair not in pair_ids:
+                next_pair += 1
+                pair_ids[pair] = next_pair
+                literature = risk.LiteratureResult.parse(literature or "")
+                structure = risk.StructureResult.parse(structure or "")
+                severities[pair] = risk.pair_severity(literature, structure)
+                conn.execute(INSERT_PAIR, pair_row(next_pair, pair[0], pair[1], literature, structure))
+
+            patient = (department, name, age, diagnosis, medication_list)
+            if patient not in patient_ids:
+                next_patient += 1
+                patient_ids[patient] = next_patient
+                conn.execute('''
+                    INSERT INTO audited_patients (id, run_id, name, age, department, diagnosis, medication_list)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (next_patient, run_id, name, age, department, diagnosis, medication_list))
+            conn.execute(
+                "INSERT OR IGNORE INTO patient_pairs (patient_id, pair_id, department_id, severity) VALUES (?, ?, ?, ?)",
+                (patient_ids[patient], pair_ids[pair], department_ids[department], severities[pair]),
+            )
+        conn.execute(f'DROP TABLE "{table}"')
+
+def _typed_pair_results(conn):
+    """Replaces the display-text pair_results of a version 1/2 file by typed columns."""
+    rows = conn.execute("SELECT id, drug_1, drug_2, literature_risk, biochem_risk FROM pair_results").fetchall()
+    conn.execute("DROP VIEW IF EXISTS patient_safety_audit")
+    conn.execute("DROP TABLE pair_results")
+    create_tables(conn)
+    severities = []
+    for pair_id, drug_1, drug_2, literature, structure in rows:
+        literature = risk.LiteratureResult.parse(literature or "")
+        structure = risk.StructureResult.parse(structure or "")
+        conn.execute(INSERT_PAIR, pair_row(pair_id, drug_1, drug_2, literature, structure))
+        severities.append((risk.pair_severity(literature, structure), pair_id))
+    return severities
+
+def _upgrade(conn):
+    """Brings a version 0 to 4 database to the current layout."""
+    _upgrade_audit_runs(conn)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if "patient_pairs" in tables:
+        severities = []
+        pair_columns = {row[1] for row in conn.execute("PRAGMA table_info(pair_results)")}
+        if "structure_status" not in pair_columns:
+            severities = _typed_pair_results(conn)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(patient_pairs)")}
+        if "department_id" not in columns:
+            create_tables(conn)
+            conn.execute("ALTER TABLE patient_pairs ADD COLUMN department_id INTEGER REFERENCES departments (id)")
+            conn.execute("ALTER TABLE patient_pairs ADD COLUMN severity INTEGER NOT NULL DEFAULT 0")
+            conn.execute("INSERT INTO departments (name) SELECT DISTINCT department FROM audited_patients")
+            conn.execute('''
+                UPDATE patient_pairs SET department_id = (
+                    SELECT d.id FROM audited_patients p JOIN departments d ON d.name = p.department
+                    WHERE p.id = patient_pairs.patient_id
+                )
+            ''')
+        conn.executemany("UPDATE patient_pairs SET severity = ? WHERE pair_id = ?", severities)
+
+    # Department views are rebuilt below; tables are version 0 data
+    legacy = []
+    for name, kind in _department_objects(conn):
+        if kind == "view":
+            conn.execute(f'DROP VIEW "{name}"')
+        else:
+            legacy.append(name)
+    create_tables(conn)
+    if legacy:
+        _import_department_tables(conn, sorted(legacy))
+    create_indexes(conn)
+    create_department_views(conn)
+
+def ensure_schema(conn):
+    """Creates or upgrades the schema in place (safe to call on every connect)."""
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
+
+    # BEGIN IMMEDIATE so two processes starting together upgrade only once
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            _upgrade(conn)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def connect(db_path=AUDIT_DB_PATH):
+    """Opens (and creates if needed) the audit database, upgrading older files first."""
+    conn = sqlite3.connect(db_path)
+    ensure_schema(conn)
+    return conn
+
+class SchemaOutdatedError(Exception):
+    """Raised when a read-only connection finds an audit database older than SCHEMA_VERSION."""
+
+def connect_readonly(db_path=AUDIT_DB_PATH):
+    """
+    Opens an existing audit database read-only, without upgrading it (for
+    the dashboards, which may run next to an audit that is writing).
+
+    Raises:
+        SchemaOutdatedError: The file predates SCHEMA_VERSION; running
+            this module (or an audit) upgrades it.
+    """
+    conn = sqlite3.connect(f"{pathlib.Path(db_path).resolve().as_uri()}?mode=ro", uri=True)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version < SCHEMA_VERSION:
+        conn.close()
+        raise SchemaOutdatedError(
+            f"{db_path} has audit schema version {version}, this version reads {SCHEMA_VERSION}. "
+            f"Upgrade it with `python3 scripts/audit_schema.py` or a new audit run."
+        )
+    return conn
+
+if __name__ == "__main__":
+    with connect() as conn:
+        runs = conn.execute("SELECT COUNT(*) FROM audit_runs").fetchone()[0]
+        pairs = conn.execute("SELECT COUNT(*) FROM pair_results").fetchone()[0]
+        views = department_views(conn)
+    print(f"Schema version {SCHEMA_VERSION}: {runs} runs, {pairs} pair results, {len(views)} department views.")
@@ -0,0 +1,275 @@
+import sqlite3
+import time
+import datetime
+import itertools
+
+import risk
+import audit_schema
+
+# ==========================================
+# AUDIT RESULT WRITER
+# ==========================================
+# Role: Write an audit run to the normalized store in audit_results.db
+# (see audit_schema.py) as fast as SQLite allows. Each unique drug pair is
+# written once to pair_results; patients only reference it by id in
+# patient_pairs. Rows are buffered and flushed with executemany in large
+# transactions, and secondary indexes and department views are built once
+# the load is finished.
+# A full run writes into staging tables (see audit_schema.py) that replace
+# the stored results in one transaction when it completes, so the previous
+# results stay readable while it runs and if it fails.
+# An incremental writer updates the stored results instead: it only adds
+# the pairs that are new to the store and replaces the given patients' rows.
+# Every flush also commits the run's checkpoint (the last patient written,
+# in reader order), so an interrupted full run can be resumed from there.
+# ==========================================
+
+# Rows buffered before a flush (one transaction each)
+FLUSH_ROWS = 100000
+
+# Longest time between checkpoints when rows arrive slowly (live PubMed)
+CHECKPOINT_SECONDS = 60
+
+BIOLOGICAL_RESULT = risk.StructureResult(risk.StructureStatus.BIOLOGICAL)
+NO_LITERATURE_RESULT = risk.LiteratureResult(risk.LiteratureSeverity.NONE, 0)
+NO_STRUCTURE_RESULT = risk.StructureResult(risk.StructureStatus.UNAVAILABLE)
+
+# Department (and view) of patients without one
+UNASSIGNED_DEPARTMENT = "Unassigned"
+
+class AuditWriter:
+    """
+    Buffered writer for one audit run. The previous results are replaced
+    when a full run closes (or, for an incremental run, updated); the run
+    is recorded in audit_runs.
+
+    Args:
+        path (str): Audit database.
+        drugs (dict): Drug dictionary {drug_id: {'name', ...}}.
+        literature_mode (str): Recorded with the run.
+        min_drugs (int): Recorded with the run.
+        change_id (int): patients.db change-log watermark the run covers.
+        incremental (bool): Keep the stored results; see remove_patients().
+        resume_run (int): Continue this interrupted full run (its staged
+            results are kept and checkpoint / counts restored) instead of
+            starting one.
+        flush_rows (int): Rows buffered per transaction.
+
+    Use as a context manager, or call close() to flush, index and finish
+    the run.
+    """
+
+    def __init__(self, path, drugs, literature_mode=None, min_drugs=None, change_id=None,
+                 incremental=False, resume_run=None, flush_rows=FLUSH_ROWS):
+        self.drugs = drugs
+        self.incremental = incremental
+        self.flush_rows = flush_rows
+        # (department, patient id) of the last patient committed
+        self.checkpoint = None
+        # (smaller drug id, larger drug id) -> pair_results id
+        self.pair_ids = {}
+        # pair_results id -> overall severity (index 0 unused)
+        self._severities = [None]
+        # department name -> departments id
+        self.department_ids = {}
+        self._departments = []
+        self.rows_written = 0
+        self.patients_written = 0
+        self.pairs_written = 0
+        self._pairs = []
+        self._patients = []
+        self._patient_pairs = []
+        self._removed = []
+        self._last_patient = None
+        self._flushed_at = time.monotonic()
+
+        # The pipeline opens the writer before handing it to its writer thread
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute("PRAGMA cache_size = -131072")  # 128 MB
+        self.conn.execute("PRAGMA temp_store = MEMORY")
+
+        # Result table name -> table this run writes to
+        prefix = "" if incremental else audit_schema.STAGING_PREFIX
+        self.tables = {name: prefix + name for name in audit_schema.RESULT_TABLES}
+        self._insert_pair = audit_schema.insert_pair_sql(prefix)
+
+        audit_schema.ensure_schema(self.conn)
+        self.conn.execute("BEGIN")
+        if incremental or resume_run is not None:
+            self._load_stored()
+        else:
+            audit_schema.create_staging_tables(self.conn)
+        if resume_run is not None:
+            self._resume(resume_run)
+        else:
+            self.run_id = self.conn.execute('''
+                INSERT INTO audit_runs (started_at, status, mode, change_id, literature_mode, min_drugs)
+                VALUES (?, 'running', ?, ?, ?, ?)
+            ''', (datetime.datetime.now().isoformat(timespec="seconds"), "incremental" if incremental else "full",
+                  change_id, literature_mode, min_drugs)).lastrowid
+        self.conn.execute("COMMIT")
+
+    def _resume(self, run_id):
+        """Restores the counts and checkpoint of an interrupted run and marks it running again."""
+        run = audit_schema.get_run(self.conn, run_id)
+        self.run_id = run_id
+        self.patients_written = run["patients"] or 0
+        self.pairs_written = run["pairs"] or 0
+        self.rows_written = run["rows"] or 0
+        if run["checkpoint_patient_id"] is not None:
+            self.checkpoint = (run["checkpoint_department"], run["checkpoint_patient_id"])
+        self.conn.execute(
+            "UPDATE audit_runs SET status = 'running', finished_at = NULL WHERE id = ?", (run_id,)
+        )
+
+    def _load_stored(self):
+        """Registers the stored (or, resuming, staged) pair results and departments."""
+        pair_results, departments = self.tables["pair_results"], self.tables["departments"]
+        drug_ids = {drug["name"]: drug_id for drug_id, drug in self.drugs.items()}
+        max_id = self.conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {pair_results}").fetchone()[0]
+        self._severities = [None] * (max_id + 1)
+        for pair_id, drug_1, drug_2, literature_severity, structure_severity in self.conn.execute(
+            f"SELECT id, drug_1, drug_2, literature_severity, structure_severity FROM {pair_results}"
+        ):
+            self._severities[pair_id] = risk.severity_of(literature_severity, structure_severity)
+            a, b = drug_ids.get(drug_1), drug_ids.get(drug_2)
+            if a is not None and b is not None:
+                self.pair_ids[(a, b) if a < b else (b, a)] = pair_id
+        self.department_ids = dict(self.conn.execute(f"SELECT name, id FROM {departments}"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self.conn is not None:
+            self.conn.execute(
+                "UPDATE audit_runs SET status = 'failed', finished_at = ? WHERE id = ?",
+                (datetime.datetime.now().isoformat(timespec="seconds"), self.run_id),
+            )
+            self.conn.close()
+            self.conn = None
+
+    def add_pair_results(self, results):
+        """
+        Buffers {(drug_id_a, drug_id_b): (LiteratureResult, StructureResult)}
+        results, once per pair.
+        """
+        for (a, b), (literature, structure) in results.items():
+            key = (a, b) if a < b else (b, a)
+            if key in self.pair_ids:
+                continue
+            pair_id = self.pair_ids[key] = len(self._severities)
+            literature = literature or NO_LITERATURE_RESULT
+            structure = structure or NO_STRUCTURE_RESULT
+            drug_1, drug_2 = sorted([self.drugs[a]["name"], self.drugs[b]["name"]])
+            self._severities.append(risk.pair_severity(literature, structure))
+            self._pairs.append(audit_schema.pair_row(pair_id, drug_1, drug_2, literature, structure))
+
+    def remove_patients(self, patient_ids):
+        """
+        Buffers deleting the stored rows of these patients (incremental
+        runs); patients re-added with add_patients() get fresh rows.
+        """
+        self._removed.extend((patient_id,) for patient_id in patient_ids)
+
+    def add_patients(self, patients):
+        """
+        Buffers each patient and its drug pairs. Every pair must already
+        have its result registered with add_pair_results().
+
+        Returns:
+            int: Number of patient-pair rows added.
+        """
+        added = 0
+        pair_ids, severities = self.pair_ids, self._severities
+        for patient in patients:
+            patient_id, department = patient["id"], patient["department"]
+            department_name = department or UNASSIGNED_DEPARTMENT
+            department_id = self.department_ids.get(department_name)
+            if department_id is None:
+                department_id = self.department_ids[department_name] = len(self.department_ids) + 1
+                self._departments.append((department_id, department_name))
+            self._patients.append((
+                patient_id, self.run_id, patient["name"], patient["age"],
+                department, patient["diagnosis"], ", ".join(patient["medications"]),
+            ))
+            ids = {pair_ids[(a, b) if a < b else (b, a)]
+                   for a, b in itertools.combinations(patient["drug_ids"], 2)}
+            self._patient_pairs.extend(
+                (patient_id, pair_id, department_id, severities[pair_id]) for pair_id in ids
+            )
+            added += len(ids)
+            self._last_patient = (department, patient_id)
+        if (len(self._patient_pairs) >= self.flush_rows
+                or time.monotonic() - self._flushed_at >= CHECKPOINT_SECONDS):
+            self.flush()
+        return added
+
+    def flush(self):
+        """Writes every buffered row, with the run's checkpoint and counts, in one transaction."""
+        self._flushed_at = time.monotonic()
+        if not (self._pairs or self._patients or self._removed):
+            return
+        checkpoint = self.checkpoint if self.incremental else self._last_patient or self.checkpoint
+        tables = self.tables
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.executemany(f"DELETE FROM {tables['patient_pairs']} WHERE patient_id = ?", self._removed)
+            self.conn.executemany(f"DELETE FROM {tables['audited_patients']} WHERE id = ?", self._removed)
+            self.conn.executemany(self._insert_pair, self._pairs)
+            self.conn.executemany(f'''
+                INSERT INTO {tables['audited_patients']} (id, run_id, name, age, department, diagnosis, medication_list)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', self._patients)
+            self.conn.executemany(f"INSERT INTO {tables['departments']} (id, name) VALUES (?, ?)", self._departments)
+            self.conn.executemany(
+                f"INSERT INTO {tables['patient_pairs']} (patient_id, pair_id, department_id, severity) "
+                "VALUES (?, ?, ?, ?)",
+                self._patient_pairs,
+            )
+            self.conn.execute('''
+                UPDATE audit_runs
+                SET patients = ?, pairs = ?, rows = ?, checkpoint_department = ?, checkpoint_patient_id = ?
+                WHERE id = ?
+            ''', (self.patients_written + len(self._patients), self.pairs_written + len(self._pairs),
+                  self.rows_written + len(self._patient_pairs), *(checkpoint or (None, None)), self.run_id))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.checkpoint = checkpoint
+        self.rows_written += len(self._patient_pairs)
+        self.patients_written += len(self._patients)
+        self.pairs_written += len(self._pairs)
+        self._pairs, self._patients, self._departments, self._patient_pairs = [], [], [], []
+        self._removed = []
+
+    def close(self):
+        """
+        Flushes, swaps in a full run's staged results, builds indexes and
+        views, finishes the run and closes the database (once).
+        """
+        if self.conn is None:
+            return
+        self.flush()
+        self.conn.execute("BEGIN")
+        if not self.incremental:
+            audit_schema.swap_in_staging(self.conn)
+        audit_schema.create_indexes(self.conn)
+        audit_schema.create_department_views(self.conn)
+        self.conn.execute('''
+            UPDATE audit_runs
+            SET status = 'completed', finished_at = ?, patients = ?, pairs = ?, rows = ?
+            WHERE id = ?
+        ''', (datetime.datetime.now().isoformat(timespec="seconds"),
+              self.patients_written, self.pairs_written, self.rows_written, self.run_id))
+        self.conn.execute("COMMIT")
+        # The replaced results' pages stay free for the next run's staging
+        # tables, so the file settles at about twice the results (no VACUUM)
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.conn.close()
+        self.conn = None
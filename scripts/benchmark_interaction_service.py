@@ -0,0 +1,90 @@
+import json
+import time
+import random
+import argparse
+import threading
+import http.client
+
+import numpy as np
+
+import database_agent
+import interaction_service
+
+# ==========================================
+# INTERACTION SERVICE BENCHMARK
+# ==========================================
+# Measures point-of-care check latency on random medication lists drawn
+# from the drug dictionary: the in-process check() call and the full HTTP
+# round trip through a local InteractionService (keep-alive connections,
+# one per client thread). Literature for unknown pairs is queued in the
+# background and never waited for, as at order entry.
+# ==========================================
+
+def medication_lists(drug_names, count, min_drugs, max_drugs, seed):
+    rng = random.Random(seed)
+    return [rng.sample(drug_names, rng.randint(min_drugs, min(max_drugs, len(drug_names))))
+            for _ in range(count)]
+
+def _client(host, port, lists, latencies):
+    conn = http.client.HTTPConnection(host, port)
+    try:
+        for medications in lists:
+            body = json.dumps({"medications": medications})
+            started = time.perf_counter()
+            conn.request("POST", "/check", body, {"Content-Type": "application/json"})
+            response = conn.getresponse()
+            response.read()
+            latencies.append((time.perf_counter() - started) * 1000)
+            assert response.status == 200
+    finally:
+        conn.close()
+
+def run(requests, clients, min_drugs, max_drugs, seed, literature_mode):
+    service = interaction_service.InteractionService(literature_mode=literature_mode)
+    names = sorted(drug["name"] for drug in database_agent.get_drug_dictionary().values())
+    lists = medication_lists(names, requests, min_drugs, max_drugs, seed)
+    print(f"Service warm in {service.load_seconds * 1000:.1f} ms: {len(service.literature)} literature, "
+          f"{len(service.structure)} structure results; {len(names)} drugs")
+
+    # Warm-up pass (first structure scores, cache connections per thread)
+    for medications in lists[:50]:
+        service.check(medications)
+
+    direct = []
+    for medications in lists:
+        started = time.perf_counter()
+        service.check(medications)
+        direct.append((time.perf_counter() - started) * 1000)
+
+    server = interaction_service.make_server(service, port=0)
+    host, port = server.server_address
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    latencies = []
+    threads = [threading.Thread(target=_client, args=(host, port, lists[i::clients], latencies))
+               for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    server.shutdown()
+    server.server_close()
+
+    print(f"{requests} checks of {min_drugs}-{max_drugs} drugs, {clients} HTTP clients "
+          f"({requests / wall:.0f} checks/s over HTTP)")
+    print(f"{'path':<22}{'p50 (ms)':>10}{'p99 (ms)':>10}")
+    for label, values in [("check()", direct), ("HTTP POST /check", latencies)]:
+        print(f"{label:<22}{np.percentile(values, 50):>10.3f}{np.percentile(values, 99):>10.3f}")
+    print(f"Literature pairs queued in the background: {service.health()['literature_queued']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the point-of-care interaction service.")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--min-drugs", type=int, default=3)
+    parser.add_argument("--max-drugs", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--literature-mode", choices=interaction_service.literature_agent.LITERATURE_MODES)
+    args = parser.parse_args()
+    run(args.requests, args.clients, args.min_drugs, args.max_drugs, args.seed, args.literature_mode)
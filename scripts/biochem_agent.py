@@ -1,16 +1,17 @@
-from rdkit import Chem
-from rdkit.Chem import DataStructs
-from rdkit.Chem import AllChem
-from rdkit import RDLogger
-import utils
+import os
 
-# Suppress RDKit warnings/logs to keep output clean
-RDLogger.DisableLog('rdApp.*')
+import risk
+import utils
+import fingerprint_registry
 
 # ==========================================
 # BIO-CHEMIST AGENT
 # ==========================================
 # Role: Perform structural analysis on drugs.
+# Structures are parsed and fingerprinted once per process by the
+# fingerprint registry (RDKit is only loaded when a structure is new).
+# Set DDI_STRUCTURE_CATALOG to a catalog built by structure_catalog.py to
+# score against a full formulary instead of DRUG_SMILES.
 # ==========================================
 
 # Dictionary mapping Drug Names to SMILES strings (Chemical Structures)
@@ -71,52 +72,157 @@ DRUG_SMILES = {
     "Calcium/Vit D": None # Not a small molecule in this context
 }
 
+# Morgan fingerprint settings. Stored with every cached score (with the
+# structure source, see cache_params()), so changing them invalidates the
+# cached structure results automatically.
+FINGERPRINT_PARAMS = {"type": "morgan", "radius": 2, "fpSize": 1024}
+
+# Directory of a prebuilt structure catalog; unset uses DRUG_SMILES
+STRUCTURE_CATALOG = os.environ.get("DDI_STRUCTURE_CATALOG")
+
+_registry = None
+_engine = None
+_similarity_index = None
+
+def get_registry():
+    """
+    Returns the process-wide structure source: the memory-mapped catalog
+    when DDI_STRUCTURE_CATALOG is set, else the registry for DRUG_SMILES.
+    """
+    global _registry
+    if _registry is None:
+        if STRUCTURE_CATALOG:
+            import structure_catalog
+            catalog = structure_catalog.StructureCatalog(STRUCTURE_CATALOG)
+            if catalog.params != FINGERPRINT_PARAMS:
+                raise ValueError(f"Structure catalog {STRUCTURE_CATALOG} was built with {catalog.params}, "
+                                 f"expected {FINGERPRINT_PARAMS}")
+            _registry = catalog
+        else:
+            _registry = fingerprint_registry.FingerprintRegistry.build(DRUG_SMILES, FINGERPRINT_PARAMS)
+    return _registry
+
+def cache_params():
+    """
+    Params structure cache entries are saved and looked up with: the
+    fingerprint settings and the identity of the structure source (the
+    DRUG_SMILES table's digest, or the catalog build), so scores from one
+    set of structures never answer for another.
+    """
+    return dict(FINGERPRINT_PARAMS, structures=get_registry().structure_source)
+
+def get_matrix_engine():
+    """Returns the vectorized Tanimoto engine over the registry (built once)."""
+    global _engine
+    if _engine is None:
+        import tanimoto_matrix
+        _engine = tanimoto_matrix.TanimotoMatrix.from_registry(get_registry())
+    return _engine
+
+def get_similarity_index():
+    """Returns the threshold / top-k search index over the registry (built once)."""
+    global _similarity_index
+    if _similarity_index is None:
+        import similarity_index
+        _similarity_index = similarity_index.SimilarityIndex.from_engine(get_matrix_engine())
+    return _similarity_index
+
 def analyze_structure_risk(drug1_name, drug2_name):
     """
     Calculates the Tanimoto Similarity between two drugs.
+
+    Returns:
+        StructureResult: The similarity, or why the pair was not scored
+        (str() gives the status message).
     """
     
     # Check cache first
-    _, chem_res = utils.get_cached_result(drug1_name, drug2_name)
-    if chem_res:
+    params = cache_params()
+    cached = utils.get_cached_entry(drug1_name, drug2_name, utils.STRUCTURE, params=params)
+    if cached:
         print(f"[Bio-Chemist Agent] Using cached result for {drug1_name} + {drug2_name}")
-        return chem_res
+        return _cached_result(cached)
 
-    # 1. Get SMILES strings
-    smi1 = DRUG_SMILES.get(drug1_name)
-    smi2 = DRUG_SMILES.get(drug2_name)
-    
-    if not smi1 or not smi2:
-        return "⚪ Data Unavailable (Complex/Missing structure)"
+    registry = get_registry()
+
+    # 1. Structures that cannot be scored were recorded when the registry was built
+    unscored = unscored_status(registry, drug1_name, drug2_name)
+    if unscored:
+        return unscored
         
     try:
-        # 2. Convert SMILES to RDKit Molecule objects
-        mol1 = Chem.MolFromSmiles(smi1)
-        mol2 = Chem.MolFromSmiles(smi2)
-        
-        if mol1 is None or mol2 is None:
-            return "⚪ Invalid chemical structure data"
-
-        # 3. Generate Fingerprints using the new Generator method to avoid warnings
-        # Old: BigMorgan (Deprecation warning) -> New: MorganGenerator
-        fpgen = AllChem.GetMorganGenerator(radius=2, fpSize=1024)
-        fp1 = fpgen.GetFingerprint(mol1)
-        fp2 = fpgen.GetFingerprint(mol2)
-        
-        # 4. Calculate Similarity
-        similarity = DataStructs.TanimotoSimilarity(fp1, fp2)
+        # 2. Calculate Similarity (Tanimoto on the precomputed Morgan fingerprints)
+        similarity = registry.similarity(drug1_name, drug2_name)
         
-        # 5. Evaluate Risk
-        if similarity > 0.4:
-            result = f"⚠️ HIGH STRUCTURAL SIMILARITY ({similarity:.2f}). Possible metabolic competition."
-        else:
-            result = f"✅ Low similarity ({similarity:.2f})."
+        # 3. Evaluate Risk
+        result = risk.StructureResult.scored(similarity)
             
-        utils.save_cached_result(drug1_name, drug2_name, None, result)
+        utils.save_cached_entry(drug1_name, drug2_name, utils.STRUCTURE, str(result),
+                                similarity=similarity, params=params)
         return result
             
     except Exception as e:
-        return f"Error in chemical analysis: {e}"
+        return risk.StructureResult.failure(f"Error in chemical analysis: {e}")
+
+def _cached_result(cached):
+    """Structure result of a cache entry (only scored pairs are cached)."""
+    return risk.StructureResult.parse(cached["status"], similarity=cached["similarity"])
+
+def unscored_status(registry, drug1_name, drug2_name):
+    """Result for a pair that cannot be scored (a structure missing or invalid in the registry), else None."""
+    statuses = (registry.status(drug1_name), registry.status(drug2_name))
+    if fingerprint_registry.STATUS_MISSING in statuses:
+        return risk.StructureResult(risk.StructureStatus.MISSING)
+    if fingerprint_registry.STATUS_INVALID in statuses:
+        return risk.StructureResult(risk.StructureStatus.INVALID)
+    return None
+
+def score_pairs(pairs, workers=1):
+    """
+    Structure risk for many drug pairs at once.
+    Cached pairs are answered from the cache; the rest are scored in one
+    vectorized pass (split over a process pool when workers > 1) and
+    cached in a single transaction.
+    
+    Args:
+        pairs (iterable): (drug1, drug2) tuples.
+        workers (int): Scoring processes; None uses every available CPU.
+        
+    Returns:
+        dict: Maps each (drug1, drug2) tuple to its StructureResult.
+    """
+    registry = get_registry()
+    params = cache_params()
+    results = {}
+    to_score = []
+    for drug1, drug2 in pairs:
+        cached = utils.get_cached_entry(drug1, drug2, utils.STRUCTURE, params=params)
+        if cached:
+            results[(drug1, drug2)] = _cached_result(cached)
+            continue
+        unscored = unscored_status(registry, drug1, drug2)
+        if unscored:
+            results[(drug1, drug2)] = unscored
+        else:
+            to_score.append((drug1, drug2))
+
+    if workers == 1:
+        similarities = get_matrix_engine().score_pairs(to_score)
+    else:
+        import parallel_scoring
+        similarities = parallel_scoring.score_pairs(get_matrix_engine(), to_score, workers)
+    entries = []
+    for (drug1, drug2), similarity in similarities.items():
+        result = risk.StructureResult.scored(similarity)
+        results[(drug1, drug2)] = result
+        entries.append({"drug1": drug1, "drug2": drug2, "source": utils.STRUCTURE,
+                        "status": str(result), "similarity": similarity,
+                        "params": params})
+    utils.save_cached_entries(entries)
+
+    print(f"[Bio-Chemist Agent] {len(results) - len(entries)} pairs cached or unscorable, "
+          f"{len(entries)} scored in one batch.")
+    return results
 
 # Simple test block
 if __name__ == "__main__":
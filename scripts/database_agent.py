@@ -1,85 +1,213 @@
-import sqlite3
+import patient_schema
 
 # ==========================================
 # DATABASE AGENT
 # ==========================================
 # Role: Identify patients who are at risk due to Polypharmacy.
 # Polypharmacy here is defined as taking 3 or more medications.
+# Patients are streamed in keyset-paginated batches ordered by
+# (department, id), so memory stays flat however large the hospital is.
 # ==========================================
 
 import os
 
-def get_at_risk_patients():
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_PATH = os.path.join(BASE_DIR, "outputs", "patients.db")
+
+# Minimum number of prescriptions that counts as polypharmacy
+MIN_DRUGS = 3
+
+# Patients fetched per query
+BATCH_SIZE = 1000
+
+def connect(db_path=DB_PATH):
+    """
+    Opens the patient database for reading, upgrading databases created
+    before the drug dictionary and indexes first (see patient_schema.py).
+    """
+    return patient_schema.connect(db_path)
+
+def _with_medications(conn, rows):
+    """
+    Patient dicts for (id, name, age, department, diagnosis) rows, with
+    their prescriptions. Prescriptions without a drug (no name to resolve,
+    see patient_schema.resolve_drug_ids) are left out.
+    """
+    medications = {row[0]: [] for row in rows}
+    drug_ids = {row[0]: [] for row in rows}
+    placeholders = ", ".join("?" * len(rows))
+    for prescription_id, patient_id, drug_name, drug_id in conn.execute(f'''
+        SELECT id, patient_id, drug_name, drug_id FROM prescriptions
+        WHERE patient_id IN ({placeholders})
+        ORDER BY patient_id, id
+    ''', list(medications)):
+        if drug_id is None:
+            print(f"[Database Agent] Skipping prescription {prescription_id} of patient {patient_id}: no drug name")
+            continue
+        medications[patient_id].append(drug_name)
+        drug_ids[patient_id].append(drug_id)
+
+    return [
+        {
+            "id": p_id,
+            "name": p_name,
+            "age": age,
+            "department": dept,
+            "diagnosis": diagnosis,
+            "medications": medications[p_id],
+            "drug_ids": drug_ids[p_id],
+        }
+        for p_id, p_name, age, dept, diagnosis in rows
+    ]
+
+def iter_patient_batches(batch_size=BATCH_SIZE, min_drugs=MIN_DRUGS, after=None, db_path=DB_PATH):
+    """
+    Streams polypharmacy patients in batches ordered by (department, id),
+    a missing department sorting as ''.
+
+    Args:
+        batch_size (int): Patients per batch (one query each).
+        min_drugs (int): Minimum number of prescriptions.
+        after (tuple): (department, patient_id) to resume after, exclusive.
+        db_path (str): Patient database.
+
+    Yields:
+        list: Patient dicts (id, name, age, department, diagnosis,
+        medications, drug_ids), medications being a list of names and
+        drug_ids the matching `drugs` table ids, in prescription order.
+    """
+    conn = connect(db_path)
+    try:
+        last_department, last_id = after or ("", 0)
+        last_department = last_department or ""
+        while True:
+            # Row-value comparison walks the (COALESCE(department, ''), id)
+            # index from the last key instead of re-reading skipped rows like
+            # OFFSET would; a NULL department would never compare greater.
+            # SQLite only seeks an expression index on the separate bound.
+            rows = conn.execute('''
+                SELECT p.id, p.name, p.age, p.department, p.diagnosis
+                FROM patients p
+                WHERE COALESCE(p.department, '') >= ?
+                  AND (COALESCE(p.department, ''), p.id) > (?, ?)
+                  AND (SELECT COUNT(*) FROM prescriptions pr WHERE pr.patient_id = p.id) >= ?
+                ORDER BY COALESCE(p.department, ''), p.id
+                LIMIT ?
+            ''', (last_department, last_department, last_id, min_drugs, batch_size)).fetchall()
+            if not rows:
+                return
+
+            yield _with_medications(conn, rows)
+            last_department, last_id = rows[-1][3] or "", rows[-1][0]
+    finally:
+        conn.close()
+
+def get_patients(patient_ids, min_drugs=MIN_DRUGS, db_path=DB_PATH):
+    """
+    The given patients that (still) take at least `min_drugs` medications,
+    as patient dicts (see iter_patient_batches). Deleted patients and
+    patients below the threshold are left out.
+    """
+    conn = connect(db_path)
+    try:
+        patients = []
+        patient_ids = list(patient_ids)
+        # Stays under SQLite's bound-parameter limit
+        for start in range(0, len(patient_ids), BATCH_SIZE):
+            chunk = patient_ids[start:start + BATCH_SIZE]
+            placeholders = ", ".join("?" * len(chunk))
+            rows = conn.execute(f'''
+                SELECT p.id, p.name, p.age, p.department, p.diagnosis
+                FROM patients p
+                WHERE p.id IN ({placeholders})
+                  AND (SELECT COUNT(*) FROM prescriptions pr WHERE pr.patient_id = p.id) >= ?
+                ORDER BY p.department, p.id
+            ''', chunk + [min_drugs]).fetchall()
+            if rows:
+                patients.extend(_with_medications(conn, rows))
+        return patients
+    finally:
+        conn.close()
+
+def get_change_watermark(db_path=DB_PATH):
+    """Id of the newest prescription change (see patient_schema.py)."""
+    conn = connect(db_path)
+    try:
+        return patient_schema.latest_change(conn)
+    finally:
+        conn.close()
+
+def get_changed_patients(after, until, db_path=DB_PATH):
+    """Ids of the patients whose prescriptions or record changed in (after, until]."""
+    conn = connect(db_path)
+    try:
+        return patient_schema.changed_patients(conn, after, until)
+    finally:
+        conn.close()
+
+def iter_at_risk_patients(batch_size=BATCH_SIZE, min_drugs=MIN_DRUGS, after=None, db_path=DB_PATH):
+    """Streams polypharmacy patients one at a time (see iter_patient_batches)."""
+    for batch in iter_patient_batches(batch_size, min_drugs, after, db_path):
+        yield from batch
+
+def count_at_risk_patients(min_drugs=MIN_DRUGS, db_path=DB_PATH):
+    """Number of patients with at least `min_drugs` prescriptions."""
+    conn = connect(db_path)
+    try:
+        return conn.execute('''
+            SELECT COUNT(*) FROM (
+                SELECT patient_id FROM prescriptions
+                GROUP BY patient_id
+                HAVING COUNT(*) >= ?
+            )
+        ''', (min_drugs,)).fetchone()[0]
+    finally:
+        conn.close()
+
+def get_drug_dictionary(db_path=DB_PATH):
     """
-    Connects to the database and runs a SQL query to find
-    patients taking more than 3 medications.
-    
+    The drugs table as {drug_id: {'name', 'is_biological', 'is_small_molecule'}}.
+    """
+    conn = connect(db_path)
+    try:
+        return patient_schema.load_drugs(conn)
+    finally:
+        conn.close()
+
+def refresh_drug_dictionary(drugs, patients, db_path=DB_PATH):
+    """
+    Reloads `drugs` (a get_drug_dictionary() result, in place) if the
+    patients take a drug registered after it was loaded, e.g. a new name
+    resolved while the audit was reading.
+
     Returns:
-        list: A list of tuples, where each tuple contains (patient_id, patient_name, list_of_drugs)
+        dict: `drugs`.
     """
-    
+    if any(drug_id not in drugs for patient in patients for drug_id in patient["drug_ids"]):
+        drugs.update(get_drug_dictionary(db_path))
+    return drugs
+
+def get_at_risk_patients(min_drugs=MIN_DRUGS):
+    """
+    Connects to the database and finds patients taking `min_drugs`
+    or more medications.
+    Loads every patient into memory; prefer iter_at_risk_patients() for
+    large databases.
+
+    Returns:
+        list: Patient dicts (id, name, age, department, diagnosis, medications)
+    """
+
     print("[Database Agent] Connecting to patient records...")
-    
-    # Define path to the database in 'outputs' folder
-    BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    DB_PATH = os.path.join(BASE_DIR, "outputs", "patients.db")
-    
-    # 1. Connect to the database
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # 2. SQL Query
-    # We join patients with prescriptions, group by patient, 
-    # and count the number of drugs.
-    # HAVING COUNT(drug_name) >= 3 filters for our polypharmacy definition.
-    query = '''
-        SELECT 
-            p.id, 
-            p.name, 
-            p.age,
-            p.department,
-            p.diagnosis,
-            GROUP_CONCAT(pr.drug_name, ', ') as medication_list
-        FROM patients p
-        JOIN prescriptions pr ON p.id = pr.patient_id
-        GROUP BY p.id
-        HAVING COUNT(pr.drug_name) >= 3
-        ORDER BY p.department
-    '''
-    
+
     try:
-        cursor.execute(query)
-        results = cursor.fetchall()
-        
-        # 3. Process results into a clean format
-        # The query returns medication_list as a string "DrugA, DrugB". 
-        # We'll split it into a proper Python list.
-        at_risk_patients = []
-        
-        for row in results:
-            p_id, p_name, age, dept, diagnosis, meds_str = row
-            meds_list = meds_str.split(', ') # Convert "A, B" -> ["A", "B"]
-            
-            # Store in a dictionary for easy access later
-            patient_data = {
-                "id": p_id,
-                "name": p_name,
-                "age": age,
-                "department": dept,
-                "diagnosis": diagnosis,
-                "medications": meds_list
-            }
-            at_risk_patients.append(patient_data)
-            
+        at_risk_patients = list(iter_at_risk_patients(min_drugs=min_drugs))
         print(f"[Database Agent] Found {len(at_risk_patients)} patients with polypharmacy risk.")
         return at_risk_patients
 
     except Exception as e:
         print(f"[Database Agent] Error: {e}")
         return []
-        
-    finally:
-        conn.close()
 
 # Simple test block to run this agent independently
 if __name__ == "__main__":
@@ -1,5 +1,10 @@
-import sqlite3
+import os
+import time
 import random
+import sqlite3
+import argparse
+
+import patient_schema
 
 # ==========================================
 # PART 1: DATA PREPARATION
@@ -48,10 +53,6 @@ department_data = {
     }
 }
 
-department_list = list(department_data.keys())
-
-import os
-
 # ==========================================
 # PART 2: DATABASE SETUP
 # ==========================================
@@ -60,117 +61,201 @@ import os
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DB_PATH = os.path.join(BASE_DIR, "outputs", "patients.db")
 
-conn = sqlite3.connect(DB_PATH)
-cursor = conn.cursor()
+# Default profile: the original 100-patient demo hospital
+DEFAULT_PATIENTS = 100
+DEFAULT_POLYPHARMACY_RATE = 0.55
 
-print("Creating database tables...")
+# Drug count -> relative weight, for polypharmacy and other patients
+DEFAULT_POLY_DRUG_COUNTS = {3: 1, 4: 1, 5: 1, 6: 1}
+DEFAULT_OTHER_DRUG_COUNTS = {1: 1, 2: 1}
 
-cursor.execute("DROP TABLE IF EXISTS prescriptions")
-cursor.execute("DROP TABLE IF EXISTS patients")
+# Patients generated (and inserted with one executemany) per batch
+INSERT_BATCH = 50000
 
-# Create 'patients' table with DEPARTMENT
-cursor.execute('''
-    CREATE TABLE patients (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        age INTEGER,
-        department TEXT,
-        diagnosis TEXT
-    )
-''')
-
-# Create 'prescriptions' table
-cursor.execute('''
-    CREATE TABLE prescriptions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        patient_id INTEGER,
-        drug_name TEXT,
-        FOREIGN KEY (patient_id) REFERENCES patients (id)
-    )
-''')
+def _open_fresh(db_path):
+    """Replaces any existing database with an empty one tuned for bulk loading."""
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    # Nothing to recover if a generated database is interrupted: skip the
+    # journal and fsyncs during the load and keep temporary b-trees in memory
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -262144")  # 256 MB
+    return conn
+
+def _cumulative(weights):
+    """(values, cumulative weights) for random.choices."""
+    values = list(weights)
+    total, cumulative = 0, []
+    for value in values:
+        total += weights[value]
+        cumulative.append(total)
+    return values, cumulative
 
 # ==========================================
 # PART 3: GENERATING AND INSERTING DATA
 # ==========================================
 
-print("Generating synthetic patient data with departments...")
-
-generated_names = set()
-total_patients = 100
-polypharmacy_count = 0
-
-for i in range(total_patients):
-    # 1. Unique Name
-    while True:
-        f_name = random.choice(first_names)
-        l_name = random.choice(last_names)
-        full_name = f"{f_name} {l_name}"
-        if full_name not in generated_names:
-            generated_names.add(full_name)
-            break
-    
-    # 2. Select Department
-    dept = random.choice(department_list)
-    
-    # 3. Age Logic based on Department
-    if dept == "Pediatrics":
-        age = random.randint(1, 17)
-    else:
-        age = random.randint(18, 90)
-    
-    # 4. Diagnosis Logic
-    dept_info = department_data[dept]
-    possible_diagnoses = dept_info["diagnoses"]
-    primary_diagnosis = random.choice(possible_diagnoses)
-    
-    # Insert patient
-    cursor.execute("INSERT INTO patients (name, age, department, diagnosis) VALUES (?, ?, ?, ?)", 
-                   (full_name, age, dept, primary_diagnosis))
-    patient_id = cursor.lastrowid
-    
-    # 5. Medications Logic (Polypharmacy enforcement)
-    # We need ~50 patients with >= 3 drugs.
-    
-    target_drug_count = 0
-    if polypharmacy_count < 55:
-        target_drug_count = random.randint(3, 6)
-        polypharmacy_count += 1
-    else:
-        target_drug_count = random.randint(1, 2)
-        
-    patient_meds = []
-    
-    # A. First, pick 1-2 drugs from their specific department
-    dept_meds = dept_info["medications"]
-    primary_meds_count = min(len(dept_meds), random.randint(1, 2))
-    patient_meds.extend(random.sample(dept_meds, k=primary_meds_count))
-    
-    # B. If we need more drugs for polypharmacy, pick from "General/Comorbidities"
-    # e.g., A Cardiology patient might also have Diabetes (Endo) or Pain (Ortho)
-    
-    all_possible_drugs = []
-    for d_key, d_val in department_data.items():
-        if d_key != "Pediatrics": # Don't give adult drugs to random fills unless carefully checked, but for simple demo:
-             all_possible_drugs.extend(d_val["medications"])
-    
-    # Remove duplicates from our master list
-    all_possible_drugs = list(set(all_possible_drugs))
-    
-    attempts = 0
-    while len(patient_meds) < target_drug_count and attempts < 20:
-        attempts += 1
-        random_drug = random.choice(all_possible_drugs)
-        if random_drug not in patient_meds:
-            patient_meds.append(random_drug)
-
-    # Insert prescriptions
-    for drug in patient_meds:
-        cursor.execute("INSERT INTO prescriptions (patient_id, drug_name) VALUES (?, ?)", 
-                       (patient_id, drug))
-
-conn.commit()
-conn.close()
-
-print(f"Successfully created {total_patients} patients.")
-print(f"Generated {polypharmacy_count} polypharmacy cases.")
-print("Database 'patients.db' ready.")
+def generate_hospital(db_path=DB_PATH, patients=DEFAULT_PATIENTS, seed=None,
+                      departments=None, polypharmacy_rate=DEFAULT_POLYPHARMACY_RATE,
+                      poly_drug_counts=None, other_drug_counts=None, profile=None):
+    """
+    Writes a synthetic hospital to `db_path`, replacing any existing file.
+
+    Args:
+        db_path (str): Output database.
+        patients (int): Number of patients.
+        seed (int): Random seed; the same seed and arguments always give
+            the same database. None is unseeded.
+        departments (dict): Department -> relative weight (default: every
+            department of the profile, equally likely).
+        polypharmacy_rate (float): Share of patients given 3+ drugs.
+        poly_drug_counts (dict): Drug count -> weight for those patients.
+        other_drug_counts (dict): Drug count -> weight for everyone else.
+        profile (dict): Department -> {'diagnoses', 'medications'} map
+            (default: department_data).
+
+    Returns:
+        dict: Counts of patients, polypharmacy patients and prescriptions.
+    """
+    profile = profile or department_data
+    departments = departments or {dept: 1 for dept in profile}
+    unknown = set(departments) - set(profile)
+    if unknown:
+        raise ValueError(f"Departments not in the profile: {sorted(unknown)}")
+
+    rng = random.Random(seed)
+    dept_values, dept_weights = _cumulative(departments)
+    poly_values, poly_weights = _cumulative(poly_drug_counts or DEFAULT_POLY_DRUG_COUNTS)
+    other_values, other_weights = _cumulative(other_drug_counts or DEFAULT_OTHER_DRUG_COUNTS)
+
+    # Comorbidity drugs can come from any department except Pediatrics
+    # (no adult drugs in random fills); sorted so a seed is reproducible
+    all_possible_drugs = sorted({
+        drug for d_key, d_val in profile.items() if d_key != "Pediatrics"
+        for drug in d_val["medications"]
+    })
+    full_names = [f"{f_name} {l_name}" for f_name in first_names for l_name in last_names]
+
+    started = time.time()
+    conn = _open_fresh(db_path)
+    conn.execute("BEGIN")
+    patient_schema.create_tables(conn)
+    drug_ids = patient_schema.register_drugs(
+        conn, sorted({drug for d_val in profile.values() for drug in d_val["medications"]})
+    )
+
+    # 1. Unique names while the first/last name combinations last
+    name_order = rng.sample(full_names, len(full_names))
+
+    polypharmacy_count = 0
+    prescription_id = 0
+    patient_rows, prescription_rows = [], []
+    for patient_id in range(1, patients + 1):
+        if patient_id <= len(name_order):
+            full_name = name_order[patient_id - 1]
+        else:
+            full_name = rng.choice(full_names)
+
+        # 2. Select Department
+        dept = rng.choices(dept_values, cum_weights=dept_weights)[0]
+        dept_info = profile[dept]
+
+        # 3. Age Logic based on Department
+        if dept == "Pediatrics":
+            age = rng.randint(1, 17)
+        else:
+            age = rng.randint(18, 90)
+
+        # 4. Diagnosis Logic
+        primary_diagnosis = rng.choice(dept_info["diagnoses"])
+        patient_rows.append((patient_id, full_name, age, dept, primary_diagnosis))
+
+        # 5. Medications Logic (Polypharmacy enforcement)
+        if rng.random() < polypharmacy_rate:
+            target_drug_count = rng.choices(poly_values, cum_weights=poly_weights)[0]
+            polypharmacy_count += 1
+        else:
+            target_drug_count = rng.choices(other_values, cum_weights=other_weights)[0]
+
+        # A. First, pick 1-2 drugs from their specific department
+        dept_meds = dept_info["medications"]
+        primary_meds_count = min(len(dept_meds), rng.randint(1, 2))
+        patient_meds = rng.sample(dept_meds, k=primary_meds_count)
+
+        # B. If we need more drugs for polypharmacy, pick from "General/Comorbidities"
+        # e.g., A Cardiology patient might also have Diabetes (Endo) or Pain (Ortho)
+        attempts = 0
+        while len(patient_meds) < target_drug_count and attempts < 20:
+            attempts += 1
+            random_drug = rng.choice(all_possible_drugs)
+            if random_drug not in patient_meds:
+                patient_meds.append(random_drug)
+
+        for drug in patient_meds:
+            prescription_id += 1
+            prescription_rows.append((prescription_id, patient_id, drug, drug_ids[drug]))
+
+        if len(patient_rows) >= INSERT_BATCH:
+            _insert(conn, patient_rows, prescription_rows)
+            patient_rows, prescription_rows = [], []
+
+    _insert(conn, patient_rows, prescription_rows)
+
+    # Indexes are built once, after the load
+    patient_schema.finish_load(conn)
+    conn.execute("COMMIT")
+    conn.execute("PRAGMA journal_mode = DELETE")
+    conn.close()
+
+    print(f"Successfully created {patients} patients ({prescription_id} prescriptions) "
+          f"in {time.time() - started:.1f}s.")
+    print(f"Generated {polypharmacy_count} polypharmacy cases.")
+    return {"patients": patients, "polypharmacy": polypharmacy_count, "prescriptions": prescription_id}
+
+def _insert(conn, patient_rows, prescription_rows):
+    conn.executemany(
+        "INSERT INTO patients (id, name, age, department, diagnosis) VALUES (?, ?, ?, ?, ?)",
+        patient_rows,
+    )
+    conn.executemany(
+        "INSERT INTO prescriptions (id, patient_id, drug_name, drug_id) VALUES (?, ?, ?, ?)",
+        prescription_rows,
+    )
+
+def _parse_weights(text, key=str):
+    """Parses 'a=2,b=1' into {key('a'): 2.0, key('b'): 1.0}."""
+    weights = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        weights[key(name.strip())] = float(weight) if weight else 1.0
+    return weights
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the synthetic hospital database.")
+    parser.add_argument("--patients", type=int, default=DEFAULT_PATIENTS)
+    parser.add_argument("--seed", type=int, help="Random seed for a reproducible database")
+    parser.add_argument("--departments",
+                        help="Department mix, e.g. 'Cardiology=3,Neurology=1' (default: all, equally)")
+    parser.add_argument("--polypharmacy-rate", type=float, default=DEFAULT_POLYPHARMACY_RATE)
+    parser.add_argument("--poly-drug-counts",
+                        help="Drug-count weights for polypharmacy patients, e.g. '3=4,4=3,5=2,6=1'")
+    parser.add_argument("--other-drug-counts",
+                        help="Drug-count weights for other patients, e.g. '1=2,2=1'")
+    parser.add_argument("--output", default=DB_PATH)
+    args = parser.parse_args()
+
+    print("Generating synthetic patient data with departments...")
+    generate_hospital(
+        db_path=args.output,
+        patients=args.patients,
+        seed=args.seed,
+        departments=_parse_weights(args.departments) if args.departments else None,
+        polypharmacy_rate=args.polypharmacy_rate,
+        poly_drug_counts=_parse_weights(args.poly_drug_counts, int) if args.poly_drug_counts else None,
+        other_drug_counts=_parse_weights(args.other_drug_counts, int) if args.other_drug_counts else None,
+    )
+    print(f"Database '{os.path.basename(args.output)}' ready.")
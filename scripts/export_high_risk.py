@@ -1,6 +1,9 @@
 import sqlite3
 import datetime
 
+import risk
+import audit_schema
+
 # ==========================================
 # HIGH RISK EXPORT CAPABILITY
 # ==========================================
@@ -8,6 +11,8 @@ import datetime
 # a separate file containing ONLY High-Risk patients.
 # High Risk is defined as a KNOWN RISK in literature
 # or HIGH STRUCTURAL SIMILARITY in chemistry.
+# Both files hold a `patient_safety_audit` table (a view in the audit
+# database) with the department as a column.
 # ==========================================
 
 def export_high_risk_patients():
@@ -16,76 +21,89 @@ def export_high_risk_patients():
     INPUT_DB = os.path.join(BASE_DIR, "outputs", "audit_results.db")
     OUTPUT_DB = os.path.join(BASE_DIR, "outputs", "high_risk_patients.db")
     
+    conn = None
     try:
-        conn = sqlite3.connect(INPUT_DB)
+        # Upgrades audit databases written before the unified audit view
+        conn = audit_schema.connect(INPUT_DB)
         cursor = conn.cursor()
-        # Get all tables in the database
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = [row[0] for row in cursor.fetchall() if row[0] != "sqlite_sequence"]
-        
+
         print(f"Connecting to output database '{OUTPUT_DB}'...")
         hr_conn = sqlite3.connect(OUTPUT_DB)
         hr_cursor = hr_conn.cursor()
-        
+
+        # Drop old tables (including per-department ones) to avoid duplicates
+        hr_cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name != 'sqlite_sequence';")
+        for (table,) in hr_cursor.fetchall():
+            hr_cursor.execute(f'DROP TABLE "{table}"')
+
+        hr_cursor.execute('''
+            CREATE TABLE patient_safety_audit (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                department TEXT,
+                run_id INTEGER,
+                severity INTEGER,
+                patient_name TEXT,
+                age INTEGER,
+                diagnosis TEXT,
+                drug_1 TEXT,
+                drug_2 TEXT,
+                citation_count INTEGER,
+                literature_severity INTEGER,
+                similarity REAL,
+                structure_status INTEGER,
+                structure_severity INTEGER,
+                literature_risk TEXT,
+                biochem_risk TEXT,
+                detected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # One range scan of the (severity, department) index for every department
+        cursor.execute('''
+            SELECT
+                department,
+                run_id,
+                severity,
+                patient_name,
+                age,
+                diagnosis,
+                drug_1,
+                drug_2,
+                citation_count,
+                literature_severity,
+                similarity,
+                structure_status,
+                structure_severity,
+                literature_risk,
+                biochem_risk
+            FROM patient_safety_audit
+            WHERE severity >= ?
+            ORDER BY department, patient_id, pair_id
+        ''', (risk.Severity.HIGH,))
+
         total_high_risk = 0
-        
-        for table in tables:
-            print(f"Scanning department: {table}...")
-            
-            # Query for high risk interactions in this specific table
-            query = f'''
-                SELECT 
-                    patient_name, 
-                    age, 
-                    diagnosis, 
-                    drug_1, 
-                    drug_2, 
-                    literature_risk, 
-                    biochem_risk
-                FROM {table}
-                WHERE literature_risk LIKE '%KNOWN RISK%'
-                   OR biochem_risk LIKE '%HIGH STRUCTURAL SIMILARITY%'
-            '''
-            
-            cursor.execute(query)
-            high_risk_results = cursor.fetchall()
-            
-            if high_risk_results:
-                total_high_risk += len(high_risk_results)
-                
-                # Drop old table to avoid duplicates
-                hr_cursor.execute(f"DROP TABLE IF EXISTS {table}")
-                
-                # Create corresponding table in the new DB
-                hr_cursor.execute(f'''
-                    CREATE TABLE {table} (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        patient_name TEXT,
-                        age INTEGER,
-                        diagnosis TEXT,
-                        drug_1 TEXT,
-                        drug_2 TEXT,
-                        literature_risk TEXT,
-                        biochem_risk TEXT,
-                        detected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                
-                # Insert the data
-                for row in high_risk_results:
-                    hr_cursor.execute(f'''
-                        INSERT INTO {table} 
-                        (patient_name, age, diagnosis, drug_1, drug_2, literature_risk, biochem_risk)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', row)
-        
+        while True:
+            high_risk_results = cursor.fetchmany(10000)
+            if not high_risk_results:
+                break
+            total_high_risk += len(high_risk_results)
+            hr_cursor.executemany('''
+                INSERT INTO patient_safety_audit
+                (department, run_id, severity, patient_name, age, diagnosis, drug_1, drug_2, citation_count,
+                 literature_severity, similarity, structure_status, structure_severity, literature_risk, biochem_risk)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', high_risk_results)
+
+        hr_cursor.execute("CREATE INDEX idx_patient_safety_audit_department ON patient_safety_audit (department, severity)")
+        hr_cursor.execute("CREATE INDEX idx_patient_safety_audit_literature ON patient_safety_audit (literature_severity)")
+
         hr_conn.commit()
         hr_conn.close()
         
         if total_high_risk == 0:
             print("No high-risk patients found in any department. Awesome!")
         else:
-            print(f"\nSuccessfully generated {OUTPUT_DB} with data separated by department tables.")
+            print(f"\nSuccessfully generated {OUTPUT_DB} (table patient_safety_audit, indexed by department).")
             print(f"Total High-Risk Interactions Found: {total_high_risk}")
                 
     except sqlite3.Error as e:
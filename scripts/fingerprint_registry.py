@@ -0,0 +1,203 @@
+import os
+import struct
+import hashlib
+
+# ==========================================
+# FINGERPRINT REGISTRY
+# ==========================================
+# Role: Parse and fingerprint every drug structure once per process.
+# Fingerprints are kept as Python ints (bit i = Morgan bit i), so scoring
+# a pair is an AND and two popcounts. The registry is persisted to a
+# versioned binary file keyed by SMILES hash and fingerprint parameters,
+# so repeat runs do not parse SMILES (or even import RDKit) at all.
+# ==========================================
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REGISTRY_PATH = os.path.join(BASE_DIR, "outputs", "fingerprints.bin")
+
+# File layout (little-endian):
+#   header: magic, format version, radius, fpSize, entry count
+#   entry:  sha1(SMILES), status byte, fpSize/8 fingerprint bytes
+FORMAT_MAGIC = b"DDIFP"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<5sHHII")
+_ENTRY_HEAD = struct.Struct("<20sB")
+
+# Structure status codes
+STATUS_OK = 0
+STATUS_MISSING = 1   # No SMILES (biological, mixture, unknown drug)
+STATUS_INVALID = 2   # SMILES that RDKit cannot parse
+
+if hasattr(int, "bit_count"):
+    popcount = int.bit_count
+else:  # Python < 3.10
+    def popcount(value):
+        return bin(value).count("1")
+
+def smiles_hash(smiles):
+    """Stable 20-byte key for a SMILES string."""
+    return hashlib.sha1(smiles.encode("utf-8")).digest()
+
+def tanimoto(fp1, fp2):
+    """Tanimoto similarity of two int fingerprints (0.0 if both are empty)."""
+    common = popcount(fp1 & fp2)
+    union = popcount(fp1) + popcount(fp2) - common
+    return common / union if union else 0.0
+
+def fingerprint_smiles(smiles_list, params):
+    """
+    Parses and fingerprints SMILES with RDKit.
+    Returns a list of (status, int fingerprint or None).
+    """
+    from rdkit import Chem
+    from rdkit import RDLogger
+    from rdkit.Chem import AllChem
+
+    # Suppress RDKit warnings/logs to keep output clean
+    RDLogger.DisableLog('rdApp.*')
+    fpgen = AllChem.GetMorganGenerator(radius=params["radius"], fpSize=params["fpSize"])
+
+    results = []
+    for smiles in smiles_list:
+        try:
+            mol = Chem.MolFromSmiles(smiles)
+        except Exception:
+            mol = None
+        if mol is None:
+            results.append((STATUS_INVALID, None))
+            continue
+        bits = fpgen.GetFingerprint(mol).ToBitString()
+        # ToBitString() lists bit 0 first; reverse so bit i is 2**i
+        results.append((STATUS_OK, int(bits[::-1], 2)))
+    return results
+
+def _load_file(path, params):
+    """
+    Reads a registry file written with the same parameters.
+    Returns {smiles_hash: (status, fingerprint)}; empty if absent, stale or corrupt.
+    """
+    if not os.path.exists(path):
+        return {}
+
+    n_bytes = params["fpSize"] // 8
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, radius, fp_size, count = _HEADER.unpack_from(data, 0)
+    except (IOError, struct.error):
+        return {}
+    if (magic, version, radius, fp_size) != (FORMAT_MAGIC, FORMAT_VERSION, params["radius"], params["fpSize"]):
+        return {}
+
+    entries = {}
+    offset = _HEADER.size
+    try:
+        for _ in range(count):
+            key, status = _ENTRY_HEAD.unpack_from(data, offset)
+            offset += _ENTRY_HEAD.size
+            fp_bytes = data[offset:offset + n_bytes]
+            if len(fp_bytes) != n_bytes:
+                return {}
+            offset += n_bytes
+            entries[key] = (status, int.from_bytes(fp_bytes, "little") if status == STATUS_OK else None)
+    except struct.error:
+        return {}
+    return entries
+
+def _save_file(path, params, entries):
+    """Writes {smiles_hash: (status, fingerprint)} atomically (temp file + rename)."""
+    n_bytes = params["fpSize"] // 8
+    chunks = [_HEADER.pack(FORMAT_MAGIC, FORMAT_VERSION, params["radius"], params["fpSize"], len(entries))]
+    for key, (status, fp) in sorted(entries.items()):
+        chunks.append(_ENTRY_HEAD.pack(key, status))
+        chunks.append(fp.to_bytes(n_bytes, "little") if fp is not None else bytes(n_bytes))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(b"".join(chunks))
+    os.replace(tmp_path, path)
+
+class FingerprintRegistry:
+    """
+    Fingerprints of a fixed set of named structures.
+
+    Build with `FingerprintRegistry.build(name_to_smiles, params)`. Names
+    without SMILES are recorded as STATUS_MISSING and unparsable SMILES as
+    STATUS_INVALID, up front, so scoring never has to handle them again.
+    """
+
+    def __init__(self, params, names, statuses, fingerprints, structure_source=None):
+        self.params = dict(params)
+        # Identity of the structures behind the fingerprints (see build())
+        self.structure_source = structure_source
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.statuses = list(statuses)
+        self.fingerprints = list(fingerprints)
+        self.bit_counts = [popcount(fp) if fp is not None else 0 for fp in self.fingerprints]
+
+    @classmethod
+    def build(cls, name_to_smiles, params, path=REGISTRY_PATH):
+        """
+        Builds the registry, reusing fingerprints stored in `path` and
+        fingerprinting (then saving) only structures not seen before.
+        Pass path=None to skip the on-disk cache.
+        """
+        stored = _load_file(path, params) if path else {}
+
+        names = list(name_to_smiles)
+        keys = {}
+        to_compute = {}
+        for name in names:
+            smiles = name_to_smiles[name]
+            if smiles:
+                key = smiles_hash(smiles)
+                keys[name] = key
+                if key not in stored:
+                    to_compute[key] = smiles
+
+        if to_compute:
+            computed = fingerprint_smiles(list(to_compute.values()), params)
+            stored.update(zip(to_compute.keys(), computed))
+            if path:
+                _save_file(path, params, stored)
+
+        statuses, fingerprints = [], []
+        for name in names:
+            status, fp = stored[keys[name]] if name in keys else (STATUS_MISSING, None)
+            statuses.append(status)
+            fingerprints.append(fp)
+        digest = hashlib.sha1(repr(sorted(name_to_smiles.items())).encode("utf-8")).hexdigest()
+        return cls(params, names, statuses, fingerprints, {"smiles_digest": digest})
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.names)
+
+    def status(self, name):
+        """STATUS_OK, STATUS_MISSING (also for unknown names) or STATUS_INVALID."""
+        i = self.index.get(name)
+        return self.statuses[i] if i is not None else STATUS_MISSING
+
+    def fingerprint(self, name):
+        """The int fingerprint of a structure, or None."""
+        i = self.index.get(name)
+        return self.fingerprints[i] if i is not None else None
+
+    def packed(self):
+        """(names, (n, fpSize/64) uint64 bit matrix, valid mask, bit counts) for the batch engines."""
+        import numpy as np
+        from tanimoto_matrix import pack_fingerprints
+        bits = pack_fingerprints(self.fingerprints, self.params["fpSize"])
+        valid = np.array([status == STATUS_OK for status in self.statuses], dtype=bool)
+        return self.names, bits, valid, np.array(self.bit_counts, dtype=np.int64)
+
+    def similarity(self, name1, name2):
+        """Tanimoto similarity of two registered structures (both must be STATUS_OK)."""
+        i, j = self.index[name1], self.index[name2]
+        common = popcount(self.fingerprints[i] & self.fingerprints[j])
+        union = self.bit_counts[i] + self.bit_counts[j] - common
+        return common / union if union else 0.0
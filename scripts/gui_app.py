@@ -1,16 +1,21 @@
 import tkinter as tk
 from tkinter import ttk
 import customtkinter as ctk
-import sqlite3
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import os
 
+import risk
+import audit_schema
+
 # Set appearance and theme to match Streamlit light mode
 ctk.set_appearance_mode("light")
 ctk.set_default_color_theme("blue")
 
+# Rows shown in the audit log table (a large audit has millions)
+MAX_TABLE_ROWS = 5000
+
 class DDIAuditorGUI(ctk.CTk):
     def __init__(self):
         super().__init__()
@@ -19,8 +24,11 @@ class DDIAuditorGUI(ctk.CTk):
         self.geometry("1400x900")
 
         # Configuration & State
-        self.df = pd.DataFrame()
+        self.departments = []
         self.filtered_df = pd.DataFrame()
+        self.summary = {}
+        self.dept_counts = pd.Series(dtype=int)
+        self.top_drugs = pd.Series(dtype=int)
         
         BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         self.db_path = os.path.join(BASE_DIR, "outputs", "audit_results.db")
@@ -192,55 +200,89 @@ class DDIAuditorGUI(ctk.CTk):
             return
 
         try:
-            conn = sqlite3.connect(self.db_path)
+            # Read-only: an out-of-date file is reported, not upgraded under a running audit
+            conn = audit_schema.connect_readonly(self.db_path)
             cursor = conn.cursor()
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-            tables = [row[0] for row in cursor.fetchall() if row[0] != "sqlite_sequence"]
-            
-            df_list = []
-            for table in tables:
-                df_temp = pd.read_sql_query(f"SELECT *, '{table.replace('_', ' ')}' as Department FROM {table}", conn)
-                df_list.append(df_temp)
-            
+            cursor.execute("SELECT name FROM departments ORDER BY name;")
+            self.departments = [row[0] for row in cursor.fetchall()]
             conn.close()
             
-            if df_list:
-                self.df = pd.concat(df_list, ignore_index=True)
-                # Calculate high risk Boolean
-                self.df['Is_High_Risk'] = self.df['literature_risk'].str.contains('KNOWN RISK', na=False) | \
-                                         self.df['biochem_risk'].str.contains('HIGH STRUCTURAL SIMILARITY', na=False)
-                
+            if self.departments:
                 # Update Filter Dropdown
-                depts = ["All"] + sorted(self.df['Department'].unique().tolist())
+                depts = ["All"] + self.departments
                 self.dept_selector.configure(values=depts)
                 
                 self.apply_filters()
+        except audit_schema.SchemaOutdatedError as e:
+            self.metric_widgets["Total Patients Audited"].configure(text="Err: Old Schema")
+            print(f"Error loading data: {e}")
         except Exception as e:
             print(f"Error loading data: {e}")
 
     def apply_filters(self, *args):
-        if self.df.empty: return
+        if not self.departments: return
         
-        filtered = self.df.copy()
+        # Filters run in SQL on the indexed department / severity columns;
+        # metrics and charts are aggregated there, only the table rows are loaded
+        conditions, params = [], []
         
         # Dept Filter
         dept = self.dept_selector.get()
         if dept != "All":
-            filtered = filtered[filtered['Department'] == dept]
+            conditions.append("department = ?")
+            params.append(dept)
             
         # High Risk Filter
         if self.high_risk_var.get():
-            filtered = filtered[filtered['Is_High_Risk'] == True]
+            conditions.append("severity >= ?")
+            params.append(risk.Severity.HIGH)
+            
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        high_risk = where + (" AND " if conditions else " WHERE ") + f"severity >= {risk.Severity.HIGH:d}"
+        
+        try:
+            conn = audit_schema.connect_readonly(self.db_path)
+            summary = conn.execute(f"""
+                SELECT COUNT(DISTINCT patient_id), COUNT(*),
+                       COALESCE(SUM(severity >= {risk.Severity.HIGH:d}), 0),
+                       COUNT(DISTINCT CASE WHEN severity >= {risk.Severity.HIGH:d} THEN patient_id END)
+                FROM patient_safety_audit{where}
+            """, params).fetchone()
+            dept_counts = conn.execute(f"""
+                SELECT department, COUNT(*) FROM patient_safety_audit{high_risk}
+                GROUP BY department ORDER BY department
+            """, params).fetchall()
+            top_drugs = conn.execute(f"""
+                SELECT drug, COUNT(*) AS involvement FROM (
+                    SELECT drug_1 AS drug FROM patient_safety_audit{high_risk}
+                    UNION ALL
+                    SELECT drug_2 FROM patient_safety_audit{high_risk}
+                )
+                GROUP BY drug ORDER BY involvement DESC LIMIT 10
+            """, params * 2).fetchall()
+            filtered = pd.read_sql_query(f"""
+                SELECT patient_name, age, department AS Department, diagnosis, drug_1, drug_2,
+                       literature_risk, biochem_risk
+                FROM patient_safety_audit{where}
+                LIMIT ?
+            """, conn, params=params + [MAX_TABLE_ROWS])
+            conn.close()
+        except Exception as e:
+            print(f"Error loading data: {e}")
+            return
             
+        self.summary = dict(zip(["patients", "interactions", "high_risk", "high_risk_patients"], summary))
+        self.dept_counts = pd.Series(dict(dept_counts), dtype=int)
+        self.top_drugs = pd.Series(dict(top_drugs), dtype=int)
         self.filtered_df = filtered
         self.update_ui()
 
     def update_ui(self):
         # 1. Update Executive Summary Metrics
-        total_p = self.filtered_df['patient_name'].nunique()
-        total_a = len(self.filtered_df)
-        risks = self.filtered_df['Is_High_Risk'].sum()
-        risk_patients = self.filtered_df[self.filtered_df['Is_High_Risk']]['patient_name'].nunique()
+        total_p = self.summary["patients"]
+        total_a = self.summary["interactions"]
+        risks = self.summary["high_risk"]
+        risk_patients = self.summary["high_risk_patients"]
         
         self.metric_widgets["Total Patients Audited"].configure(text=str(total_p))
         self.metric_widgets["Drug Pairs Checked"].configure(text=str(total_a))
@@ -281,8 +323,8 @@ class DDIAuditorGUI(ctk.CTk):
             self.tree.insert('', tk.END, values=values, tags=tags)
 
     def render_charts(self):
-        # Get risk dataframe
-        df_risk = self.filtered_df[self.filtered_df['Is_High_Risk']]
+        # High-risk counts per department and top drugs, aggregated in SQL
+        dept_counts, top_drugs = self.dept_counts, self.top_drugs
         
         # Dept Chart (Vertical Bar) - Match Streamlit style
         for w in self.dept_chart_frame.winfo_children(): w.destroy()
@@ -292,8 +334,7 @@ class DDIAuditorGUI(ctk.CTk):
         fig1.patch.set_facecolor('white')
         ax1.set_facecolor('white')
         
-        if not df_risk.empty:
-            dept_counts = df_risk.groupby("Department").size()
+        if not dept_counts.empty:
             # Plotly styling: vertical bars, multi-colored
             colors = ['#1f77b4', '#99ccff', '#ff3333', '#ff9999', '#2ca02c', '#98df8a', '#d62728']
             colors = colors * (len(dept_counts) // len(colors) + 1) # Repeat if necessary
@@ -333,9 +374,7 @@ class DDIAuditorGUI(ctk.CTk):
         fig2.patch.set_facecolor('white')
         ax2.set_facecolor('white')
         
-        if not df_risk.empty:
-            drugs = pd.concat([df_risk['drug_1'], df_risk['drug_2']])
-            top_drugs = drugs.value_counts().head(10)
+        if not top_drugs.empty:
             
             # Title removed from map frame since UI provides it
             # Plotly default colors
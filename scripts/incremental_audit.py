@@ -0,0 +1,125 @@
+import os
+import time
+import datetime
+import itertools
+
+import utils
+import database_agent
+import literature_agent
+import biochem_agent
+import audit_schema
+import audit_writer
+import interaction_matrix
+
+# ==========================================
+# INCREMENTAL AUDIT
+# ==========================================
+# Role: Bring audit_results.db up to date with the prescription changes
+# logged in patients.db since the last completed run (see
+# patient_schema.py), instead of re-auditing the whole hospital:
+#   1. the changed patients are read from the change log after the last
+#      run's watermark,
+#   2. only their drug pairs that are not in the audit store yet go to the
+#      Literature and Bio-Chemist agents (whose caches still apply),
+#   3. their rows are deleted and rewritten in the audit store; patients
+#      that were deleted or dropped below the threshold just disappear.
+# The work scales with the day's churn, not with the hospital's size.
+# Stored pair results are reused, so once the last full run is older than
+# the literature cache TTL a full audit is run instead, refreshing them.
+# ==========================================
+
+def _full_audit_reason(audit_db_path, min_drugs, db_path):
+    """Why the audit store cannot be updated incrementally (None if it can), and the last run."""
+    if not os.path.exists(audit_db_path):
+        return "no audit database yet", None
+    conn = audit_schema.connect(audit_db_path)
+    try:
+        last_run = audit_schema.last_completed_run(conn)
+        full_run = audit_schema.latest_full_run(conn)
+    finally:
+        conn.close()
+    if full_run and full_run["status"] in ("running", "failed"):
+        # The store holds a partial full run
+        return f"run {full_run['id']} did not finish", None
+    if last_run is None:
+        return "no completed run with a change watermark", None
+    if last_run["min_drugs"] != min_drugs:
+        return f"the last run used min_drugs={last_run['min_drugs']}", None
+    ttl = utils.CACHE_TTL[utils.LITERATURE]
+    if ttl is not None and full_run is not None:
+        age = time.time() - datetime.datetime.fromisoformat(full_run["started_at"]).timestamp()
+        if age > ttl:
+            return (f"the stored literature results are {age / 86400:.0f} days old "
+                    f"(literature TTL {ttl / 86400:.0f} days)"), None
+    if database_agent.get_change_watermark(db_path) < last_run["change_id"]:
+        # A regenerated patients.db starts a new, shorter change log
+        return "the patient database's change log was reset", None
+    return None, last_run
+
+def run_incremental_audit(audit_db_path, literature_mode=None, workers=1,
+                          min_drugs=database_agent.MIN_DRUGS, db_path=database_agent.DB_PATH, matrix_dir=None):
+    """
+    Re-audits the patients changed since the last completed run.
+
+    Args:
+        audit_db_path (str): Audit database (see audit_schema.py).
+        literature_mode (str): One of literature_agent.LITERATURE_MODES.
+        workers (int): Structure scoring processes (see biochem_agent.score_pairs).
+        min_drugs (int): Polypharmacy threshold (must match the last run).
+        db_path (str): Patient database.
+        matrix_dir (str): Interaction matrix to answer known pairs from.
+
+    Returns:
+        dict: Run stats (changed, patients, pairs, rows, wall), or None
+        when a full audit is needed instead.
+    """
+    started = time.perf_counter()
+    reason, last_run = _full_audit_reason(audit_db_path, min_drugs, db_path)
+    if reason:
+        print(f"[Incremental] Full audit needed: {reason}.")
+        return None
+
+    # Connecting resolves prescriptions added by name only, before the watermark is read
+    change_id = database_agent.get_change_watermark(db_path)
+    changed = database_agent.get_changed_patients(last_run["change_id"], change_id, db_path)
+    patients = database_agent.get_patients(changed, min_drugs, db_path)
+    # Loaded after the changes are read, so it knows every drug they added
+    drugs = database_agent.get_drug_dictionary(db_path)
+    print(f"[Incremental] {len(changed)} patients changed since run {last_run['id']}; "
+          f"{len(patients)} still at risk.")
+
+    with audit_writer.AuditWriter(audit_db_path, drugs, literature_mode=literature_mode, min_drugs=min_drugs,
+                                  change_id=change_id, incremental=True) as writer:
+        # Only pairs the audit store has never seen go to the agents
+        new_pairs = {
+            (a, b) if a < b else (b, a)
+            for patient in patients for a, b in itertools.combinations(patient["drug_ids"], 2)
+        }.difference(writer.pair_ids)
+        names = {(a, b): tuple(sorted([drugs[a]["name"], drugs[b]["name"]])) for a, b in new_pairs}
+        small = [key for (a, b), key in names.items()
+                 if not drugs[a]["is_biological"] and not drugs[b]["is_biological"]]
+
+        literature, structure = {}, {}
+        matrix = interaction_matrix.load_matrix(matrix_dir, literature_mode) if matrix_dir and names else None
+        if matrix is not None:
+            literature, structure = matrix.lookup(names.values())
+        missing = [key for key in names.values() if key not in literature]
+        if missing:
+            literature.update(literature_agent.check_drug_interactions(missing, mode=literature_mode))
+        small = [key for key in small if key not in structure]
+        if small:
+            structure.update(biochem_agent.score_pairs(small, workers=workers))
+        writer.add_pair_results({
+            pair: (literature[key], structure.get(key, audit_writer.BIOLOGICAL_RESULT))
+            for pair, key in names.items()
+        })
+
+        writer.remove_patients(changed)
+        rows = writer.add_patients(patients)
+        writer.close()
+
+    stats = {"changed": len(changed), "patients": len(patients), "pairs": len(new_pairs), "rows": rows,
+             "wall": time.perf_counter() - started}
+    print(f"[Incremental] {stats['patients']} patients, {stats['pairs']} new pairs, "
+          f"{stats['rows']} rows in {stats['wall']:.2f}s wall-clock")
+    return stats
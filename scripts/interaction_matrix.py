@@ -0,0 +1,333 @@
+import os
+import json
+import time
+import argparse
+import itertools
+
+import numpy as np
+
+import risk
+import utils
+import database_agent
+import literature_agent
+import biochem_agent
+from structure_catalog import write_strings
+
+# ==========================================
+# INTERACTION MATRIX
+# ==========================================
+# Role: Precompute the result of every pair of the drug vocabulary once,
+# so the auditor, the dashboards and the point-of-care service share one
+# read-only artifact instead of each asking the agents (and their JSON
+# cache) pair by pair. `build_matrix()` writes a directory:
+#   matrix.json                    drug names, parameters, pair count
+#   entries.npy                    one packed record per drug pair, upper
+#                                  triangle of the name-sorted vocabulary,
+#                                  row by row (see pair_index)
+#   summaries.bin + summary_offsets.npy
+#                                  UTF-8 interaction summaries
+# `InteractionMatrix` memory-maps entries.npy; a pair is one index
+# computation and one record read, whatever the vocabulary size.
+# Pairs whose lookup or scoring failed are stored as unknown (-1) and left
+# to the agents. A matrix is only used while it fits the current setup:
+# same literature source (and offline index build), fingerprints and
+# structures, and no older than the literature cache TTL.
+# ==========================================
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MATRIX_DIR = os.path.join(BASE_DIR, "outputs", "interaction_matrix")
+
+MATRIX_VERSION = 1
+
+# Pairs sent to the agents (and held in memory) at a time while building
+BUILD_CHUNK = 20000
+
+# One record per pair; -1 / NaN mark a missing value
+ENTRY_DTYPE = np.dtype([
+    ("severity", "i1"),             # risk.Severity
+    ("literature_severity", "i1"),  # risk.LiteratureSeverity, -1 if the lookup failed
+    ("structure_status", "i1"),     # risk.StructureStatus, -1 if scoring failed
+    ("structure_severity", "i1"),   # risk.StructureSeverity, -1 if not scored
+    ("citation_count", "<i4"),
+    ("similarity", "<f8"),          # float64, so rendered similarities match the agent's
+    ("summary_id", "<i4"),          # row of summaries.bin, -1 if none
+])
+
+BIOLOGICAL_RESULT = risk.StructureResult(risk.StructureStatus.BIOLOGICAL)
+
+def pair_count(n):
+    """Number of pairs of an n-drug vocabulary."""
+    return n * (n - 1) // 2
+
+def pair_index(i, j, n):
+    """Position of the pair of drugs i < j in the upper-triangular entry array."""
+    return i * n - i * (i + 1) // 2 + (j - i - 1)
+
+def _entry(literature, structure, summary_ids, summaries):
+    """The record of one pair's two results (failures become unknown)."""
+    if literature.severity is not None:
+        literature_severity, citation_count = int(literature.severity), literature.citation_count or 0
+    else:
+        literature_severity, citation_count = -1, 0
+    summary_id = -1
+    if literature.summary is not None:
+        summary_id = summary_ids.get(literature.summary)
+        if summary_id is None:
+            summary_id = summary_ids[literature.summary] = len(summaries)
+            summaries.append(literature.summary)
+    if structure.status == risk.StructureStatus.ERROR:
+        structure_status, structure_severity, similarity = -1, -1, np.nan
+    else:
+        structure_status = int(structure.status)
+        structure_severity = int(structure.severity) if structure.severity is not None else -1
+        similarity = structure.similarity if structure.similarity is not None else np.nan
+    severity = risk.pair_severity(literature, structure)
+    return (int(severity), literature_severity, structure_status, structure_severity,
+            citation_count, similarity, summary_id)
+
+def build_matrix(matrix_dir=MATRIX_DIR, literature_mode=None, workers=1, db_path=database_agent.DB_PATH):
+    """
+    Materializes the results of every pair of the drug dictionary.
+
+    Args:
+        matrix_dir (str): Output directory.
+        literature_mode (str): One of literature_agent.LITERATURE_MODES.
+        workers (int): Structure scoring processes (see biochem_agent.score_pairs).
+        db_path (str): Patient database holding the drug dictionary.
+
+    Returns:
+        InteractionMatrix: The new matrix.
+    """
+    started = time.time()
+    literature_mode = literature_mode or literature_agent.LITERATURE_MODE
+    drugs = sorted(database_agent.get_drug_dictionary(db_path).values(), key=lambda drug: drug["name"])
+    names = [drug["name"] for drug in drugs]
+    biological = [drug["is_biological"] for drug in drugs]
+    n, count = len(names), pair_count(len(names))
+
+    os.makedirs(matrix_dir, exist_ok=True)
+    meta_path = os.path.join(matrix_dir, "matrix.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    entries = np.lib.format.open_memmap(
+        os.path.join(matrix_dir, "entries.npy"), mode="w+", dtype=ENTRY_DTYPE, shape=(count,))
+    summary_ids, summaries = {}, []
+
+    # Pairs come out of combinations() in entry order, so each chunk is one slice
+    pairs = itertools.combinations(range(n), 2)
+    unknown = 0
+    for start in range(0, count, BUILD_CHUNK):
+        chunk = list(itertools.islice(pairs, BUILD_CHUNK))
+        keys = [(names[i], names[j]) for i, j in chunk]
+        literature = literature_agent.check_drug_interactions(keys, mode=literature_mode)
+        small = [key for (i, j), key in zip(chunk, keys) if not biological[i] and not biological[j]]
+        structure = biochem_agent.score_pairs(small, workers=workers) if small else {}
+        records = [
+            _entry(literature[key], structure.get(key, BIOLOGICAL_RESULT), summary_ids, summaries)
+            for key in keys
+        ]
+        entries[start:start + len(records)] = np.array(records, dtype=ENTRY_DTYPE)
+        unknown += sum(record[1] < 0 or record[2] < 0 for record in records)
+        print(f"[Interaction Matrix] {start + len(records)}/{count} pairs...")
+    entries.flush()
+    del entries
+
+    write_strings(os.path.join(matrix_dir, "summaries.bin"),
+                   os.path.join(matrix_dir, "summary_offsets.npy"), summaries)
+    meta = {
+        "version": MATRIX_VERSION,
+        "drugs": names,
+        "count": count,
+        "literature_mode": literature_mode,
+        "literature_params": literature_agent.cache_params(literature_mode),
+        "fingerprint_params": biochem_agent.FINGERPRINT_PARAMS,
+        "structure_source": biochem_agent.get_registry().structure_source,
+        "built_at": time.time(),
+    }
+    # Written last: a directory without matrix.json is an unfinished build
+    with open(meta_path, "w") as f:
+        json.dump(meta, f, indent=2)
+
+    print(f"[Interaction Matrix] {count} pairs of {n} drugs in {time.time() - started:.1f}s "
+          f"({unknown} left to the agents, {len(summaries)} summaries)")
+    return InteractionMatrix(matrix_dir)
+
+class InteractionMatrix:
+    """
+    Read-only view of a matrix directory.
+
+    Opening a matrix reads matrix.json and the summaries; the pair records
+    stay on disk (memory-mapped) and only the ones looked up are read.
+    """
+
+    def __init__(self, matrix_dir=MATRIX_DIR):
+        self.matrix_dir = matrix_dir
+        meta_path = os.path.join(matrix_dir, "matrix.json")
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"No interaction matrix in {matrix_dir} (run interaction_matrix.py build)")
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("version") != MATRIX_VERSION:
+            raise ValueError(f"Unsupported interaction matrix version {meta.get('version')} in {matrix_dir}")
+        self.drugs = meta["drugs"]
+        self.count = meta["count"]
+        self.literature_mode = meta["literature_mode"]
+        # Matrices built before these were recorded never match
+        self.literature_params = meta.get("literature_params")
+        self.fingerprint_params = meta["fingerprint_params"]
+        self.structure_source = meta.get("structure_source")
+        self.built_at = meta.get("built_at")
+        self.index = {name: i for i, name in enumerate(self.drugs)}
+        # A vocabulary of fewer than two drugs has no pairs (and numpy cannot map an empty file)
+        if self.count:
+            self.entries = np.load(os.path.join(matrix_dir, "entries.npy"), mmap_mode="r")
+        else:
+            self.entries = np.zeros(0, dtype=ENTRY_DTYPE)
+        if len(self.entries) != self.count:
+            raise ValueError(f"Interaction matrix in {matrix_dir} has {len(self.entries)} pairs, "
+                             f"expected {self.count}")
+        offsets = np.load(os.path.join(matrix_dir, "summary_offsets.npy"))
+        with open(os.path.join(matrix_dir, "summaries.bin"), "rb") as f:
+            data = f.read()
+        self.summaries = [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def mismatch(self, literature_mode=None):
+        """
+        Why the matrix cannot answer for this literature mode, literature
+        source, fingerprints and structures (None if it can).
+        """
+        literature_mode = literature_mode or literature_agent.LITERATURE_MODE
+        if self.literature_mode != literature_mode:
+            return f"built for literature mode '{self.literature_mode}'"
+        if self.literature_params != literature_agent.cache_params(literature_mode):
+            return f"built from literature source {self.literature_params}"
+        ttl = utils.CACHE_TTL[utils.LITERATURE]
+        if ttl is not None and (self.built_at is None or time.time() - self.built_at > ttl):
+            return f"older than the literature TTL of {ttl / 86400:.0f} days"
+        if self.fingerprint_params != biochem_agent.FINGERPRINT_PARAMS:
+            return f"built for fingerprints {self.fingerprint_params}"
+        if self.structure_source != biochem_agent.get_registry().structure_source:
+            return f"built for structures {self.structure_source}"
+        return None
+
+    def matches(self, literature_mode=None):
+        """Whether the matrix answers for this literature mode (see mismatch())."""
+        return self.mismatch(literature_mode) is None
+
+    def entry(self, drug1, drug2):
+        """The raw record of a pair (in either order), or None if a drug is not in the vocabulary."""
+        i, j = self.index.get(drug1), self.index.get(drug2)
+        if i is None or j is None or i == j:
+            return None
+        if i > j:
+            i, j = j, i
+        return self.entries[pair_index(i, j, len(self.drugs))]
+
+    def results(self, record):
+        """(LiteratureResult, StructureResult) of a record; None for a failed half."""
+        literature = structure = None
+        if record["literature_severity"] >= 0:
+            summary_id = int(record["summary_id"])
+            literature = risk.LiteratureResult(
+                int(record["literature_severity"]), int(record["citation_count"]),
+                self.summaries[summary_id] if summary_id >= 0 else None,
+            )
+        if record["structure_status"] >= 0:
+            similarity = float(record["similarity"])
+            structure_severity = int(record["structure_severity"])
+            structure = risk.StructureResult(
+                int(record["structure_status"]), None if np.isnan(similarity) else similarity,
+                severity=structure_severity if structure_severity >= 0 else None,
+            )
+        return literature, structure
+
+    def pair(self, drug1, drug2):
+        """(LiteratureResult, StructureResult) of a pair in either order; None if a drug is unknown."""
+        record = self.entry(drug1, drug2)
+        return self.results(record) if record is not None else None
+
+    def lookup(self, pairs):
+        """
+        Results of many (drug1, drug2) pairs.
+
+        Returns:
+            tuple: ({pair: LiteratureResult}, {pair: StructureResult}) of
+            the pairs the matrix knows; the rest are left to the agents.
+        """
+        literature, structure = {}, {}
+        for pair in pairs:
+            known = self.pair(*pair)
+            if known is None:
+                continue
+            if known[0] is not None:
+                literature[pair] = known[0]
+            if known[1] is not None:
+                structure[pair] = known[1]
+        return literature, structure
+
+    def patient(self, medications):
+        """
+        Every pair of a medication list, read in one vectorized index.
+
+        Returns:
+            list: (drug_1, drug_2, record) per pair of known drugs, names
+            sorted, highest severity first.
+        """
+        ids = np.array(sorted({self.index[name] for name in medications if name in self.index}), dtype=np.int64)
+        if len(ids) < 2:
+            return []
+        upper_i, upper_j = np.triu_indices(len(ids), k=1)
+        i, j = ids[upper_i], ids[upper_j]
+        records = self.entries[i * len(self.drugs) - i * (i + 1) // 2 + (j - i - 1)]
+        order = np.argsort(-records["severity"], kind="stable")
+        return [(self.drugs[i[k]], self.drugs[j[k]], records[k]) for k in order]
+
+def load_matrix(matrix_dir, literature_mode=None):
+    """The matrix in `matrix_dir` if it fits this literature mode and is fresh, else None (with the reason printed)."""
+    try:
+        matrix = InteractionMatrix(matrix_dir)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"[Interaction Matrix] Not used: {e}")
+        return None
+    reason = matrix.mismatch(literature_mode)
+    if reason is not None:
+        print(f"[Interaction Matrix] Not used: {reason} (rebuild it with interaction_matrix.py build)")
+        return None
+    return matrix
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the precomputed interaction matrix.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="Materialize every pair of the drug dictionary")
+    build.add_argument("--output", default=MATRIX_DIR)
+    build.add_argument("--literature-mode", choices=literature_agent.LITERATURE_MODES)
+    build.add_argument("--workers", type=int, default=1,
+                       help="Processes for structure scoring (0: one per CPU)")
+
+    query = sub.add_parser("query", help="Look up the pairs of a medication list")
+    query.add_argument("drugs", nargs="*")
+    query.add_argument("--matrix", default=MATRIX_DIR)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_matrix(args.output, literature_mode=args.literature_mode, workers=args.workers or None)
+    else:
+        matrix = InteractionMatrix(args.matrix)
+        unknown = int(np.sum((matrix.entries["literature_severity"] < 0) | (matrix.entries["structure_status"] < 0)))
+        print(f"{matrix.count} pairs of {len(matrix.drugs)} drugs, literature mode '{matrix.literature_mode}', "
+              f"{unknown} unknown")
+        missing = [name for name in args.drugs if name not in matrix]
+        if missing:
+            print(f"Not in the vocabulary: {', '.join(missing)}")
+        for drug_1, drug_2, record in matrix.patient(args.drugs):
+            literature, structure = matrix.results(record)
+            print(f"{drug_1} + {drug_2}: {risk.Severity(int(record['severity'])).name}")
+            print(f"    {literature if literature is not None else '(literature unknown)'}")
+            print(f"    {structure if structure is not None else '(structure unknown)'}")
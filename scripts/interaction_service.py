@@ -0,0 +1,357 @@
+import os
+import json
+import time
+import datetime
+import queue
+import socket
+import argparse
+import itertools
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import risk
+import utils
+import patient_schema
+import database_agent
+import literature_agent
+import biochem_agent
+import audit_schema
+import interaction_matrix
+
+# ==========================================
+# POINT-OF-CARE INTERACTION SERVICE
+# ==========================================
+# Role: Answer "is this medication list safe?" at order-entry time instead
+# of in the nightly batch. A long-lived local HTTP JSON service keeps warm:
+#   - the pair results of the last audit (audit_results.db) in memory,
+#   - the fingerprint registry / catalog, so structure risk is scored on
+#     the fly for any pair,
+#   - the drug dictionary, to map spelling variants and class flags,
+#   - optionally the precomputed interaction matrix, read before anything
+#     else (see interaction_matrix.py).
+# Literature risk that is neither in memory nor in the agent cache is
+# never fetched on the request path: the pair is queued for a background
+# thread (the usual agent, rate limits and cache included) and the answer
+# says `literature_pending` until a later request finds it. Such a pair
+# has severity PENDING, unless its structure alone already makes it HIGH.
+# Literature results expire like the agent cache's (utils.CACHE_TTL): a
+# preloaded audit result as old as its audit, and a result found later
+# at its cache entry's expiry, after which the pair is queued again.
+#
+#   POST /check   {"medications": ["Aspirin", "Ibuprofen", ...]}
+#   GET  /health  counters
+# ==========================================
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+# Pairs looked up per background literature batch
+LITERATURE_BATCH = 200
+
+# Seconds the background thread waits to fill a batch
+LITERATURE_LINGER = 0.05
+
+# Severity of a pair whose literature is still queued: not known to be safe
+PENDING = "PENDING"
+
+# Order of the pairs in a response, most severe first
+SEVERITY_ORDER = {risk.Severity.HIGH.name: 0, risk.Severity.REVIEW.name: 1, PENDING: 2,
+                  risk.Severity.NONE.name: 3}
+
+def _enum_name(value):
+    return value.name if value is not None else None
+
+def literature_json(result):
+    if result is None:
+        return None
+    return {"severity": _enum_name(result.severity), "citation_count": result.citation_count,
+            "summary": result.summary, "error": result.error, "text": str(result)}
+
+def structure_json(result):
+    return {"status": result.status.name, "severity": _enum_name(result.severity),
+            "similarity": result.similarity, "error": result.error, "text": str(result)}
+
+def _expiry(looked_up_at):
+    """Unix time a literature result looked up at `looked_up_at` expires (None: never)."""
+    ttl = utils.CACHE_TTL[utils.LITERATURE]
+    return looked_up_at + ttl if ttl is not None else None
+
+class InteractionService:
+    """
+    Warm, thread-safe interaction checker.
+
+    Args:
+        audit_db_path (str): Audit database whose pair results are preloaded
+            (skipped if missing).
+        db_path (str): Patient database for the drug dictionary (optional).
+        literature_mode (str): Mode of the background literature lookups.
+        matrix_dir (str): Interaction matrix to answer known pairs from
+            (optional; ignored unless built with the same literature mode).
+
+    The audit's literature results are only preloaded when its last
+    completed full run used the same literature mode and is younger than
+    the literature TTL; its structure results always are.
+    """
+
+    def __init__(self, audit_db_path=audit_schema.AUDIT_DB_PATH, db_path=database_agent.DB_PATH,
+                 literature_mode=None, matrix_dir=None):
+        self.literature_mode = literature_mode
+        # (drug_1, drug_2) sorted names -> LiteratureResult / StructureResult
+        self.literature = {}
+        self.structure = {}
+        # (drug_1, drug_2) -> Unix time self.literature[pair] expires (None: never)
+        self._literature_expires = {}
+        # normalized name -> (name, is_biological)
+        self.drugs = {}
+        self.counters = {"requests": 0, "pairs": 0, "matrix_pairs": 0, "literature_queued": 0,
+                         "literature_fetched": 0}
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._queue = queue.Queue()
+
+        started = time.perf_counter()
+        self.matrix = interaction_matrix.load_matrix(matrix_dir, literature_mode) if matrix_dir else None
+        if db_path and os.path.exists(db_path):
+            for drug in database_agent.get_drug_dictionary(db_path).values():
+                self.drugs[patient_schema.normalize_name(drug["name"])] = (drug["name"], drug["is_biological"])
+        if audit_db_path and os.path.exists(audit_db_path):
+            self._load_audit(audit_db_path)
+        # Parses / maps every structure now rather than on the first request
+        self.registry = biochem_agent.get_registry()
+        self.load_seconds = time.perf_counter() - started
+
+        self._worker = threading.Thread(target=self._literature_worker, name="literature-queue", daemon=True)
+        self._worker.start()
+
+    def _load_audit(self, audit_db_path):
+        # Read-only: the service may start next to an audit that is writing
+        try:
+            conn = audit_schema.connect_readonly(audit_db_path)
+        except audit_schema.SchemaOutdatedError as e:
+            print(f"[Interaction Service] Audit results not used: {e}")
+            return
+        try:
+            run = audit_schema.latest_full_run(conn, completed=True)
+            audit_mode = (run and run["literature_mode"]) or literature_agent.LITERATURE_MODE
+            use_literature = audit_mode == (self.literature_mode or literature_agent.LITERATURE_MODE)
+            if not use_literature:
+                print(f"[Interaction Service] Audit literature not used: found in literature mode '{audit_mode}'")
+            # The audit's results are as old as the run that looked them up
+            # (results without a completed run are of unknown age)
+            started = run and run["started_at"]
+            expires = _expiry(datetime.datetime.fromisoformat(started).timestamp() if started else 0.0)
+            if use_literature and expires is not None and expires <= time.time():
+                print("[Interaction Service] Audit literature not used: older than the literature TTL")
+                use_literature = False
+            for row in conn.execute(f"SELECT {', '.join(audit_schema.PAIR_COLUMNS)} FROM pair_results"):
+                literature, structure = audit_schema.results_from_row(row)
+                pair = (row[1], row[2])
+                if use_literature and literature.severity is not None:
+                    self.literature[pair] = literature
+                    self._literature_expires[pair] = expires
+                if structure.status != risk.StructureStatus.ERROR:
+                    self.structure[pair] = structure
+        finally:
+            conn.close()
+
+    def resolve(self, name):
+        """(dictionary name, is_biological) of a medication name as typed."""
+        known = self.drugs.get(patient_schema.normalize_name(name))
+        if known:
+            return known
+        name = " ".join(name.split())
+        return name, bool(patient_schema.classify_drug(name)[0])
+
+    def _structure(self, pair, biological):
+        result = self.structure.get(pair)
+        if result is None:
+            if biological:
+                result = risk.StructureResult(risk.StructureStatus.BIOLOGICAL)
+            else:
+                result = biochem_agent.unscored_status(self.registry, *pair)
+                if result is None:
+                    try:
+                        result = risk.StructureResult.scored(self.registry.similarity(*pair))
+                    except Exception as e:
+                        return risk.StructureResult.failure(f"Error in chemical analysis: {e}")
+            self.structure[pair] = result
+        return result
+
+    def _literature(self, pair):
+        """The known, unexpired literature result, else None (and the pair is queued)."""
+        result = self.literature.get(pair)
+        if result is not None:
+            expires = self._literature_expires.get(pair)
+            if expires is None or expires > time.time():
+                return result
+        cached = literature_agent.cached_interaction(*pair, mode=self.literature_mode)
+        if cached:
+            result, expires = cached
+            if result.severity is not None:
+                self.literature[pair] = result
+                self._literature_expires[pair] = expires
+                return result
+        with self._lock:
+            if pair not in self._pending:
+                self._pending.add(pair)
+                self.counters["literature_queued"] += 1
+                self._queue.put(pair)
+        return None
+
+    def check(self, medications):
+        """
+        Per-pair risk of a medication list.
+
+        Returns:
+            dict: pairs (one entry per drug pair, highest severity first)
+            and literature_pending (pairs whose literature is still queued;
+            their severity is PENDING unless the structure makes it HIGH).
+        """
+        resolved = {}
+        for name in medications:
+            drug, biological = self.resolve(name)
+            resolved[drug] = biological
+        pairs = []
+        pending = from_matrix = 0
+        for drug_1, drug_2 in itertools.combinations(sorted(resolved), 2):
+            pair = (drug_1, drug_2)
+            literature, structure = (self.matrix.pair(*pair) if self.matrix else None) or (None, None)
+            from_matrix += literature is not None
+            structure = structure or self._structure(pair, resolved[drug_1] or resolved[drug_2])
+            literature = literature or self._literature(pair)
+            if literature is not None:
+                severity = risk.pair_severity(literature, structure).name
+            elif structure.severity == risk.StructureSeverity.HIGH:
+                # No literature result can lower a high structural similarity
+                severity = risk.Severity.HIGH.name
+            else:
+                severity = PENDING
+            pending += literature is None
+            pairs.append({
+                "drug_1": drug_1,
+                "drug_2": drug_2,
+                "severity": severity,
+                "literature_pending": literature is None,
+                "literature": literature_json(literature),
+                "structure": structure_json(structure),
+            })
+        pairs.sort(key=lambda item: SEVERITY_ORDER[item["severity"]])
+        with self._lock:
+            self.counters["requests"] += 1
+            self.counters["pairs"] += len(pairs)
+            self.counters["matrix_pairs"] += from_matrix
+        return {"medications": list(resolved), "pairs": pairs, "literature_pending": pending}
+
+    def _literature_worker(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + LITERATURE_LINGER
+            while len(batch) < LITERATURE_BATCH:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                results = literature_agent.check_drug_interactions(batch, mode=self.literature_mode)
+            except Exception as e:
+                print(f"[Interaction Service] Literature batch failed: {e}")
+                results = {}
+            with self._lock:
+                for pair in batch:
+                    result = results.get(pair)
+                    # Failures are not kept, so a later request queues them again
+                    if result is not None and result.severity is not None:
+                        self.literature[pair] = result
+                        self._literature_expires[pair] = _expiry(time.time())
+                        self.counters["literature_fetched"] += 1
+                    self._pending.discard(pair)
+
+    def wait_for_literature(self, timeout=None):
+        """Blocks until the background queue is empty (for tests and benchmarks)."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            with self._lock:
+                if not self._pending:
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+
+    def health(self):
+        with self._lock:
+            return dict(self.counters, pending=len(self._pending), literature_pairs=len(self.literature),
+                        structure_pairs=len(self.structure), load_seconds=round(self.load_seconds, 3))
+
+class _Handler(BaseHTTPRequestHandler):
+    service = None
+    # Keep-alive, so a client pays for one connection, not one per check
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Headers and body are separate writes; without this, Nagle's
+        # algorithm holds the body back for the client's delayed ACK (~40 ms)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(200, self.service.health())
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/check":
+            self._send(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            medications = json.loads(self.rfile.read(length) or b"{}").get("medications")
+            if not isinstance(medications, list) or not all(isinstance(m, str) for m in medications):
+                raise ValueError("'medications' must be a list of drug names")
+        except (ValueError, AttributeError) as e:
+            self._send(400, {"error": str(e)})
+            return
+        started = time.perf_counter()
+        result = self.service.check(medications)
+        result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        self._send(200, result)
+
+    def log_message(self, format, *args):
+        # One line per request would dominate the service's own latency
+        pass
+
+def make_server(service, host=HOST, port=PORT):
+    """HTTP server answering with `service` (one thread per connection)."""
+    handler = type("InteractionHandler", (_Handler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve point-of-care drug interaction checks over HTTP.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--audit-db", default=audit_schema.AUDIT_DB_PATH)
+    parser.add_argument("--literature-mode", choices=literature_agent.LITERATURE_MODES)
+    parser.add_argument("--matrix", nargs="?", const=interaction_matrix.MATRIX_DIR, metavar="DIR",
+                        help="Answer known pairs from a precomputed interaction matrix")
+    args = parser.parse_args()
+
+    service = InteractionService(args.audit_db, literature_mode=args.literature_mode, matrix_dir=args.matrix)
+    server = make_server(service, args.host, args.port)
+    print(f"[Interaction Service] {len(service.literature)} literature / {len(service.structure)} structure "
+          f"results warm in {service.load_seconds:.2f}s; listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,6 +1,9 @@
-import requests
-import time
+import os
+import asyncio
 import utils
+import pubmed_client
+import literature_index
+import risk
 
 # ==========================================
 # LITERATURE AGENT
@@ -10,7 +13,112 @@ import utils
 # ==========================================
 
 # Base URL for NCBI E-utilities API (Public & Free)
-BASE_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
+BASE_URL = pubmed_client.BASE_URL
+
+# How batches are answered:
+#   'pair'     - one ESearch per drug pair (N*(N-1)/2 requests)
+#   'per-drug' - fetch each drug's PMID set once and intersect locally (N requests)
+#   'offline'  - answer from a local index built from a PubMed baseline dump (no network)
+LITERATURE_MODES = ("pair", "per-drug", "offline")
+LITERATURE_MODE = os.environ.get("DDI_LITERATURE_MODE", "pair")
+
+# Offline index file used by 'offline' mode
+LITERATURE_INDEX = os.environ.get("DDI_LITERATURE_INDEX", literature_index.INDEX_PATH)
+
+# Cache params of counts from the PubMed API ('pair' and 'per-drug' give the
+# same counts). Offline counts carry their index's identity instead, so a
+# count from an offline or synthetic index never answers a live lookup.
+PUBMED_CACHE_PARAMS = {"source": "pubmed"}
+
+_offline_backend = None
+
+def get_offline_backend():
+    """Loads the offline literature index once per process."""
+    global _offline_backend
+    if _offline_backend is None:
+        _offline_backend = literature_index.OfflineLiteratureBackend(LITERATURE_INDEX)
+    return _offline_backend
+
+def cache_params(mode=None):
+    """Params the literature cache entries of a mode are saved and looked up with."""
+    if (mode or LITERATURE_MODE) == "offline":
+        return get_offline_backend().cache_params
+    return PUBMED_CACHE_PARAMS
+
+def build_query(drug1, drug2):
+    """
+    Builds the PubMed search term for a drug pair.
+    We look for: Drug1 AND Drug2 AND "Drug Interactions" matches in the title or abstract.
+    """
+    return f"{drug1}[Title/Abstract] AND {drug2}[Title/Abstract] AND Drug Interactions[MeSH]"
+
+def build_drug_query(drug):
+    """
+    Builds the PubMed search term for a single drug. The pair query is the
+    AND of two of these, so its hits are exactly the intersection of the
+    two drugs' PMID sets.
+    """
+    return f"{drug}[Title/Abstract] AND Drug Interactions[MeSH]"
+
+def build_params(query):
+    """ESearch parameters for a query."""
+    return {
+        "db": "pubmed",       # Database to search
+        "term": query,        # Our search term
+        "retmode": "json",    # Return format
+        "retmax": 5           # We only need to know if hits exist, not get all of them
+    }
+
+def classify_citations(drug1, drug2, count):
+    """
+    Turns a citation count into a literature result.
+
+    Returns:
+        LiteratureResult: Known risk (with summary), potential risk, or no
+        obvious flag.
+    """
+    if count > risk.KNOWN_RISK_CITATIONS:
+        # Many papers found -> High probability of known interaction
+        # SIMULATED LLM SUMMARY INTERVENTION
+        summary = generate_simulated_llm_summary(drug1, drug2)
+        return risk.LiteratureResult(risk.LiteratureSeverity.KNOWN, count, summary)
+    elif count > 0:
+        # A few papers - might be rare or emerging
+        return risk.LiteratureResult(risk.LiteratureSeverity.POTENTIAL, count)
+    else:
+        return risk.LiteratureResult(risk.LiteratureSeverity.NONE, 0)
+
+def _record_response(drug1, drug2, query, data):
+    """Classifies an ESearch response and caches it."""
+    # 'count' tells us how many papers matched the query
+    count = int(data["esearchresult"]["count"])
+    result = classify_citations(drug1, drug2, count)
+    utils.save_cached_entry(drug1, drug2, utils.LITERATURE, str(result),
+                            citation_count=count, params=PUBMED_CACHE_PARAMS, query=query)
+    return result
+
+def _cached_result(cached):
+    """Literature result of a cache entry (its status text keeps the summary)."""
+    return risk.LiteratureResult.parse(cached["status"], citation_count=cached["citation_count"])
+
+def cached_interaction(drug1, drug2, mode=None):
+    """
+    The cached literature result of a pair, without querying anything.
+
+    Returns:
+        tuple: (LiteratureResult, expires_at) with expires_at a Unix time
+        (None: never), or None on a miss or an expired entry.
+    """
+    cached = utils.get_cached_entry(drug1, drug2, utils.LITERATURE, params=cache_params(mode))
+    if not cached:
+        return None
+    return _cached_result(cached), cached["expires_at"]
+
+def _error_result(error):
+    """Failed-lookup result (never cached)."""
+    if isinstance(error, pubmed_client.PubMedError):
+        return risk.LiteratureResult.failure("❌ API Error")
+    return risk.LiteratureResult.failure(f"Error connecting to NCBI: {error}")
 
 def check_drug_interaction(drug1, drug2):
     """
@@ -21,61 +129,179 @@ def check_drug_interaction(drug1, drug2):
         drug2 (str): Name of second drug.
         
     Returns:
-        str: A status message ("Known Risk", "Potential Risk", or "No obvious flag")
+        LiteratureResult: Known risk, potential risk, no obvious flag, or
+        a failure (str() gives the status message)
     """
     
-    # Check cache first
-    lit_res, _ = utils.get_cached_result(drug1, drug2)
-    if lit_res:
+    # Check cache first (expired entries fall through and are refreshed)
+    cached = utils.get_cached_entry(drug1, drug2, utils.LITERATURE, params=cache_params())
+    if cached:
         print(f"[Literature Agent] Using cached result for {drug1} + {drug2}")
-        return lit_res
+        return _cached_result(cached)
+
+    query = build_query(drug1, drug2)
+
+    if LITERATURE_MODE == "offline":
+        backend = get_offline_backend()
+        count = backend.count(drug1, drug2)
+        result = classify_citations(drug1, drug2, count)
+        utils.save_cached_entry(drug1, drug2, utils.LITERATURE, str(result),
+                                citation_count=count, params=backend.cache_params, query=query)
+        return result
 
-    # 1. Construct the search query
-    # We look for: Drug1 AND Drug2 AND "Drug Interactions" matches in the title or abstract.
-    query = f"{drug1}[Title/Abstract] AND {drug2}[Title/Abstract] AND Drug Interactions[MeSH]"
-    
-    params = {
-        "db": "pubmed",       # Database to search
-        "term": query,        # Our search term
-        "retmode": "json",    # Return format
-        "retmax": 5           # We only need to know if hits exist, not get all of them
-    }
-    
     print(f"[Literature Agent] Checking PubMed for: {drug1} + {drug2}...")
     
     try:
-        # 2. Make the API Call
-        response = requests.get(BASE_URL, params=params)
-        
-        if response.status_code == 200:
-            data = response.json()
-            
-            # 'count' tells us how many papers matched the query
-            count = int(data["esearchresult"]["count"])
-            
-            if count > 5:
-                # Many papers found -> High probability of known interaction
-                # SIMULATED LLM SUMMARY INTERVENTION
-                summary = generate_simulated_llm_summary(drug1, drug2)
-                result = f"⚠️ KNOWN RISK ({count} citations) - 🤖 LLM Summary: {summary}"
-            elif count > 0:
-                # A few papers - might be rare or emerging
-                result = f"⚠️ POTENTIAL RISK ({count} citations) - Needs review."
-            else:
-                result = "✅ No obvious flag in literature."
-            
-            utils.save_cached_result(drug1, drug2, result, None)
-            return result
-        else:
-            return "❌ API Error"
-            
+        # The shared client waits for the rate limiter and retries 429/5xx
+        data = pubmed_client.get_client().esearch(build_params(query))
+        return _record_response(drug1, drug2, query, data)
     except Exception as e:
-        return f"Error connecting to NCBI: {e}"
+        return _error_result(e)
+
+async def check_drug_interactions_async(pairs):
+    """
+    Asyncio version of `check_drug_interactions()`.
+    Cached pairs are answered locally; the rest are queried concurrently.
+    """
+    results = {}
+    pending = []
+    for drug1, drug2 in pairs:
+        cached = utils.get_cached_entry(drug1, drug2, utils.LITERATURE, params=PUBMED_CACHE_PARAMS)
+        if cached:
+            results[(drug1, drug2)] = _cached_result(cached)
+        else:
+            pending.append((drug1, drug2))
+
+    print(f"[Literature Agent] {len(results)} pairs cached, querying PubMed for {len(pending)}...")
+
+    queries = [build_query(d1, d2) for d1, d2 in pending]
+    responses = await pubmed_client.get_client().esearch_many([build_params(q) for q in queries])
+
+    for (drug1, drug2), query, data in zip(pending, queries, responses):
+        if isinstance(data, Exception):
+            results[(drug1, drug2)] = _error_result(data)
+            continue
+        try:
+            results[(drug1, drug2)] = _record_response(drug1, drug2, query, data)
+        except (KeyError, ValueError) as e:
+            results[(drug1, drug2)] = _error_result(e)
+
+    return results
+
+def count_shared_citations(pmids1, pmids2):
+    """Number of PMIDs two sorted id arrays have in common."""
+    if len(pmids1) > len(pmids2):
+        pmids1, pmids2 = pmids2, pmids1
+    return len(set(pmids1).intersection(pmids2))
+
+async def get_drug_pmids_async(drugs):
+    """
+    Returns {drug: sorted PMID array} for the given drugs, fetching (and
+    caching) only the drugs whose set is not cached yet.
+    """
+    pmid_sets = {}
+    missing = []
+    for drug in drugs:
+        pmids = utils.get_pmid_set(build_drug_query(drug))
+        if pmids is None:
+            missing.append(drug)
+        else:
+            pmid_sets[drug] = pmids
+
+    if missing:
+        print(f"[Literature Agent] Fetching PMID sets for {len(missing)} drugs...")
+        client = pubmed_client.get_client()
+        semaphore = asyncio.Semaphore(client.max_in_flight)
+        fetched = await asyncio.gather(
+            *[client.fetch_pmids_async(build_drug_query(drug), semaphore) for drug in missing],
+            return_exceptions=True
+        )
+        for drug, pmids in zip(missing, fetched):
+            if isinstance(pmids, Exception):
+                print(f"[Literature Agent] Could not fetch PMIDs for {drug}: {pmids}")
+                continue
+            utils.save_pmid_set(build_drug_query(drug), pmids)
+            pmid_sets[drug] = utils.get_pmid_set(build_drug_query(drug))
+
+    return pmid_sets
+
+async def check_drug_interactions_per_drug_async(pairs):
+    """
+    Per-drug version of `check_drug_interactions_async()`: one PMID set
+    per drug, pair counts by local intersection. Classification and cache
+    entries are the same as in pair mode.
+    """
+    results = {}
+    pending = []
+    for drug1, drug2 in pairs:
+        cached = utils.get_cached_entry(drug1, drug2, utils.LITERATURE, params=PUBMED_CACHE_PARAMS)
+        if cached:
+            results[(drug1, drug2)] = _cached_result(cached)
+        else:
+            pending.append((drug1, drug2))
+
+    print(f"[Literature Agent] {len(results)} pairs cached, intersecting PMID sets for {len(pending)}...")
+
+    drugs = sorted({drug for pair in pending for drug in pair})
+    pmid_sets = await get_drug_pmids_async(drugs)
+
+    for drug1, drug2 in pending:
+        if drug1 not in pmid_sets or drug2 not in pmid_sets:
+            results[(drug1, drug2)] = risk.LiteratureResult.failure("❌ API Error")
+            continue
+        count = count_shared_citations(pmid_sets[drug1], pmid_sets[drug2])
+        result = classify_citations(drug1, drug2, count)
+        utils.save_cached_entry(drug1, drug2, utils.LITERATURE, str(result), citation_count=count,
+                                params=PUBMED_CACHE_PARAMS, query=build_query(drug1, drug2))
+        results[(drug1, drug2)] = result
+
+    return results
+
+def check_drug_interactions_offline(pairs):
+    """
+    Offline version of `check_drug_interactions()`: counts come from the
+    local literature index and are cached in a single transaction, tagged
+    with the index build so they never answer a live lookup.
+    """
+    backend = get_offline_backend()
+    results = {}
+    entries = []
+    for drug1, drug2 in pairs:
+        cached = utils.get_cached_entry(drug1, drug2, utils.LITERATURE, params=backend.cache_params)
+        if cached:
+            results[(drug1, drug2)] = _cached_result(cached)
+            continue
+        count = backend.count(drug1, drug2)
+        result = classify_citations(drug1, drug2, count)
+        entries.append({"drug1": drug1, "drug2": drug2, "source": utils.LITERATURE,
+                        "status": str(result), "citation_count": count,
+                        "params": backend.cache_params, "query": build_query(drug1, drug2)})
+        results[(drug1, drug2)] = result
+
+    utils.save_cached_entries(entries)
+    print(f"[Literature Agent] {len(results) - len(entries)} pairs cached, "
+          f"{len(entries)} answered from the offline index.")
+    return results
+
+def check_drug_interactions(pairs, mode=None):
+    """
+    Checks many drug pairs at the maximum rate NCBI allows.
+    
+    Args:
+        pairs (iterable): (drug1, drug2) tuples.
+        mode (str): One of LITERATURE_MODES (default: LITERATURE_MODE).
         
-    finally:
-        # Be polite to the API server!
-        # NCBI limits requests without API keys to 3 per second.
-        time.sleep(0.5) 
+    Returns:
+        dict: Maps each (drug1, drug2) tuple to its LiteratureResult.
+    """
+    mode = mode or LITERATURE_MODE
+    if mode == "offline":
+        return check_drug_interactions_offline(pairs)
+    if mode == "per-drug":
+        return asyncio.run(check_drug_interactions_per_drug_async(list(pairs)))
+    if mode == "pair":
+        return asyncio.run(check_drug_interactions_async(list(pairs)))
+    raise ValueError(f"Unknown literature mode: {mode}")
 
 def generate_simulated_llm_summary(drug1, drug2):
     """
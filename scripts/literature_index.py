@@ -0,0 +1,275 @@
+import os
+import re
+import glob
+import gzip
+import time
+import random
+import sqlite3
+import argparse
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+import utils
+
+# ==========================================
+# OFFLINE LITERATURE INDEX
+# ==========================================
+# Role: Answer literature lookups without network access.
+# `build_index()` streams a local MEDLINE/PubMed baseline dump
+# (pubmed*.xml.gz) and keeps, for every drug in the vocabulary, the PMIDs
+# of Drug Interactions articles that mention it in the title or abstract.
+# `OfflineLiteratureBackend` loads that inverted index and answers pair
+# citation counts by set intersection, the same way the per-drug online
+# mode does.
+# ==========================================
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INDEX_PATH = os.path.join(BASE_DIR, "outputs", "literature_index.db")
+PATIENTS_DB = os.path.join(BASE_DIR, "outputs", "patients.db")
+
+# "Drug Interactions[MeSH]" also matches the narrower headings below it
+# in the MeSH tree, so the index keeps those too.
+DRUG_INTERACTION_HEADINGS = {
+    "Drug Interactions",
+    "Drug Antagonism",
+    "Drug Inverse Agonism",
+    "Drug Partial Agonism",
+    "Drug Synergism",
+    "Food-Drug Interactions",
+    "Herb-Drug Interactions",
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def normalize_term(text):
+    """Lower-cases a drug name or text and reduces it to single-spaced word tokens."""
+    return " ".join(_TOKEN_RE.findall(text.lower()))
+
+def _parse_articles(path):
+    """
+    Streams one baseline/update file. Yields ('article', pmid, text, headings)
+    for each citation and ('delete', pmid, None, None) for each deletion.
+    Each citation is dropped from the tree once it is read (the root would
+    otherwise keep every cleared, empty element), so memory stays flat.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        root = None
+        for event, elem in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = elem
+                continue
+            if elem.tag == "PubmedArticle":
+                citation = elem.find("MedlineCitation")
+                pmid = int(citation.findtext("PMID"))
+                article = citation.find("Article")
+                parts = []
+                if article is not None:
+                    title = article.find("ArticleTitle")
+                    if title is not None:
+                        parts.append("".join(title.itertext()))
+                    for abstract in article.iterfind("Abstract/AbstractText"):
+                        parts.append("".join(abstract.itertext()))
+                headings = {d.text for d in citation.iterfind("MeshHeadingList/MeshHeading/DescriptorName")}
+                yield "article", pmid, " ".join(parts), headings
+                root.clear()
+            elif elem.tag == "DeleteCitation":
+                for pmid in elem.iterfind("PMID"):
+                    yield "delete", int(pmid.text), None, None
+                root.clear()
+
+def load_vocabulary(db_path=PATIENTS_DB):
+    """Returns the distinct drug names prescribed in the patient database."""
+    conn = sqlite3.connect(db_path)
+    try:
+        return [row[0] for row in conn.execute("SELECT DISTINCT drug_name FROM prescriptions")]
+    finally:
+        conn.close()
+
+def build_index(paths, drugs, index_path=INDEX_PATH):
+    """
+    Builds the offline inverted index (drug term -> PMIDs).
+
+    Args:
+        paths (list): Baseline/update files, applied in order.
+        drugs (list): Drug names to index.
+        index_path (str): SQLite file to write.
+
+    Returns:
+        dict: Build statistics.
+    """
+    # Match whole-word phrases, prefiltered on the phrase's first word
+    terms_by_first_word = {}
+    for drug in drugs:
+        term = normalize_term(drug)
+        if term:
+            terms_by_first_word.setdefault(term.split(" ")[0], set()).add(term)
+
+    postings = {term: set() for terms in terms_by_first_word.values() for term in terms}
+    # Terms each indexed PMID was filed under, so revisions and deletions
+    # in update files only touch the postings they affect
+    filed_under = {}
+    articles = 0
+
+    for path in paths:
+        print(f"[Literature Index] Reading {os.path.basename(path)}...")
+        for kind, pmid, text, headings in _parse_articles(path):
+            # A deletion, or a newer version of a citation, drops the old one
+            for term in filed_under.pop(pmid, ()):
+                postings[term].discard(pmid)
+            if kind == "delete":
+                continue
+
+            articles += 1
+            if not headings & DRUG_INTERACTION_HEADINGS:
+                continue
+
+            normalized = normalize_term(text)
+            words = set(normalized.split(" "))
+            padded = f" {normalized} "
+            hits = [
+                term
+                for word in words & terms_by_first_word.keys()
+                for term in terms_by_first_word[word]
+                if f" {term} " in padded
+            ]
+            for term in hits:
+                postings[term].add(pmid)
+            if hits:
+                filed_under[pmid] = hits
+
+    matched = len(filed_under)
+
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    conn = sqlite3.connect(index_path)
+    with conn:
+        conn.execute('''
+            CREATE TABLE term_pmids (
+                term TEXT PRIMARY KEY,
+                pmid_count INTEGER NOT NULL,
+                pmids BLOB NOT NULL
+            )
+        ''')
+        conn.execute("CREATE TABLE index_meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.executemany(
+            "INSERT INTO term_pmids (term, pmid_count, pmids) VALUES (?, ?, ?)",
+            [(term, len(pmids), utils.pmids_to_blob(sorted(pmids))) for term, pmids in postings.items()]
+        )
+        stats = {
+            "files": len(paths),
+            "articles": articles,
+            "matched_articles": matched,
+            "terms": len(postings),
+            "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        conn.executemany("INSERT INTO index_meta (key, value) VALUES (?, ?)",
+                         [(k, str(v)) for k, v in stats.items()])
+    conn.close()
+
+    print(f"[Literature Index] {articles} articles read, {matched} indexed for {len(postings)} drug terms.")
+    return stats
+
+class OfflineLiteratureBackend:
+    """
+    In-memory view of the offline index. Pair counts are computed by set
+    intersection on first use and memoized, so repeat lookups are a dict hit.
+    """
+
+    def __init__(self, index_path=INDEX_PATH):
+        if not os.path.exists(index_path):
+            raise FileNotFoundError(
+                f"No offline literature index at {index_path}. "
+                "Build one with: python3 scripts/literature_index.py build <baseline files>"
+            )
+        conn = sqlite3.connect(index_path)
+        try:
+            self._pmids = {
+                term: frozenset(utils.blob_to_pmids(blob))
+                for term, blob in conn.execute("SELECT term, pmids FROM term_pmids")
+            }
+            self.meta = dict(conn.execute("SELECT key, value FROM index_meta"))
+        finally:
+            conn.close()
+        self._counts = {}
+        # Identity of this index build, stored with the cache entries it answers
+        self.cache_params = {"source": "offline", "index": os.path.abspath(index_path),
+                             "built_at": self.meta.get("built_at")}
+
+    def __contains__(self, drug):
+        return normalize_term(drug) in self._pmids
+
+    def pmids(self, drug):
+        """PMIDs of Drug Interactions articles mentioning the drug (empty if unknown)."""
+        return self._pmids.get(normalize_term(drug), frozenset())
+
+    def count(self, drug1, drug2):
+        """Citation count for `drug1[tiab] AND drug2[tiab] AND Drug Interactions[MeSH]`."""
+        key = (drug1, drug2) if drug1 <= drug2 else (drug2, drug1)
+        count = self._counts.get(key)
+        if count is None:
+            pmids1, pmids2 = self.pmids(drug1), self.pmids(drug2)
+            if len(pmids1) > len(pmids2):
+                pmids1, pmids2 = pmids2, pmids1
+            count = len(pmids1.intersection(pmids2))
+            self._counts[key] = count
+        return count
+
+def write_synthetic_baseline(path, drugs, n_articles=2000, seed=0):
+    """
+    Writes a small gzipped PubMed-style XML fixture for tests and demos.
+    Each article mentions 0-3 of the drugs; about half carry the
+    Drug Interactions heading.
+    """
+    rng = random.Random(seed)
+    fillers = ["patients", "plasma", "levels", "study", "cohort", "adverse", "events", "dose"]
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<PubmedArticleSet>\n')
+        for pmid in range(1, n_articles + 1):
+            mentioned = rng.sample(drugs, k=rng.randint(0, min(3, len(drugs))))
+            title = " and ".join(mentioned) or "Unrelated study"
+            abstract = " ".join(rng.choice(fillers) for _ in range(12))
+            heading = "Drug Interactions" if rng.random() < 0.5 else "Humans"
+            f.write(
+                "<PubmedArticle><MedlineCitation>"
+                f"<PMID>{pmid}</PMID><Article>"
+                f"<ArticleTitle>{escape(title)}</ArticleTitle>"
+                f"<Abstract><AbstractText>{escape(abstract)}</AbstractText></Abstract>"
+                "</Article><MeshHeadingList><MeshHeading>"
+                f"<DescriptorName>{heading}</DescriptorName>"
+                "</MeshHeading></MeshHeadingList>"
+                "</MedlineCitation></PubmedArticle>\n"
+            )
+        f.write("</PubmedArticleSet>\n")
+
+def _expand_paths(inputs):
+    """Expands directories and globs into a sorted list of XML files."""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(sorted(glob.glob(os.path.join(item, "*.xml.gz")) + glob.glob(os.path.join(item, "*.xml"))))
+        else:
+            paths.extend(sorted(glob.glob(item)) or [item])
+    return paths
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the offline PubMed literature index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="Index baseline/update XML files")
+    build.add_argument("inputs", nargs="+", help="pubmed*.xml.gz files or directories")
+    build.add_argument("--drugs", nargs="*", help="Drug names to index (default: all prescribed drugs)")
+    build.add_argument("--output", default=INDEX_PATH)
+
+    synthetic = sub.add_parser("synthetic", help="Write a small synthetic baseline fixture")
+    synthetic.add_argument("output")
+    synthetic.add_argument("--articles", type=int, default=2000)
+    synthetic.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+    if args.command == "build":
+        build_index(_expand_paths(args.inputs), args.drugs or load_vocabulary(), args.output)
+    else:
+        write_synthetic_baseline(args.output, load_vocabulary(), args.articles, args.seed)
+        print(f"Synthetic baseline written to {args.output}")
@@ -0,0 +1,114 @@
+import os
+import math
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from tanimoto_matrix import popcount_rows
+
+# ==========================================
+# PARALLEL STRUCTURE SCORING
+# ==========================================
+# Role: Spread Tanimoto scoring of very large pair sets over CPU cores.
+# Pairs travel to the workers as compact int64 row-index arrays and come
+# back as float64 similarity arrays; fingerprints are never pickled.
+# Workers read the packed fingerprint matrix in place: straight from the
+# catalog file when the engine is memory-mapped, otherwise from a
+# shared-memory copy made once by the parent.
+# ==========================================
+
+# Below this many pairs a single process is faster than starting a pool
+MIN_PARALLEL_PAIRS = 200000
+
+# Pair chunks per worker; a few per worker evens out uneven chunks
+CHUNKS_PER_WORKER = 4
+
+# Set in each worker by _init_worker()
+_bits = None
+_bit_counts = None
+_shm = None
+
+def default_workers():
+    """Number of CPUs this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def _init_worker(source, bit_counts):
+    """
+    Attaches a worker to the fingerprint matrix.
+
+    Args:
+        source (tuple): ('file', path, offset, shape) for a memory-mapped
+            matrix, or ('shm', name, shape) for a shared-memory block.
+        bit_counts (ndarray): Set bits per row.
+    """
+    global _bits, _bit_counts, _shm
+    if source[0] == "file":
+        _, path, offset, shape = source
+        _bits = np.memmap(path, dtype="<u8", mode="r", offset=offset, shape=shape)
+    else:
+        _, name, shape = source
+        _shm = shared_memory.SharedMemory(name=name)
+        _bits = np.ndarray(shape, dtype="<u8", buffer=_shm.buf)
+    _bit_counts = bit_counts
+
+def _score_chunk(left, right):
+    """Tanimoto similarity of rows left[i] and right[i]."""
+    common = popcount_rows(_bits[left] & _bits[right])
+    union = _bit_counts[left] + _bit_counts[right] - common
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(union > 0, common / union, 0.0)
+
+def score_pairs(engine, pairs, workers=None):
+    """
+    Same result as `engine.score_pairs(pairs)`, computed by a process pool.
+
+    Args:
+        engine (TanimotoMatrix): Engine holding the fingerprints.
+        pairs (list): (name1, name2) tuples.
+        workers (int): Worker processes (default: every available CPU).
+
+    Returns:
+        dict: {(name1, name2): similarity} for the pairs where both
+        structures have a fingerprint.
+    """
+    workers = workers or default_workers()
+    pairs = [(a, b) for a, b in pairs if a in engine.index and b in engine.index]
+    if workers <= 1 or len(pairs) < MIN_PARALLEL_PAIRS:
+        return engine.score_pairs(pairs)
+
+    left = np.fromiter((engine.index[a] for a, _ in pairs), dtype=np.int64, count=len(pairs))
+    right = np.fromiter((engine.index[b] for _, b in pairs), dtype=np.int64, count=len(pairs))
+    keep = engine.valid[left] & engine.valid[right]
+    pairs = [pair for pair, ok in zip(pairs, keep) if ok]
+    left, right = left[keep], right[keep]
+
+    bits = engine.bits
+    shm = None
+    # A whole memory-mapped file (e.g. a structure catalog) is reopened by
+    # each worker; anything else is copied once into shared memory
+    if (isinstance(bits, np.memmap) and bits.filename and bits.flags.c_contiguous
+            and bits.offset + bits.nbytes == os.path.getsize(bits.filename)):
+        source = ("file", bits.filename, bits.offset, bits.shape)
+    else:
+        shm = shared_memory.SharedMemory(create=True, size=max(bits.nbytes, 1))
+        np.ndarray(bits.shape, dtype="<u8", buffer=shm.buf)[:] = bits
+        source = ("shm", shm.name, bits.shape)
+
+    chunk = max(math.ceil(len(pairs) / (workers * CHUNKS_PER_WORKER)), 1)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(source, engine.bit_counts)) as pool:
+            futures = [
+                pool.submit(_score_chunk, left[start:start + chunk], right[start:start + chunk])
+                for start in range(0, len(pairs), chunk)
+            ]
+            sims = np.concatenate([future.result() for future in futures]) if futures else np.empty(0)
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    return dict(zip(pairs, sims.tolist()))
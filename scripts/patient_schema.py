@@ -0,0 +1,250 @@
+import os
+import sqlite3
+
+# ==========================================
+# PATIENT DATABASE SCHEMA
+# ==========================================
+# Role: Own the layout of outputs/patients.db and upgrade older files.
+#   patients       one row per patient
+#   prescriptions  patient_id + drug_id (drug_name kept for readability)
+#   drugs          dictionary of every prescribed drug: integer id,
+#                  normalized name and class flags
+#   prescription_changes
+#                  change log filled by triggers: one row per patient
+#                  whose prescriptions (or record) changed after the load
+# Indexes cover the per-patient, per-drug and per-department lookups, so
+# the auditor can page patients and work on integer drug ids throughout.
+# The change log lets an incremental audit (main.py --incremental) revisit
+# only the patients changed since the last run's watermark (log id).
+# Prescriptions inserted later with only a drug_name (as the original
+# scripts did) get their drug registered and drug_id set on the next
+# connect().
+# The schema version lives in PRAGMA user_version.
+# ==========================================
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_PATH = os.path.join(BASE_DIR, "outputs", "patients.db")
+
+# Version 0: the original patients/prescriptions tables, no indexes
+# Version 1: drugs dictionary, prescriptions.drug_id, indexes
+# Version 2: prescription_changes log and its triggers
+# Version 3: paging index that keeps patients without a department
+SCHEMA_VERSION = 3
+
+# Name fragments that mark a biological (protein, antibody, vaccine);
+# these have no small-molecule structure to compare
+BIOLOGICAL_MARKERS = ["Insulin", "Monoclonal", "Vaccine"]
+
+INDEXES = {
+    "idx_prescriptions_patient": "prescriptions (patient_id)",
+    "idx_prescriptions_drug": "prescriptions (drug_id)",
+    "idx_patients_department": "patients (department, id)",
+    # Key the auditor pages by; a NULL department sorts as ''
+    "idx_patients_department_key": "patients (COALESCE(department, ''), id)",
+}
+
+# Change-log triggers: name -> (event, patient id expression). Patient
+# edits are logged too, since name, department, etc. are part of the audit.
+TRIGGERS = {
+    "trg_prescriptions_insert": ("AFTER INSERT ON prescriptions", "NEW.patient_id"),
+    "trg_prescriptions_update": ("AFTER UPDATE ON prescriptions", "OLD.patient_id"),
+    "trg_prescriptions_moved": ("AFTER UPDATE OF patient_id ON prescriptions", "NEW.patient_id"),
+    "trg_prescriptions_delete": ("AFTER DELETE ON prescriptions", "OLD.patient_id"),
+    "trg_patients_update": ("AFTER UPDATE ON patients", "NEW.id"),
+    "trg_patients_delete": ("AFTER DELETE ON patients", "OLD.id"),
+}
+
+def normalize_name(name):
+    """Case-folded drug name with single spaces, used to merge spelling variants."""
+    return " ".join(name.split()).casefold()
+
+def classify_drug(name):
+    """
+    Class flags for a drug name.
+
+    Returns:
+        tuple: (is_biological, is_small_molecule) as 0/1 ints. Drugs
+        listed in biochem_agent.DRUG_SMILES without a structure (e.g.
+        mixtures) are not small molecules.
+    """
+    from biochem_agent import DRUG_SMILES
+
+    is_biological = int(any(marker in name for marker in BIOLOGICAL_MARKERS))
+    no_structure = name in DRUG_SMILES and DRUG_SMILES[name] is None
+    return is_biological, int(not is_biological and not no_structure)
+
+def create_tables(conn):
+    """Creates the current tables (without indexes) in an empty database."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS patients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            age INTEGER,
+            department TEXT,
+            diagnosis TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS drugs (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            normalized_name TEXT NOT NULL UNIQUE,
+            is_biological INTEGER NOT NULL DEFAULT 0,
+            is_small_molecule INTEGER NOT NULL DEFAULT 1
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS prescriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_id INTEGER,
+            drug_name TEXT,
+            drug_id INTEGER REFERENCES drugs (id),
+            FOREIGN KEY (patient_id) REFERENCES patients (id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS prescription_changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_id INTEGER NOT NULL,
+            changed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def create_indexes(conn):
+    """Builds the lookup indexes (cheaper after a bulk load than during it)."""
+    for name, target in INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+
+def create_triggers(conn):
+    """Starts logging prescription and patient changes (after the bulk load)."""
+    for name, (event, patient_id) in TRIGGERS.items():
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name} {event}
+            BEGIN
+                INSERT INTO prescription_changes (patient_id) VALUES ({patient_id});
+            END
+        ''')
+
+def latest_change(conn):
+    """Id of the newest change-log entry (0 when nothing changed since the load)."""
+    return conn.execute("SELECT COALESCE(MAX(id), 0) FROM prescription_changes").fetchone()[0]
+
+def changed_patients(conn, after, until):
+    """Ids of the patients logged in (after, until] of the change log."""
+    return [row[0] for row in conn.execute(
+        "SELECT DISTINCT patient_id FROM prescription_changes WHERE id > ? AND id <= ?", (after, until)
+    )]
+
+def register_drugs(conn, names):
+    """
+    Adds drugs to the dictionary (spelling variants share one row).
+
+    Returns:
+        dict: {name: drug_id} for every given name.
+    """
+    ids = {}
+    for name in names:
+        normalized = normalize_name(name)
+        row = conn.execute("SELECT id FROM drugs WHERE normalized_name = ?", (normalized,)).fetchone()
+        if row is None:
+            is_biological, is_small_molecule = classify_drug(name)
+            row = (conn.execute(
+                "INSERT INTO drugs (name, normalized_name, is_biological, is_small_molecule) VALUES (?, ?, ?, ?)",
+                (" ".join(name.split()), normalized, is_biological, is_small_molecule),
+            ).lastrowid,)
+        ids[name] = row[0]
+    return ids
+
+def load_drugs(conn):
+    """{drug_id: {'name', 'is_biological', 'is_small_molecule'}} for the whole dictionary."""
+    return {
+        drug_id: {"name": name, "is_biological": bool(bio), "is_small_molecule": bool(small)}
+        for drug_id, name, bio, small in conn.execute(
+            "SELECT id, name, is_biological, is_small_molecule FROM drugs"
+        )
+    }
+
+def resolve_drug_ids(conn):
+    """
+    Registers the drug names of prescriptions added without a drug_id and
+    sets it. (Name normalization and the class flags are Python, so this
+    runs on connect rather than in a trigger.)
+
+    Returns:
+        int: Prescriptions resolved.
+    """
+    unresolved = "drug_id IS NULL AND drug_name IS NOT NULL"
+    if conn.execute(f"SELECT 1 FROM prescriptions WHERE {unresolved} LIMIT 1").fetchone() is None:
+        return 0
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        names = [row[0] for row in conn.execute(f"SELECT DISTINCT drug_name FROM prescriptions WHERE {unresolved}")]
+        ids = register_drugs(conn, names)
+        resolved = conn.executemany(
+            f"UPDATE prescriptions SET drug_id = ? WHERE {unresolved} AND drug_name = ?",
+            [(drug_id, name) for name, drug_id in ids.items()],
+        ).rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return resolved
+
+def _upgrade_to_v1(conn):
+    """Adds the drug dictionary to an original (version 0) database."""
+    create_tables(conn)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(prescriptions)")}
+    if "drug_id" not in columns:
+        conn.execute("ALTER TABLE prescriptions ADD COLUMN drug_id INTEGER REFERENCES drugs (id)")
+
+    names = [row[0] for row in conn.execute(
+        "SELECT DISTINCT drug_name FROM prescriptions WHERE drug_name IS NOT NULL ORDER BY drug_name"
+    )]
+    ids = register_drugs(conn, names)
+
+    # One pass over prescriptions, looking each name up in a keyed map
+    conn.execute("CREATE TEMP TABLE drug_map (name TEXT PRIMARY KEY, drug_id INTEGER NOT NULL)")
+    conn.executemany("INSERT INTO drug_map (name, drug_id) VALUES (?, ?)", ids.items())
+    conn.execute('''
+        UPDATE prescriptions
+        SET drug_id = (SELECT drug_id FROM drug_map WHERE drug_map.name = prescriptions.drug_name)
+    ''')
+    conn.execute("DROP TABLE drug_map")
+
+def finish_load(conn):
+    """Indexes a freshly created and loaded database, starts its change log and stamps its version."""
+    create_tables(conn)
+    create_indexes(conn)
+    create_triggers(conn)
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+def ensure_schema(conn):
+    """Creates or upgrades the schema in place (safe to call on every connect)."""
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
+
+    # BEGIN IMMEDIATE so two processes starting together upgrade only once
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            _upgrade_to_v1(conn)
+        finish_load(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def connect(db_path=DB_PATH):
+    """Opens the patient database, upgrading its schema and resolving new drug names first."""
+    conn = sqlite3.connect(db_path)
+    ensure_schema(conn)
+    resolve_drug_ids(conn)
+    return conn
+
+if __name__ == "__main__":
+    with connect() as conn:
+        drugs = load_drugs(conn)
+    print(f"Schema version {SCHEMA_VERSION}: {len(drugs)} drugs in the dictionary.")
@@ -0,0 +1,361 @@
+import time
+import queue
+import itertools
+import threading
+
+import utils
+import audit_schema
+import database_agent
+import literature_agent
+import biochem_agent
+import audit_writer
+import interaction_matrix
+
+# ==========================================
+# AUDIT PIPELINE
+# ==========================================
+# Role: Run the audit as concurrent stages joined by bounded queues, so
+# PubMed lookups, structure scoring and database writes overlap:
+#
+#   patient reader -> pair dedup -> literature workers --> results <- writer
+#                                \-> structure worker --/
+#
+# The reader streams patient batches; dedup sends each drug pair to the
+# agents the first time it is seen and hands the batch on to the writer,
+# which waits only for the pairs that batch needs. Patients in flight are
+# bounded by the queue sizes; the pair result map grows with the number
+# of distinct pairs (the drug vocabulary), not with the patient count.
+# The writer commits a checkpoint with every flush; a resumed run reads
+# patients after that checkpoint and skips the pairs already stored.
+# With a precomputed interaction matrix (see interaction_matrix.py), dedup
+# answers the pairs it knows directly and only sends the rest on.
+# ==========================================
+
+# Patient batches buffered between reader, dedup and writer
+PATIENT_QUEUE_SIZE = 4
+
+# Pair chunks buffered in front of each agent
+PAIR_QUEUE_SIZE = 16
+
+# Largest pair chunk sent to an agent at once
+PAIR_CHUNK = 2000
+
+# Concurrent literature chunks (each one is already a concurrent batch of
+# PubMed requests; two keep the rate limiter busy between chunks, and the
+# client's request slots cap both together at MAX_IN_FLIGHT)
+LITERATURE_WORKERS = 2
+
+# Queue end marker
+_DONE = object()
+
+class PipelineError(Exception):
+    """Raised when a stage failed; the original error is the __cause__."""
+
+class PairResults:
+    """Thread-safe map of finished pair results, with waiting for missing pairs."""
+
+    def __init__(self):
+        self._results = {utils.LITERATURE: {}, utils.STRUCTURE: {}}
+        self._changed = threading.Condition()
+        self._failed = None
+
+    def update(self, source, results):
+        with self._changed:
+            self._results[source].update(results)
+            self._changed.notify_all()
+
+    def fail(self, error):
+        with self._changed:
+            self._failed = error
+            self._changed.notify_all()
+
+    def wait_for(self, source, pairs):
+        """Blocks until every pair has a result from `source`; returns them."""
+        with self._changed:
+            results = self._results[source]
+            self._changed.wait_for(lambda: self._failed or all(pair in results for pair in pairs))
+            if self._failed:
+                raise PipelineError("An audit stage failed") from self._failed
+            return {pair: results[pair] for pair in pairs}
+
+class AuditPipeline:
+    """
+    One audit run through the staged pipeline.
+
+    Args:
+        audit_db_path (str): Output database (see audit_schema.py).
+        literature_mode (str): One of literature_agent.LITERATURE_MODES.
+        workers (int): Structure scoring processes (see biochem_agent.score_pairs).
+        batch_size (int): Patients per batch.
+        min_drugs (int): Polypharmacy threshold.
+        db_path (str): Patient database.
+        resume_run (int): Interrupted full run to continue; its literature
+            mode, threshold and change watermark are used.
+        matrix_dir (str): Interaction matrix to answer known pairs from
+            (ignored unless it was built with the run's literature mode).
+    """
+
+    def __init__(self, audit_db_path, literature_mode=None, workers=1,
+                 batch_size=database_agent.BATCH_SIZE, min_drugs=database_agent.MIN_DRUGS,
+                 db_path=database_agent.DB_PATH, resume_run=None, matrix_dir=None):
+        self.audit_db_path = audit_db_path
+        self.literature_mode = literature_mode
+        self.workers = workers
+        self.batch_size = batch_size
+        self.min_drugs = min_drugs
+        self.db_path = db_path
+        self.resume_run = resume_run
+
+        self.drugs = database_agent.get_drug_dictionary(db_path)
+        if resume_run is not None:
+            run = self._resumable_run(resume_run)
+            self.literature_mode, self.min_drugs, self.change_id = (
+                run["literature_mode"], run["min_drugs"], run["change_id"])
+        else:
+            # Changes logged after this point are picked up by the next
+            # incremental run, even if this run already saw them
+            self.change_id = database_agent.get_change_watermark(db_path)
+        self.matrix = interaction_matrix.load_matrix(matrix_dir, self.literature_mode) if matrix_dir else None
+        self.writer = None
+        self.run_id = resume_run
+        self.results = PairResults()
+        self.patient_queue = queue.Queue(PATIENT_QUEUE_SIZE)
+        self.writer_queue = queue.Queue(PATIENT_QUEUE_SIZE)
+        self.literature_queue = queue.Queue(PAIR_QUEUE_SIZE)
+        self.structure_queue = queue.Queue(PAIR_QUEUE_SIZE)
+
+        self._failed = threading.Event()
+        self._errors = []
+        # Seconds each stage spent working (not waiting on a queue)
+        self.busy = {}
+        self._busy_lock = threading.Lock()
+        self.stats = {"patients": 0, "pairs": 0, "rows": 0, "matrix_pairs": 0}
+
+    def _resumable_run(self, run_id):
+        """The audit_runs row of `run_id`; PipelineError unless it is an unfinished, latest full run."""
+        conn = audit_schema.connect(self.audit_db_path)
+        try:
+            run = audit_schema.get_run(conn, run_id)
+            latest = audit_schema.latest_full_run(conn)
+            staged = audit_schema.has_staging_tables(conn)
+        finally:
+            conn.close()
+        if run is None:
+            raise PipelineError(f"No audit run {run_id}")
+        if run["status"] == "completed":
+            raise PipelineError(f"Audit run {run_id} already completed")
+        if run["mode"] != "full" or run["status"] not in ("running", "failed"):
+            raise PipelineError(f"Audit run {run_id} is not a resumable full run")
+        if run_id != latest["id"]:
+            raise PipelineError(f"Audit run {run_id} was replaced by run {latest['id']}")
+        if not staged:
+            raise PipelineError(f"Audit run {run_id} left no staged results to resume; start a full run")
+        return run
+
+    # --- plumbing ---
+
+    def _put(self, q, item):
+        """Queue.put that gives up once another stage has failed."""
+        while not self._failed.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise PipelineError("Stopped because another stage failed")
+
+    def _get(self, q):
+        while not self._failed.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        raise PipelineError("Stopped because another stage failed")
+
+    def _timed(self, stage, started):
+        with self._busy_lock:
+            self.busy[stage] = self.busy.get(stage, 0.0) + time.perf_counter() - started
+
+    def _run_stage(self, name, target):
+        try:
+            target()
+        except PipelineError:
+            pass
+        except BaseException as e:
+            self._errors.append((name, e))
+            self._failed.set()
+            self.results.fail(e)
+
+    # --- stages ---
+
+    def _read_patients(self):
+        batches = database_agent.iter_patient_batches(self.batch_size, self.min_drugs,
+                                                      after=self.writer.checkpoint, db_path=self.db_path)
+        while True:
+            started = time.perf_counter()
+            batch = next(batches, None)
+            self._timed("read", started)
+            if batch is None:
+                break
+            self._put(self.patient_queue, batch)
+        self._put(self.patient_queue, _DONE)
+
+    def _pair_names(self, a, b):
+        """Agent key of an id pair: the two drug names, sorted."""
+        return tuple(sorted([self.drugs[a]["name"], self.drugs[b]["name"]]))
+
+    def _dedup_pairs(self):
+        seen = self._stored_pairs
+        while True:
+            batch = self._get(self.patient_queue)
+            if batch is _DONE:
+                break
+            started = time.perf_counter()
+            # Shared with the writer, which names the pairs from it too
+            database_agent.refresh_drug_dictionary(self.drugs, batch, self.db_path)
+            new_pairs = []
+            for patient in batch:
+                for a, b in itertools.combinations(patient["drug_ids"], 2):
+                    key = (a, b) if a < b else (b, a)
+                    if key not in seen:
+                        seen.add(key)
+                        new_pairs.append(key)
+            self.stats["pairs"] += len(new_pairs)
+            self._timed("dedup", started)
+
+            for start in range(0, len(new_pairs), PAIR_CHUNK):
+                chunk = new_pairs[start:start + PAIR_CHUNK]
+                names = [self._pair_names(a, b) for a, b in chunk]
+                literature, structure = self.matrix.lookup(names) if self.matrix else ({}, {})
+                if literature:
+                    self.results.update(utils.LITERATURE, literature)
+                    self.stats["matrix_pairs"] += len(literature)
+                if structure:
+                    self.results.update(utils.STRUCTURE, structure)
+                missing = [pair for pair in names if pair not in literature]
+                if missing:
+                    self._put(self.literature_queue, missing)
+                small_molecules = [
+                    pair for (a, b), pair in zip(chunk, names)
+                    if not self.drugs[a]["is_biological"] and not self.drugs[b]["is_biological"]
+                    and pair not in structure
+                ]
+                if small_molecules:
+                    self._put(self.structure_queue, small_molecules)
+            self._put(self.writer_queue, batch)
+
+        for _ in range(LITERATURE_WORKERS):
+            self._put(self.literature_queue, _DONE)
+        self._put(self.structure_queue, _DONE)
+        self._put(self.writer_queue, _DONE)
+
+    def _literature_worker(self):
+        while True:
+            pairs = self._get(self.literature_queue)
+            if pairs is _DONE:
+                return
+            started = time.perf_counter()
+            results = literature_agent.check_drug_interactions(pairs, mode=self.literature_mode)
+            self._timed("literature", started)
+            self.results.update(utils.LITERATURE, results)
+
+    def _structure_worker(self):
+        while True:
+            pairs = self._get(self.structure_queue)
+            if pairs is _DONE:
+                return
+            started = time.perf_counter()
+            results = biochem_agent.score_pairs(pairs, workers=self.workers)
+            self._timed("structure", started)
+            self.results.update(utils.STRUCTURE, results)
+
+    def _write_results(self):
+        with self.writer as writer:
+            while True:
+                batch = self._get(self.writer_queue)
+                if batch is _DONE:
+                    break
+
+                # Results for the pairs this batch adds to the writer's map
+                # (waits for the agents)
+                new_pairs = {
+                    (a, b) if a < b else (b, a)
+                    for patient in batch for a, b in itertools.combinations(patient["drug_ids"], 2)
+                }.difference(writer.pair_ids)
+                names = {pair: self._pair_names(*pair) for pair in new_pairs}
+                literature = self.results.wait_for(utils.LITERATURE, set(names.values()))
+                small = {key for (a, b), key in names.items()
+                         if not self.drugs[a]["is_biological"] and not self.drugs[b]["is_biological"]}
+                structure = self.results.wait_for(utils.STRUCTURE, small)
+                writer.add_pair_results({
+                    pair: (literature[key], structure.get(key, audit_writer.BIOLOGICAL_RESULT))
+                    for pair, key in names.items()
+                })
+
+                started = time.perf_counter()
+                self.stats["rows"] += writer.add_patients(batch)
+                self.stats["patients"] += len(batch)
+                self._timed("write", started)
+                print(f"[Pipeline] Recorded {self.stats['patients']} patients, "
+                      f"{self.stats['rows']} patient-pair rows...")
+
+            started = time.perf_counter()
+            writer.close()
+            self._timed("write", started)
+
+    def run(self):
+        """Runs every stage to completion; raises PipelineError if one fails."""
+        started = time.perf_counter()
+        self.writer = audit_writer.AuditWriter(
+            self.audit_db_path, self.drugs, literature_mode=self.literature_mode, min_drugs=self.min_drugs,
+            change_id=self.change_id, resume_run=self.resume_run,
+        )
+        self.run_id = self.writer.run_id
+        # Pairs committed before an interruption are not sent to the agents again
+        self._stored_pairs = set(self.writer.pair_ids)
+        self.stats["patients"] = self.writer.patients_written
+        self.stats["rows"] = self.writer.rows_written
+        if self.writer.checkpoint:
+            print(f"[Pipeline] Resuming run {self.run_id} after patient {self.writer.checkpoint[1]} "
+                  f"({self.writer.checkpoint[0]}), {len(self._stored_pairs)} pairs already stored")
+        stages = [("read", self._read_patients), ("dedup", self._dedup_pairs),
+                  ("structure", self._structure_worker), ("write", self._write_results)]
+        stages += [("literature", self._literature_worker)] * LITERATURE_WORKERS
+
+        threads = [threading.Thread(target=self._run_stage, args=stage, name=f"audit-{stage[0]}", daemon=True)
+                   for stage in stages]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt as e:
+            # Stop every stage; the writer marks the run failed and keeps its checkpoint
+            self._errors.append(("interrupted", e))
+            self._failed.set()
+            self.results.fail(e)
+            for thread in threads:
+                thread.join()
+
+        self.stats["wall"] = time.perf_counter() - started
+        if self._errors:
+            name, error = self._errors[0]
+            print(f"[Pipeline] Run {self.run_id} stopped; continue it with main.py --resume {self.run_id}")
+            raise PipelineError(f"Audit stage '{name}' failed: {error}") from error
+        return self.stats
+
+    def print_timings(self):
+        """Wall-clock time against the time each stage spent working."""
+        print(f"[Pipeline] {self.stats['patients']} patients, {self.stats['pairs']} unique pairs, "
+              f"{self.stats['rows']} rows in {self.stats['wall']:.2f}s wall-clock")
+        if self.matrix is not None:
+            print(f"[Pipeline] {self.stats['matrix_pairs']} pairs answered by the interaction matrix")
+        for stage in ("read", "dedup", "literature", "structure", "write"):
+            print(f"[Pipeline]   {stage:<11}{self.busy.get(stage, 0.0):8.2f}s busy")
+
+def run_audit(audit_db_path, literature_mode=None, workers=1, **options):
+    """Runs one pipelined audit and prints its stage timings."""
+    pipeline = AuditPipeline(audit_db_path, literature_mode=literature_mode, workers=workers, **options)
+    pipeline.run()
+    pipeline.print_timings()
+    return pipeline.stats
@@ -0,0 +1,247 @@
+import time
+import argparse
+import itertools
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+import risk
+import audit_schema
+import audit_writer
+import database_agent
+
+# ==========================================
+# PRESCRIPTION ANALYTICS
+# ==========================================
+# Role: Answer the population-level questions ("which pairs are
+# co-prescribed most", "which drug is in the most flagged interactions",
+# "which department carries the risk") with sparse algebra instead of
+# scanning the expanded patient-pair rows of the audit.
+# The prescriptions table is read once into a 0/1 patient x drug CSR
+# matrix A. Then:
+#   A^T A          co-prescription count of every drug pair (upper triangle)
+#   pair join      those counts against the audit's pair_results severities
+#   bincount       per-drug involvement in flagged pairs
+#   D^T (A_i * A_j) flagged pairs per department (D: patient x department)
+# The audit database is only read for pair_results, one row per pair.
+# ==========================================
+
+# Flag columns of pair_results and the level that counts as flagged
+FLAGS = {
+    "severity": risk.Severity.HIGH,                   # high overall risk (dashboard charts)
+    "literature": risk.LiteratureSeverity.KNOWN,      # known literature risk (advanced queries 2 and 9)
+    "structure": risk.StructureSeverity.HIGH,         # high structural similarity
+}
+
+FLAG_COLUMNS = {"severity": "severity", "literature": "literature_severity", "structure": "structure_severity"}
+
+class PrescriptionMatrix:
+    """
+    Polypharmacy patients x drug dictionary, as a 0/1 CSR matrix.
+
+    Attributes:
+        matrix (scipy.sparse.csr_matrix): int32 patient x drug matrix, 1
+            where the patient takes the drug.
+        patient_ids (numpy.ndarray): patients.id of each row.
+        department_codes (numpy.ndarray): Index into `departments` of each row.
+        departments (list): Department names.
+        drug_names (list): Drug name of each column.
+    """
+
+    def __init__(self, matrix, patient_ids, department_codes, departments, drug_names):
+        self.matrix = matrix
+        self.patient_ids = patient_ids
+        self.department_codes = department_codes
+        self.departments = departments
+        self.drug_names = drug_names
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def department_matrix(self):
+        """0/1 patient x department CSR matrix."""
+        rows = len(self.patient_ids)
+        return sp.csr_matrix(
+            (np.ones(rows, dtype=np.int32), (np.arange(rows), self.department_codes)),
+            shape=(rows, len(self.departments)),
+        )
+
+def load_prescription_matrix(min_drugs=database_agent.MIN_DRUGS, db_path=database_agent.DB_PATH):
+    """
+    Reads the patients taking at least `min_drugs` medications (the audit's
+    population: prescription rows are counted, as in the audit) into a
+    PrescriptionMatrix.
+    """
+    started = time.perf_counter()
+    drugs = database_agent.get_drug_dictionary(db_path)
+    drug_ids = np.array(sorted(drugs), dtype=np.int64)
+    # Each prescription is read as one packed integer, patient_id << shift | drug_id
+    # (a tuple per row costs more than the query); ids outside the dictionary become `mask`
+    shift = int(drug_ids.max(initial=0)).bit_length() + 1
+    mask = (1 << shift) - 1
+    conn = database_agent.connect(db_path)
+    try:
+        count = conn.execute("SELECT COUNT(*) FROM prescriptions WHERE patient_id IS NOT NULL").fetchone()[0]
+        packed = np.fromiter(itertools.chain.from_iterable(conn.execute(
+            "SELECT (patient_id << ?) | MIN(COALESCE(drug_id, 0), ?) FROM prescriptions WHERE patient_id IS NOT NULL",
+            (shift, mask),
+        )), dtype=np.int64, count=count)
+        # Patient ids per department, from the (department, id) index
+        departments, known = [], []
+        for (department,) in conn.execute("SELECT DISTINCT department FROM patients ORDER BY department"):
+            # Named like the audit's department of patients without one
+            departments.append(department or audit_writer.UNASSIGNED_DEPARTMENT)
+            known.append(np.fromiter(itertools.chain.from_iterable(conn.execute(
+                "SELECT id FROM patients WHERE department IS ?", (department,))), dtype=np.int64))
+    finally:
+        conn.close()
+    patient_column, drug_column = packed >> shift, packed & mask
+
+    # Rows: patients with enough prescriptions that exist in `patients`
+    patient_ids, per_patient = np.unique(patient_column, return_counts=True)
+    patient_ids = patient_ids[per_patient >= min_drugs]
+    known_ids = np.concatenate(known) if known else np.zeros(0, dtype=np.int64)
+    known_codes = np.repeat(np.arange(len(known)), [len(ids) for ids in known])
+    order = np.argsort(known_ids)
+    known_ids, known_codes = known_ids[order], known_codes[order]
+    patient_ids = patient_ids[np.isin(patient_ids, known_ids)]
+    department_codes = known_codes[np.searchsorted(known_ids, patient_ids)]
+
+    keep = np.isin(patient_column, patient_ids) & np.isin(drug_column, drug_ids)
+    rows = np.searchsorted(patient_ids, patient_column[keep])
+    columns = np.searchsorted(drug_ids, drug_column[keep])
+    matrix = sp.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)),
+                           shape=(len(patient_ids), len(drug_ids)))
+    # A drug prescribed twice is still one drug
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+
+    result = PrescriptionMatrix(matrix, patient_ids, department_codes, departments,
+                                [drugs[int(drug_id)]["name"] for drug_id in drug_ids])
+    print(f"[Analytics] {matrix.shape[0]} patients x {matrix.shape[1]} drugs ({matrix.nnz} prescriptions) "
+          f"in {time.perf_counter() - started:.2f}s")
+    return result
+
+def co_prescriptions(prescriptions):
+    """
+    Patients taking each co-prescribed drug pair, from the upper triangle of A^T A.
+
+    Returns:
+        tuple: (i, j, patients) arrays, column i < column j.
+    """
+    counts = sp.triu(prescriptions.matrix.T @ prescriptions.matrix, k=1).tocoo()
+    return counts.row.astype(np.int64), counts.col.astype(np.int64), counts.data.astype(np.int64)
+
+def pair_table(prescriptions, audit_db_path=audit_schema.AUDIT_DB_PATH):
+    """
+    Every co-prescribed pair with its patient count and audit severities.
+
+    Returns:
+        pandas.DataFrame: drug_1, drug_2 (sorted names), patients, severity,
+        literature_severity, structure_severity and the column ids i and j;
+        most patients first. All three codes are NaN for a pair without a
+        stored result, the last two also where the lookup failed or the
+        pair was not scored.
+    """
+    i, j, patients = co_prescriptions(prescriptions)
+    names = np.array(prescriptions.drug_names, dtype=object)
+    table = pd.DataFrame({"i": i, "j": j, "patients": patients})
+    first = names[i] <= names[j]
+    table["drug_1"] = np.where(first, names[i], names[j])
+    table["drug_2"] = np.where(first, names[j], names[i])
+
+    conn = audit_schema.connect(audit_db_path)
+    try:
+        stored = pd.read_sql_query(
+            "SELECT drug_1, drug_2, literature_severity, structure_severity FROM pair_results", conn)
+    finally:
+        conn.close()
+    # One row per stored pair (the vocabulary, not the patients), so the rule is applied in Python
+    stored["severity"] = [
+        int(risk.severity_of(None if pd.isna(literature) else literature, None if pd.isna(structure) else structure))
+        for literature, structure in zip(stored["literature_severity"], stored["structure_severity"])
+    ]
+    table = table.merge(stored, how="left", on=["drug_1", "drug_2"])
+    table = table.sort_values(["patients", "drug_1", "drug_2"], ascending=[False, True, True], ignore_index=True)
+    return table[["drug_1", "drug_2", "patients", "severity", "literature_severity", "structure_severity",
+                  "i", "j"]]
+
+def flagged(pairs, flag="severity"):
+    """Rows of a pair_table() flagged by one of FLAGS."""
+    return pairs[pairs[FLAG_COLUMNS[flag]] >= FLAGS[flag]]
+
+def drug_involvement(prescriptions, pairs):
+    """
+    Patient-pair interactions each drug takes part in (both sides of a
+    pair count), for the given pair_table() rows.
+
+    Returns:
+        pandas.DataFrame: drug, interactions; most involved first.
+    """
+    n = len(prescriptions.drug_names)
+    weights = pairs["patients"].to_numpy(dtype=np.int64)
+    counts = (np.bincount(pairs["i"].to_numpy(), weights, minlength=n)
+              + np.bincount(pairs["j"].to_numpy(), weights, minlength=n)).astype(np.int64)
+    table = pd.DataFrame({"drug": prescriptions.drug_names, "interactions": counts})
+    table = table[table["interactions"] > 0]
+    return table.sort_values(["interactions", "drug"], ascending=[False, True], ignore_index=True)
+
+def department_breakdown(prescriptions, pairs):
+    """
+    Per department: audited patients, patient-pair interactions, and how
+    many of those (and of the patients) involve the given pair_table() rows.
+
+    Returns:
+        pandas.DataFrame: department, patients, interactions,
+        flagged_interactions, flagged_patients.
+    """
+    departments = prescriptions.department_matrix()
+    codes = prescriptions.department_codes
+    k = len(prescriptions.departments)
+    drugs_per_patient = np.diff(prescriptions.matrix.indptr).astype(np.int64)
+
+    # A_i * A_j: patient x flagged-pair matrix, 1 where the patient takes both drugs
+    columns = prescriptions.matrix.tocsc()
+    both = columns[:, pairs["i"].to_numpy()].multiply(columns[:, pairs["j"].to_numpy()]).tocsr()
+    per_patient = np.asarray(both.sum(axis=1)).ravel()
+    flagged_interactions = np.asarray((departments.T @ both).sum(axis=1)).ravel()
+
+    return pd.DataFrame({
+        "department": prescriptions.departments,
+        "patients": np.bincount(codes, minlength=k),
+        "interactions": np.bincount(codes, drugs_per_patient * (drugs_per_patient - 1) // 2, minlength=k)
+                        .astype(np.int64),
+        "flagged_interactions": flagged_interactions.astype(np.int64),
+        "flagged_patients": np.bincount(codes, per_patient > 0, minlength=k).astype(np.int64),
+    }).sort_values(["flagged_interactions", "department"], ascending=[False, True], ignore_index=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Co-prescription analytics over a sparse patient x drug matrix.")
+    parser.add_argument("report", choices=("pairs", "drugs", "departments"),
+                        help="pairs: most co-prescribed flagged pairs; drugs: drugs most involved in "
+                             "flagged pairs; departments: flagged interactions per department")
+    parser.add_argument("--flag", choices=sorted(FLAGS), default="severity",
+                        help="What counts as flagged (default: high overall severity)")
+    parser.add_argument("--all-pairs", action="store_true", help="pairs report: include unflagged pairs")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--min-drugs", type=int, default=database_agent.MIN_DRUGS)
+    parser.add_argument("--db", default=database_agent.DB_PATH)
+    parser.add_argument("--audit-db", default=audit_schema.AUDIT_DB_PATH)
+    args = parser.parse_args()
+
+    prescriptions = load_prescription_matrix(args.min_drugs, args.db)
+    started = time.perf_counter()
+    pairs = pair_table(prescriptions, args.audit_db)
+    selected = pairs if args.report == "pairs" and args.all_pairs else flagged(pairs, args.flag)
+    if args.report == "pairs":
+        report = selected.drop(columns=["i", "j"]).head(args.top)
+    elif args.report == "drugs":
+        report = drug_involvement(prescriptions, selected).head(args.top)
+    else:
+        report = department_breakdown(prescriptions, selected)
+    print(f"[Analytics] {len(pairs)} co-prescribed pairs, {len(selected)} selected, "
+          f"report in {time.perf_counter() - started:.2f}s")
+    with pd.option_context("display.width", 200, "display.max_colwidth", 40):
+        print(report.to_string(index=False))
@@ -0,0 +1,349 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import pubmed_transport
+
+# ==========================================
+# PUBMED CLIENT
+# ==========================================
+# Role: Shared, rate-limited access to the NCBI E-utilities API.
+# One pooled HTTP session and one token bucket are shared by every caller
+# in the process, so serial and batch lookups together never exceed
+# NCBI's limits (3 requests/s anonymous, 10 requests/s with an API key).
+# Processes that query together (work_queue.py workers) swap the bucket
+# for one they share with use_limiter().
+# What actually answers a request is a pluggable transport
+# (live / record / replay, see pubmed_transport.py).
+# ==========================================
+
+# Base URLs for NCBI E-utilities API (Public & Free)
+BASE_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
+EFETCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
+
+# ESearch returns at most this many ids per page (and only the first
+# 10,000 overall); larger result sets are paged through EFetch on the
+# history server (WebEnv) instead.
+PAGE_SIZE = 10000
+
+# Optional API key; raises the allowed rate from 3 to 10 requests per second
+API_KEY = os.environ.get("NCBI_API_KEY")
+
+ANONYMOUS_RATE = 3.0
+KEYED_RATE = 10.0
+
+# Upper bound on requests waiting for a response at the same time, across
+# every thread and event loop of the process
+MAX_IN_FLIGHT = 10
+
+# Seconds between attempts to take a request slot from an event loop
+SLOT_POLL = 0.005
+
+# Retry policy for 429 / 5xx / connection errors
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+class PubMedError(Exception):
+    """Raised when an E-utilities request fails after all retries."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+
+    Tokens refill continuously at `rate` per second up to `capacity`.
+    The rate adapts to the server: `slow_down()` halves it after a 429,
+    and `recover()` creeps back towards the configured maximum on success.
+    """
+
+    def __init__(self, rate, capacity=1.0):
+        self.max_rate = rate
+        self.min_rate = rate / 8
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Takes one token and returns how many seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        """Blocks the calling thread until a request may be sent."""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        """Waits (without blocking the event loop) until a request may be sent."""
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def slow_down(self):
+        """Halves the request rate (multiplicative decrease)."""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def recover(self):
+        """Raises the request rate a little (additive increase)."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+class UnlimitedBucket:
+    """Limiter for transports that never touch NCBI (e.g. cassette replay)."""
+
+    def acquire(self):
+        pass
+
+    async def acquire_async(self):
+        pass
+
+    def slow_down(self):
+        pass
+
+    def recover(self):
+        pass
+
+class PubMedClient:
+    """
+    E-utilities client over a pooled `requests.Session`.
+
+    `esearch()` is the blocking call; `esearch_many()` runs a batch
+    concurrently from asyncio. Both paths share the same token bucket and
+    the same `max_in_flight` request slots, so batches running in several
+    threads (each with its own event loop) never have more requests open
+    than that together.
+    """
+
+    def __init__(self, api_key=API_KEY, max_in_flight=MAX_IN_FLIGHT, limiter=None, transport=None):
+        self.api_key = api_key
+        self.max_in_flight = max_in_flight
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.transport = transport or pubmed_transport.from_env(self.session)
+
+        if limiter is None:
+            if self.transport.rate_limited:
+                limiter = TokenBucket(allowed_rate(api_key))
+            else:
+                limiter = UnlimitedBucket()
+        self.limiter = limiter
+
+        # asyncio semaphores belong to one event loop; this one is shared by all
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight,
+                                            thread_name_prefix="pubmed")
+
+    async def _acquire_slot_async(self):
+        """Waits (without blocking the event loop) for one of the process-wide request slots."""
+        while not self._slots.acquire(blocking=False):
+            await asyncio.sleep(SLOT_POLL)
+
+    def _get(self, url, params):
+        """Sends one request through the transport. Returns a `requests.Response`-like object."""
+        if self.api_key:
+            params = dict(params, api_key=self.api_key)
+        return self.transport.get(url, params)
+
+    def _backoff(self, attempt, response=None):
+        """Seconds to wait before retry number `attempt` (honours Retry-After)."""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return float(retry_after)
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+        return delay * (0.5 + random.random() / 2)
+
+    def _handle(self, response, attempt, parse):
+        """
+        Interprets a response. Returns `(True, body)` with the decoded body
+        ('json' or 'text'), or `(False, delay)` with the number of seconds to
+        wait before retrying. Raises PubMedError when giving up.
+        """
+        if response.status_code == 200:
+            self.limiter.recover()
+            return True, (response.json() if parse == "json" else response.text)
+
+        if response.status_code in RETRYABLE_STATUS and attempt < MAX_RETRIES:
+            if response.status_code == 429:
+                self.limiter.slow_down()
+            return False, self._backoff(attempt, response)
+
+        raise PubMedError(f"E-utilities returned HTTP {response.status_code}",
+                          status_code=response.status_code)
+
+    def request(self, url, params, parse="json"):
+        """
+        Sends one E-utilities request, blocking until it succeeds or fails.
+
+        Args:
+            url (str): E-utility endpoint.
+            params (dict): Query parameters.
+            parse (str): 'json' or 'text'.
+
+        Returns:
+            The decoded response body.
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                with self._slots:
+                    self.limiter.acquire()
+                    response = self._get(url, params)
+            except requests.RequestException:
+                if attempt >= MAX_RETRIES:
+                    raise
+                time.sleep(self._backoff(attempt))
+                continue
+
+            done, result = self._handle(response, attempt, parse)
+            if done:
+                return result
+            time.sleep(result)
+
+    async def request_async(self, url, params, semaphore, parse="json"):
+        """
+        Asyncio version of `request()`; `semaphore` caps this batch's
+        requests in flight, the client's slots every batch's together.
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(MAX_RETRIES + 1):
+            async with semaphore:
+                await self._acquire_slot_async()
+                try:
+                    # Reserve the token inside the slot so a slow_down()
+                    # applies to every request that has not been scheduled yet
+                    await self.limiter.acquire_async()
+                    response = await loop.run_in_executor(self._executor, self._get, url, params)
+                except requests.RequestException:
+                    if attempt >= MAX_RETRIES:
+                        raise
+                    done, result = False, self._backoff(attempt)
+                else:
+                    done, result = self._handle(response, attempt, parse)
+                finally:
+                    self._slots.release()
+
+            if done:
+                return result
+            await asyncio.sleep(result)
+
+    def esearch(self, params):
+        """
+        Runs one ESearch request, blocking until it succeeds or fails.
+
+        Args:
+            params (dict): ESearch query parameters.
+
+        Returns:
+            dict: The decoded JSON response.
+        """
+        return self.request(BASE_URL, params)
+
+    async def esearch_async(self, params, semaphore):
+        """Asyncio version of `esearch()`; `semaphore` caps requests in flight."""
+        return await self.request_async(BASE_URL, params, semaphore)
+
+    async def fetch_pmids_async(self, term, semaphore):
+        """
+        Retrieves every PMID matching a search term.
+
+        The first ESearch page also stores the result set on the history
+        server; anything beyond PAGE_SIZE is paged with EFetch (uilist)
+        against that WebEnv, which has no 10,000-record ceiling.
+
+        Returns:
+            list: The PMIDs as ints, sorted ascending.
+        """
+        data = await self.esearch_async({
+            "db": "pubmed",
+            "term": term,
+            "retmode": "json",
+            "retmax": PAGE_SIZE,
+            "usehistory": "y",
+        }, semaphore)
+        result = data["esearchresult"]
+        count = int(result["count"])
+        pmids = [int(pmid) for pmid in result.get("idlist", [])]
+
+        if count > len(pmids):
+            pages = [
+                self.request_async(EFETCH_URL, {
+                    "db": "pubmed",
+                    "WebEnv": result["webenv"],
+                    "query_key": result["querykey"],
+                    "rettype": "uilist",
+                    "retmode": "text",
+                    "retstart": start,
+                    "retmax": PAGE_SIZE,
+                }, semaphore, parse="text")
+                for start in range(len(pmids), count, PAGE_SIZE)
+            ]
+            for text in await asyncio.gather(*pages):
+                pmids.extend(int(line) for line in text.split() if line.isdigit())
+
+        return sorted(set(pmids))
+
+    async def esearch_many(self, params_list):
+        """
+        Runs a batch of ESearch requests concurrently at the allowed rate.
+
+        Returns:
+            list: One decoded JSON dict per request, in order. A request that
+            failed is returned as its exception instead.
+        """
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        tasks = [self.esearch_async(params, semaphore) for params in params_list]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+def allowed_rate(api_key=API_KEY):
+    """Requests per second NCBI allows with (or without) an API key."""
+    return KEYED_RATE if api_key else ANONYMOUS_RATE
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Returns the process-wide PubMedClient (created on first use)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = PubMedClient()
+        return _client
+
+def use_limiter(make_limiter):
+    """
+    Replaces the process-wide client's token bucket by
+    `make_limiter(allowed rate)`, e.g. one shared with other processes.
+    Transports that are not rate limited keep theirs.
+
+    Returns:
+        The client's limiter.
+    """
+    client = get_client()
+    if client.transport.rate_limited:
+        client.limiter = make_limiter(allowed_rate(client.api_key))
+    return client.limiter
@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import zlib
+import random
+import sqlite3
+import threading
+
+# ==========================================
+# PUBMED TRANSPORTS
+# ==========================================
+# Role: The layer under PubMedClient that actually answers a request.
+#   'live'   - real HTTP through the pooled requests session
+#   'record' - live, and every successful response is saved to a cassette
+#   'replay' - answered from the cassette only, with optional simulated
+#              latency and error rate; no network and no rate limit
+# Cassettes are SQLite files keyed by the normalized request, so a
+# recorded production run can be replayed exactly, at local speed.
+# ==========================================
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CASSETTE_PATH = os.path.join(BASE_DIR, "outputs", "pubmed_cassette.db")
+
+TRANSPORTS = ("live", "record", "replay")
+
+REQUEST_TIMEOUT = 30
+
+# Parameters that never go into a cassette or its keys
+_SECRET_PARAMS = {"api_key"}
+
+class CassetteMiss(Exception):
+    """Raised in replay mode when a request was never recorded."""
+
+class CannedResponse:
+    """Minimal stand-in for `requests.Response` returned by replayed requests."""
+
+    def __init__(self, status_code, body, headers=None):
+        self.status_code = status_code
+        self.content = body
+        self.headers = headers or {}
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+def normalize_request(url, params):
+    """
+    Builds the cassette key for a request: the URL plus its parameters
+    sorted by name, with whitespace in values collapsed and secrets removed.
+    """
+    items = sorted(
+        (name, " ".join(str(value).split()))
+        for name, value in params.items()
+        if name not in _SECRET_PARAMS
+    )
+    return json.dumps([url, items], separators=(",", ":"))
+
+class CassetteStore:
+    """SQLite file of recorded responses (bodies are zlib-compressed)."""
+
+    def __init__(self, path=CASSETTE_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS interactions (
+                    request_key TEXT PRIMARY KEY,
+                    status_code INTEGER NOT NULL,
+                    headers TEXT,
+                    body BLOB NOT NULL,
+                    elapsed REAL,
+                    recorded_at REAL NOT NULL
+                )
+            ''')
+
+    def _connect(self):
+        """One connection per thread (requests run on a thread pool)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode = WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Returns (status_code, headers, body, elapsed) or None."""
+        row = self._connect().execute(
+            "SELECT status_code, headers, body, elapsed FROM interactions WHERE request_key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1] or "{}"), zlib.decompress(row[2]), row[3]
+
+    def put(self, key, status_code, headers, body, elapsed):
+        conn = self._connect()
+        with conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO interactions
+                (request_key, status_code, headers, body, elapsed, recorded_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (key, status_code, json.dumps(headers), zlib.compress(body), elapsed, time.time()))
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM interactions").fetchone()[0]
+
+class LiveTransport:
+    """Sends requests over HTTP with a (pooled) requests session."""
+
+    rate_limited = True
+
+    def __init__(self, session, timeout=REQUEST_TIMEOUT):
+        self.session = session
+        self.timeout = timeout
+
+    def get(self, url, params):
+        return self.session.get(url, params=params, timeout=self.timeout)
+
+class RecordingTransport:
+    """
+    Live transport that saves every successful response to a cassette.
+    Errors (429, 5xx) are passed through but not recorded, so a replay
+    is never stuck on a transient failure.
+    """
+
+    rate_limited = True
+
+    def __init__(self, inner, store):
+        self.inner = inner
+        self.store = store
+
+    def get(self, url, params):
+        started = time.monotonic()
+        response = self.inner.get(url, params)
+        if response.status_code == 200:
+            headers = {"Content-Type": response.headers.get("Content-Type", "")}
+            self.store.put(normalize_request(url, params), response.status_code,
+                           headers, response.content, time.monotonic() - started)
+        return response
+
+class ReplayTransport:
+    """
+    Answers requests from a cassette.
+
+    Args:
+        store (CassetteStore): Recorded responses.
+        latency (float): Seconds added to every response. Pass
+            'recorded' to replay each response's original elapsed time.
+        jitter (float): Extra random latency, uniform in [0, jitter).
+        error_rate (float): Probability of answering with HTTP 503 instead,
+            to exercise the client's retry path.
+        seed (int): Seed for jitter and errors, for reproducible runs.
+    """
+
+    rate_limited = False
+
+    def __init__(self, store, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        self.store = store
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    def get(self, url, params):
+        key = normalize_request(url, params)
+        recorded = self.store.get(key)
+        if recorded is None:
+            raise CassetteMiss(f"No recorded response for {key}")
+        status_code, headers, body, elapsed = recorded
+
+        with self._rng_lock:
+            extra = self._rng.random() * self.jitter
+            fail = self._rng.random() < self.error_rate
+
+        delay = (elapsed or 0.0) if self.latency == "recorded" else self.latency
+        if delay + extra > 0:
+            time.sleep(delay + extra)
+        if fail:
+            return CannedResponse(503, b"Simulated outage")
+        return CannedResponse(status_code, body, headers)
+
+def from_env(session):
+    """
+    Builds the transport selected by the environment:
+        DDI_PUBMED_TRANSPORT   live | record | replay (default: live)
+        DDI_PUBMED_CASSETTE    cassette file (default: outputs/pubmed_cassette.db)
+        DDI_REPLAY_LATENCY     seconds, or 'recorded' (default: 0)
+        DDI_REPLAY_JITTER      seconds (default: 0)
+        DDI_REPLAY_ERROR_RATE  0.0 - 1.0 (default: 0)
+        DDI_REPLAY_SEED        int (default: unseeded)
+    """
+    mode = os.environ.get("DDI_PUBMED_TRANSPORT", "live")
+    if mode not in TRANSPORTS:
+        raise ValueError(f"Unknown PubMed transport: {mode}")
+
+    live = LiveTransport(session)
+    if mode == "live":
+        return live
+
+    store = CassetteStore(os.environ.get("DDI_PUBMED_CASSETTE", CASSETTE_PATH))
+    if mode == "record":
+        return RecordingTransport(live, store)
+
+    latency = os.environ.get("DDI_REPLAY_LATENCY", "0")
+    seed = os.environ.get("DDI_REPLAY_SEED")
+    return ReplayTransport(
+        store,
+        latency=latency if latency == "recorded" else float(latency),
+        jitter=float(os.environ.get("DDI_REPLAY_JITTER", "0")),
+        error_rate=float(os.environ.get("DDI_REPLAY_ERROR_RATE", "0")),
+        seed=int(seed) if seed is not None else None,
+    )
@@ -0,0 +1,204 @@
+import re
+from enum import IntEnum
+
+# ==========================================
+# RISK RESULTS
+# ==========================================
+# Role: Structured results of the Literature and Bio-Chemist agents.
+# Agents return LiteratureResult / StructureResult objects carrying a
+# severity enum, the citation count or similarity, a structure-status
+# code and the summary text; these are stored as typed columns. The
+# familiar display strings ("⚠️ KNOWN RISK (7 citations) - ...") are only
+# rendered for presentation, by str() here or by the audit views.
+# ==========================================
+
+# More citations than this is a known interaction
+KNOWN_RISK_CITATIONS = 5
+
+# Tanimoto similarity above this is a high structural similarity
+HIGH_SIMILARITY = 0.4
+
+class LiteratureSeverity(IntEnum):
+    NONE = 0        # no obvious flag in literature
+    POTENTIAL = 1   # a few papers, needs review
+    KNOWN = 2       # many papers, known interaction
+
+class StructureStatus(IntEnum):
+    SCORED = 0       # similarity computed
+    BIOLOGICAL = 1   # biological agent, structure skipped
+    MISSING = 2      # complex or missing structure
+    INVALID = 3      # structure could not be parsed
+    UNAVAILABLE = 4  # no structure result
+    ERROR = 5        # scoring failed
+
+class StructureSeverity(IntEnum):
+    LOW = 0
+    HIGH = 1
+
+class Severity(IntEnum):
+    """Overall severity of a drug pair."""
+    NONE = 0
+    REVIEW = 1  # potential literature risk
+    HIGH = 2    # known literature risk or high structural similarity
+
+class LiteratureResult:
+    """
+    Outcome of a literature lookup.
+
+    Args:
+        severity (LiteratureSeverity): None when the lookup failed.
+        citation_count (int): Matching papers.
+        summary (str): Interaction summary (known risks).
+        error (str): Failure message when the lookup failed.
+    """
+
+    def __init__(self, severity, citation_count=None, summary=None, error=None):
+        self.severity = LiteratureSeverity(severity) if severity is not None else None
+        self.citation_count = citation_count
+        self.summary = summary
+        self.error = error
+
+    @classmethod
+    def failure(cls, error):
+        return cls(None, error=error)
+
+    @classmethod
+    def parse(cls, status, citation_count=None):
+        """Result for a stored display string (cache entries, older audit files)."""
+        match = re.search(r"\((\d+) citations\)", status)
+        if citation_count is None and match:
+            citation_count = int(match.group(1))
+        if "KNOWN RISK" in status:
+            return cls(LiteratureSeverity.KNOWN, citation_count, status.split("LLM Summary: ", 1)[-1])
+        if "POTENTIAL RISK" in status:
+            return cls(LiteratureSeverity.POTENTIAL, citation_count)
+        if "No obvious flag" in status:
+            return cls(LiteratureSeverity.NONE, citation_count or 0)
+        return cls.failure(status)
+
+    def __eq__(self, other):
+        return isinstance(other, LiteratureResult) and vars(self) == vars(other)
+
+    def __repr__(self):
+        return f"LiteratureResult({self.severity!r}, {self.citation_count!r}, {self.summary!r}, {self.error!r})"
+
+    def __str__(self):
+        if self.severity == LiteratureSeverity.KNOWN:
+            return f"⚠️ KNOWN RISK ({self.citation_count} citations) - 🤖 LLM Summary: {self.summary}"
+        if self.severity == LiteratureSeverity.POTENTIAL:
+            return f"⚠️ POTENTIAL RISK ({self.citation_count} citations) - Needs review."
+        if self.severity == LiteratureSeverity.NONE:
+            return "✅ No obvious flag in literature."
+        return self.error
+
+class StructureResult:
+    """
+    Outcome of a structure comparison.
+
+    Args:
+        status (StructureStatus): Whether (and why not) the pair was scored.
+        similarity (float): Tanimoto similarity of scored pairs.
+        error (str): Failure message for StructureStatus.ERROR.
+        severity (StructureSeverity): Of a scored pair; computed from the
+            similarity unless given (a parsed display string only keeps a
+            rounded similarity).
+    """
+
+    def __init__(self, status, similarity=None, error=None, severity=None):
+        self.status = StructureStatus(status)
+        self.similarity = similarity
+        self.error = error
+        if self.status != StructureStatus.SCORED:
+            self.severity = None
+        elif severity is not None:
+            self.severity = StructureSeverity(severity)
+        else:
+            self.severity = StructureSeverity.HIGH if similarity > HIGH_SIMILARITY else StructureSeverity.LOW
+
+    @classmethod
+    def scored(cls, similarity):
+        return cls(StructureStatus.SCORED, similarity)
+
+    @classmethod
+    def failure(cls, error):
+        return cls(StructureStatus.ERROR, error=error)
+
+    @classmethod
+    def parse(cls, status, similarity=None):
+        """Result for a stored display string (cache entries, older audit files)."""
+        match = re.search(r"\((\d+\.\d+)\)", status)
+        if similarity is None and match:
+            similarity = float(match.group(1))
+        if "HIGH STRUCTURAL SIMILARITY" in status:
+            return cls(StructureStatus.SCORED, similarity, severity=StructureSeverity.HIGH)
+        if "Low similarity" in status:
+            return cls(StructureStatus.SCORED, similarity, severity=StructureSeverity.LOW)
+        for status_code, text in STRUCTURE_TEXTS.items():
+            if status == text:
+                return cls(status_code)
+        return cls.failure(status)
+
+    def __eq__(self, other):
+        return isinstance(other, StructureResult) and vars(self) == vars(other)
+
+    def __repr__(self):
+        return f"StructureResult({self.status!r}, {self.similarity!r}, {self.error!r}, {self.severity!r})"
+
+    def __str__(self):
+        if self.status == StructureStatus.SCORED:
+            if self.severity == StructureSeverity.HIGH:
+                return f"⚠️ HIGH STRUCTURAL SIMILARITY ({self.similarity:.2f}). Possible metabolic competition."
+            return f"✅ Low similarity ({self.similarity:.2f})."
+        if self.status == StructureStatus.ERROR:
+            return self.error
+        return STRUCTURE_TEXTS[self.status]
+
+# Display strings of the structure statuses without a similarity
+STRUCTURE_TEXTS = {
+    StructureStatus.BIOLOGICAL: "🧬 Biological Agent (Structure Skipped)",
+    StructureStatus.MISSING: "⚪ Data Unavailable (Complex/Missing structure)",
+    StructureStatus.INVALID: "⚪ Invalid chemical structure data",
+    StructureStatus.UNAVAILABLE: "⚪ Data Unavailable",
+}
+
+def pair_severity(literature, structure):
+    """Overall Severity of a pair from its two results."""
+    return severity_of(literature.severity, structure.severity)
+
+def severity_of(literature_severity, structure_severity):
+    """Overall Severity from the two severity codes (None for failed / unscored)."""
+    if literature_severity == LiteratureSeverity.KNOWN or structure_severity == StructureSeverity.HIGH:
+        return Severity.HIGH
+    if literature_severity == LiteratureSeverity.POTENTIAL:
+        return Severity.REVIEW
+    return Severity.NONE
+
+def literature_sql(prefix=""):
+    """SQL expression rendering the literature display string from typed columns."""
+    return f'''CASE {prefix}literature_severity
+            WHEN {LiteratureSeverity.KNOWN:d} THEN '⚠️ KNOWN RISK (' || {prefix}citation_count
+                || ' citations) - 🤖 LLM Summary: ' || {prefix}summary
+            WHEN {LiteratureSeverity.POTENTIAL:d} THEN '⚠️ POTENTIAL RISK (' || {prefix}citation_count
+                || ' citations) - Needs review.'
+            WHEN {LiteratureSeverity.NONE:d} THEN '✅ No obvious flag in literature.'
+            ELSE {prefix}literature_error
+        END'''
+
+def structure_sql(prefix=""):
+    """
+    SQL expression rendering the structure display string from typed columns.
+    SQLite's printf can round a similarity that sits on a tie differently
+    from Python's format, so the last digit may differ from str().
+    """
+    texts = "\n".join(
+        f"            WHEN {status:d} THEN '{text}'" for status, text in STRUCTURE_TEXTS.items()
+    )
+    return f'''CASE {prefix}structure_status
+            WHEN {StructureStatus.SCORED:d} THEN CASE
+                WHEN {prefix}structure_severity = {StructureSeverity.HIGH:d} THEN '⚠️ HIGH STRUCTURAL SIMILARITY ('
+                    || printf('%.2f', {prefix}similarity) || '). Possible metabolic competition.'
+                ELSE '✅ Low similarity (' || printf('%.2f', {prefix}similarity) || ').'
+            END
+{texts}
+            ELSE {prefix}structure_error
+        END'''
@@ -0,0 +1,160 @@
+import math
+
+import numpy as np
+
+from tanimoto_matrix import popcount_rows, popcount_words
+
+# ==========================================
+# SIMILARITY SEARCH INDEX
+# ==========================================
+# Role: "Which compounds are structurally similar to X?" over large
+# catalogs without scanning every fingerprint.
+# Rows are sorted by bit count. Tanimoto(a, b) can never exceed
+# min(|a|, |b|) / max(|a|, |b|), so for a query with |a| bits only a
+# contiguous band of bit counts can reach a threshold (Swamidass & Baldi
+# bounds). Fingerprints are stored word-major (one contiguous array per
+# 64-bit word), so scoring a band is a few passes over contiguous memory.
+# top_k() cannot prune that way when the k-th neighbour is dissimilar
+# (the band becomes the whole catalog), so it counts common bits through
+# an inverted index instead: for each bit, the rows that set it. A query
+# then reads only the rows of its own bits, in one bincount.
+# ==========================================
+
+class SimilarityIndex:
+    """
+    Threshold and top-k Tanimoto search over packed fingerprints.
+
+    Args:
+        names (list): Structure name of each row.
+        bits (ndarray): (n, words) uint64 fingerprint matrix.
+        valid (ndarray): (n,) bool, False for rows without a fingerprint
+            (these are never returned).
+    """
+
+    def __init__(self, names, bits, valid):
+        valid = np.asarray(valid, dtype=bool)
+        counts = popcount_rows(bits)
+
+        keep = np.flatnonzero(valid)
+        order = keep[np.argsort(counts[keep], kind="stable")]
+        self.names = [names[i] for i in order]
+        self.columns = np.ascontiguousarray(bits[order].T)
+        self.counts = counts[order]
+        self.position = {name: i for i, name in enumerate(self.names)}
+
+        # Row range [starts[c], starts[c + 1]) holds the rows with c bits
+        max_count = int(self.counts[-1]) if len(self.counts) else 0
+        self.starts = np.searchsorted(self.counts, np.arange(max_count + 2))
+
+        # Inverted bit index (see _bit_index), built by the first top_k()
+        self._bit_rows = None
+        self._bit_starts = None
+
+    @classmethod
+    def from_registry(cls, registry):
+        """Indexes every scoreable structure of a FingerprintRegistry or StructureCatalog."""
+        names, bits, valid, _ = registry.packed()
+        return cls(names, bits, valid)
+
+    @classmethod
+    def from_engine(cls, engine):
+        """Indexes the rows of a TanimotoMatrix."""
+        return cls(engine.names, engine.bits, engine.valid)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _query(self, drug):
+        """(row position, query words, bit count) of an indexed structure."""
+        pos = self.position.get(drug)
+        if pos is None:
+            raise KeyError(f"{drug} is not in the similarity index (unknown or no structure)")
+        return pos, self.columns[:, pos].copy(), int(self.counts[pos])
+
+    def _band(self, a, threshold):
+        """Row slice [start, end) whose bit counts can reach `threshold` for a query with `a` bits."""
+        if threshold <= 0:
+            return 0, len(self.names)
+        lo = max(math.ceil(threshold * a), 0)
+        hi = min(math.floor(a / threshold), len(self.starts) - 2)
+        if lo > hi:
+            return 0, 0
+        return int(self.starts[lo]), int(self.starts[hi + 1])
+
+    def _bit_index(self):
+        """
+        (rows, starts): rows[starts[b]:starts[b + 1]] are the rows with bit
+        b set, in row order. Takes 4 bytes per set bit (about twice the
+        fingerprints for drug-like molecules); built once, on first use.
+        """
+        if self._bit_rows is None:
+            words, n = self.columns.shape
+            # (bit, row) matrix of 0/1 bytes; word w holds bits w*64 .. w*64+63
+            by_bit = np.unpackbits(self.columns.view(np.uint8).reshape(words, n, 8), axis=2, bitorder="little")
+            by_bit = by_bit.transpose(0, 2, 1).reshape(words * 64, n)
+            flat = np.flatnonzero(by_bit.view(bool))
+            self._bit_rows = (flat % max(n, 1)).astype(np.int32)
+            self._bit_starts = np.searchsorted(flat, np.arange(words * 64 + 1) * n)
+        return self._bit_rows, self._bit_starts
+
+    def _scores(self, query_words, a, start, end):
+        """Tanimoto of the query against rows [start, end)."""
+        n = end - start
+        common = np.zeros(n, dtype=np.uint16)
+        scratch = np.empty(n, dtype=np.uint64)
+        for word, column in zip(query_words, self.columns):
+            if word:
+                np.bitwise_and(column[start:end], word, out=scratch)
+                common += popcount_words(scratch)
+        union = self.counts[start:end] + a - common
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(union > 0, common / union, 0.0)
+
+    def within(self, drug, threshold):
+        """
+        All structures with similarity > threshold to `drug`, most similar first.
+
+        Returns:
+            list: (name, similarity) tuples (the query itself excluded).
+        """
+        pos, query_words, a = self._query(drug)
+        start, end = self._band(a, threshold)
+
+        sims = self._scores(query_words, a, start, end)
+        hits = np.flatnonzero(sims > threshold)
+        hits = hits[np.argsort(-sims[hits], kind="stable")]
+        return [(self.names[start + i], float(sims[i])) for i in hits if start + i != pos]
+
+    def top_k(self, drug, k):
+        """
+        The k structures most similar to `drug`.
+
+        Counts the bits each row shares with the query from the inverted
+        bit index (only rows sharing a bit are touched), then scores every
+        row at once and keeps the k best.
+
+        Returns:
+            list: (name, similarity) tuples, most similar first (empty
+            for k <= 0).
+        """
+        pos, query_words, a = self._query(drug)
+        if k <= 0:
+            return []
+        bit_rows, bit_starts = self._bit_index()
+        n = len(self.names)
+        query_bits = np.flatnonzero(np.unpackbits(query_words.view(np.uint8), bitorder="little"))
+        common = np.bincount(
+            np.concatenate([bit_rows[bit_starts[b]:bit_starts[b + 1]] for b in query_bits] or [bit_rows[:0]]),
+            minlength=n,
+        )
+        # An empty union has nothing in common: 0 / 1
+        sims = common / np.maximum(self.counts + a - common, 1)
+        # The query itself never ranks
+        sims[pos] = -1.0
+
+        k = min(k, n - 1)
+        if k <= 0:
+            return []
+        best = np.argpartition(sims, n - k)[n - k:]
+        best = best[np.argsort(-sims[best], kind="stable")]
+        return [(self.names[i], float(sims[i])) for i in best]
@@ -0,0 +1,323 @@
+import os
+import csv
+import sys
+import json
+import gzip
+import time
+import argparse
+
+import numpy as np
+
+import fingerprint_registry
+from fingerprint_registry import STATUS_OK, STATUS_MISSING, STATUS_INVALID, popcount
+
+# ==========================================
+# STRUCTURE CATALOG
+# ==========================================
+# Role: Serve formulary-sized structure sets (thousands to millions of
+# compounds) without parsing anything at import or start-up.
+# `build_catalog()` reads a SMILES CSV/TSV or an SDF file once and writes
+# a catalog directory:
+#   catalog.json                   parameters, row count, source
+#   names.bin + name_offsets.npy   UTF-8 names, concatenated
+#   smiles.bin + smiles_offsets.npy
+#   status.npy                     uint8 structure status per row
+#   bit_counts.npy                 uint16 set bits per row
+#   fingerprints.npy               (n, fpSize/64) uint64, same packing as
+#                                  the Tanimoto engine
+# `StructureCatalog` opens the arrays memory-mapped, so rows are paged in
+# on demand and worker processes share one copy through the page cache.
+# ==========================================
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CATALOG_DIR = os.path.join(BASE_DIR, "outputs", "structure_catalog")
+
+CATALOG_VERSION = 1
+
+# Rows fingerprinted (and held in memory) at a time while building
+BUILD_CHUNK = 10000
+
+# Header names tried, in order, when the columns are not given
+NAME_COLUMNS = ("name", "drug_name", "drug", "title", "id")
+SMILES_COLUMNS = ("smiles", "canonical_smiles", "isomeric_smiles")
+
+def _open_text(path):
+    """Opens a plain or gzip-compressed text file."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+def _pick_column(header, requested, candidates, what):
+    """Index of the requested column, or of the first known candidate."""
+    lowered = [column.strip().lower() for column in header]
+    for name in ([requested] if requested else candidates):
+        if name.lower() in lowered:
+            return lowered.index(name.lower())
+    raise ValueError(f"No {what} column in {header} (pass it explicitly)")
+
+def read_smiles_table(path, name_column=None, smiles_column=None):
+    """
+    Yields (name, smiles) from a CSV or TSV file with a header row.
+    Tab-separated when the file name ends in .tsv/.tab (optionally .gz).
+    """
+    stem = path[:-3] if path.endswith(".gz") else path
+    delimiter = "\t" if stem.endswith((".tsv", ".tab")) else ","
+    with _open_text(path) as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        header = next(reader)
+        name_i = _pick_column(header, name_column, NAME_COLUMNS, "name")
+        smiles_i = _pick_column(header, smiles_column, SMILES_COLUMNS, "SMILES")
+        for row in reader:
+            if len(row) <= name_i or not row[name_i].strip():
+                continue
+            smiles = row[smiles_i].strip() if len(row) > smiles_i else ""
+            yield row[name_i].strip(), smiles
+
+def read_sdf(path, name_field=None):
+    """
+    Yields (name, smiles) from an SDF file (optionally .gz), named by the
+    `name_field` property or else the molblock title. Records RDKit cannot
+    parse have no recoverable name and are skipped.
+    """
+    from rdkit import Chem
+    from rdkit import RDLogger
+    RDLogger.DisableLog('rdApp.*')
+
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        for mol in Chem.ForwardSDMolSupplier(f):
+            if mol is None:
+                continue
+            if name_field and mol.HasProp(name_field):
+                name = mol.GetProp(name_field)
+            else:
+                name = mol.GetProp("_Name") if mol.HasProp("_Name") else ""
+            if name.strip():
+                yield name.strip(), Chem.MolToSmiles(mol)
+
+def read_structures(path, name_column=None, smiles_column=None, name_field=None):
+    """(name, smiles) records of a structure file, chosen by extension."""
+    stem = path[:-3] if path.endswith(".gz") else path
+    if stem.endswith((".sdf", ".sd", ".mol")):
+        return read_sdf(path, name_field)
+    return read_smiles_table(path, name_column, smiles_column)
+
+def write_strings(path, offsets_path, strings):
+    """Writes UTF-8 strings back to back, plus their (n + 1) start offsets."""
+    offsets = [0]
+    with open(path, "wb") as f:
+        for text in strings:
+            data = text.encode("utf-8")
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+    np.save(offsets_path, np.array(offsets, dtype=np.int64))
+
+def build_catalog(source, catalog_dir=CATALOG_DIR, params=None,
+                  name_column=None, smiles_column=None, name_field=None):
+    """
+    Builds a catalog directory from a SMILES CSV/TSV or SDF file.
+    The first record of a duplicated name wins; later ones are counted
+    and dropped.
+
+    Returns:
+        StructureCatalog: The new catalog.
+    """
+    from biochem_agent import FINGERPRINT_PARAMS
+    params = dict(params or FINGERPRINT_PARAMS)
+    started = time.time()
+
+    names, smiles_list = [], []
+    seen = set()
+    duplicates = 0
+    for name, smiles in read_structures(source, name_column, smiles_column, name_field):
+        if name in seen:
+            duplicates += 1
+            continue
+        seen.add(name)
+        names.append(name)
+        smiles_list.append(smiles)
+    del seen
+
+    os.makedirs(catalog_dir, exist_ok=True)
+    meta_path = os.path.join(catalog_dir, "catalog.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    n, words = len(names), params["fpSize"] // 64
+    write_strings(os.path.join(catalog_dir, "names.bin"),
+                   os.path.join(catalog_dir, "name_offsets.npy"), names)
+    write_strings(os.path.join(catalog_dir, "smiles.bin"),
+                   os.path.join(catalog_dir, "smiles_offsets.npy"), smiles_list)
+
+    fingerprints = np.lib.format.open_memmap(
+        os.path.join(catalog_dir, "fingerprints.npy"), mode="w+", dtype="<u8", shape=(n, words))
+    statuses = np.full(n, STATUS_MISSING, dtype=np.uint8)
+    bit_counts = np.zeros(n, dtype=np.uint16)
+    n_bytes = params["fpSize"] // 8
+
+    for start in range(0, n, BUILD_CHUNK):
+        chunk = [(i, smiles) for i, smiles in enumerate(smiles_list[start:start + BUILD_CHUNK], start) if smiles]
+        if not chunk:
+            continue
+        computed = fingerprint_registry.fingerprint_smiles([smiles for _, smiles in chunk], params)
+        for (i, _), (status, fp) in zip(chunk, computed):
+            statuses[i] = status
+            if status == STATUS_OK:
+                fingerprints[i] = np.frombuffer(fp.to_bytes(n_bytes, "little"), dtype="<u8")
+                bit_counts[i] = popcount(fp)
+    fingerprints.flush()
+    del fingerprints
+
+    np.save(os.path.join(catalog_dir, "status.npy"), statuses)
+    np.save(os.path.join(catalog_dir, "bit_counts.npy"), bit_counts)
+    meta = {
+        "version": CATALOG_VERSION,
+        "params": params,
+        "count": n,
+        "source": os.path.abspath(source),
+        "built_at": time.time(),
+    }
+    # Written last: a directory without catalog.json is an unfinished build
+    with open(meta_path, "w") as f:
+        json.dump(meta, f, indent=2)
+
+    counts = np.bincount(statuses, minlength=3)
+    print(f"[Structure Catalog] {n} structures from {source} in {time.time() - started:.1f}s "
+          f"({counts[STATUS_OK]} ok, {counts[STATUS_MISSING]} without SMILES, "
+          f"{counts[STATUS_INVALID]} invalid, {duplicates} duplicate names dropped)")
+    return StructureCatalog(catalog_dir)
+
+class StructureCatalog:
+    """
+    Read-only view of a catalog directory, with the same lookup methods
+    as FingerprintRegistry.
+
+    Opening a catalog only reads catalog.json. The name map is built on
+    the first lookup; fingerprints, statuses and SMILES stay on disk
+    (memory-mapped) and only the rows that are used are read.
+    """
+
+    def __init__(self, catalog_dir=CATALOG_DIR):
+        self.catalog_dir = catalog_dir
+        meta_path = os.path.join(catalog_dir, "catalog.json")
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"No structure catalog in {catalog_dir} (run structure_catalog.py build)")
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("version") != CATALOG_VERSION:
+            raise ValueError(f"Unsupported catalog version {meta.get('version')} in {catalog_dir}")
+        self.params = meta["params"]
+        self.count = meta["count"]
+        self.source = meta.get("source")
+        # Identity of this catalog build, stored with the scores computed from it
+        self.structure_source = {"catalog": os.path.abspath(catalog_dir), "built_at": meta.get("built_at")}
+        self._arrays = {}
+        self._names = None
+        self._index = None
+
+    def _array(self, name):
+        """A catalog array, memory-mapped on first use."""
+        array = self._arrays.get(name)
+        if array is None:
+            array = np.load(os.path.join(self.catalog_dir, f"{name}.npy"), mmap_mode="r")
+            self._arrays[name] = array
+        return array
+
+    def _strings(self, blob, i):
+        """The i-th string of a names.bin/smiles.bin style blob."""
+        offsets = self._array(f"{blob}_offsets")
+        with open(os.path.join(self.catalog_dir, f"{blob}.bin"), "rb") as f:
+            f.seek(int(offsets[i]))
+            return f.read(int(offsets[i + 1] - offsets[i])).decode("utf-8")
+
+    @property
+    def names(self):
+        """Every structure name, in row order (decoded once)."""
+        if self._names is None:
+            offsets = self._array("name_offsets")
+            with open(os.path.join(self.catalog_dir, "names.bin"), "rb") as f:
+                data = f.read()
+            self._names = [
+                sys.intern(data[offsets[i]:offsets[i + 1]].decode("utf-8"))
+                for i in range(self.count)
+            ]
+        return self._names
+
+    @property
+    def index(self):
+        """{name: row id}."""
+        if self._index is None:
+            self._index = {name: i for i, name in enumerate(self.names)}
+        return self._index
+
+    @property
+    def fingerprints(self):
+        """(n, fpSize/64) uint64 fingerprint matrix (memory-mapped)."""
+        return self._array("fingerprints")
+
+    @property
+    def statuses(self):
+        return self._array("status")
+
+    @property
+    def bit_counts(self):
+        return self._array("bit_counts")
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return self.count
+
+    def status(self, name):
+        """STATUS_OK, STATUS_MISSING (also for unknown names) or STATUS_INVALID."""
+        i = self.index.get(name)
+        return int(self.statuses[i]) if i is not None else STATUS_MISSING
+
+    def smiles(self, name):
+        """The SMILES recorded for a structure ('' if none), or None for unknown names."""
+        i = self.index.get(name)
+        return self._strings("smiles", i) if i is not None else None
+
+    def fingerprint(self, name):
+        """The int fingerprint of a structure, or None."""
+        i = self.index.get(name)
+        if i is None or self.statuses[i] != STATUS_OK:
+            return None
+        return int.from_bytes(self.fingerprints[i].tobytes(), "little")
+
+    def packed(self):
+        """(names, uint64 bit matrix, valid mask, bit counts) for the batch engines."""
+        return self.names, self.fingerprints, self.statuses == STATUS_OK, self.bit_counts
+
+    def similarity(self, name1, name2):
+        """Tanimoto similarity of two catalog structures (both must be STATUS_OK)."""
+        i, j = self.index[name1], self.index[name2]
+        both = self.fingerprints[i] & self.fingerprints[j]
+        common = popcount(int.from_bytes(both.tobytes(), "little"))
+        union = int(self.bit_counts[i]) + int(self.bit_counts[j]) - common
+        return common / union if union else 0.0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or inspect a structure catalog.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="Build a catalog from a SMILES CSV/TSV or SDF file")
+    build.add_argument("source", help="structures.csv / .tsv / .sdf (optionally .gz)")
+    build.add_argument("--output", default=CATALOG_DIR)
+    build.add_argument("--name-column", help="CSV/TSV column holding the drug name")
+    build.add_argument("--smiles-column", help="CSV/TSV column holding the SMILES")
+    build.add_argument("--name-field", help="SDF property holding the drug name (default: title line)")
+
+    info = sub.add_parser("info", help="Summarize a catalog or look up structures")
+    info.add_argument("catalog", nargs="?", default=CATALOG_DIR)
+    info.add_argument("--drugs", nargs="*", default=[])
+
+    args = parser.parse_args()
+    if args.command == "build":
+        build_catalog(args.source, args.output, name_column=args.name_column,
+                      smiles_column=args.smiles_column, name_field=args.name_field)
+    else:
+        catalog = StructureCatalog(args.catalog)
+        print(f"{catalog.count} structures from {catalog.source}, params {catalog.params}")
+        for drug in args.drugs:
+            print(f"  {drug}: status {catalog.status(drug)}, SMILES {catalog.smiles(drug)!r}")
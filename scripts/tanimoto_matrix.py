@@ -0,0 +1,136 @@
+import numpy as np
+
+# ==========================================
+# TANIMOTO MATRIX ENGINE
+# ==========================================
+# Role: Score many structure pairs with a handful of NumPy operations.
+# All registry fingerprints are packed into one contiguous uint64 bit
+# matrix (one row per structure). Whole similarity blocks come from a
+# 0/1 matrix product, and arbitrary pair lists from a vectorized
+# AND + popcount over the gathered rows.
+# ==========================================
+
+# Rows per block in similarity_matrix(); bounds the temporary memory
+BLOCK_SIZE = 2048
+
+if hasattr(np, "bitwise_count"):
+    def popcount_words(words):
+        """Number of set bits in each uint64 element (as uint8)."""
+        return np.bitwise_count(words)
+else:  # NumPy < 2.0
+    _BYTE_COUNTS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount_words(words):
+        """Number of set bits in each uint64 element (as uint8)."""
+        words = np.ascontiguousarray(words)
+        as_bytes = words.view(np.uint8).reshape(words.shape + (8,))
+        return _BYTE_COUNTS[as_bytes].sum(axis=-1, dtype=np.uint8)
+
+def popcount_rows(words):
+    """Number of set bits in each row of a uint64 matrix."""
+    return popcount_words(words).sum(axis=-1, dtype=np.int64)
+
+def pack_fingerprints(fingerprints, fp_size):
+    """
+    Packs int fingerprints (None allowed) into an (n, fp_size/64) uint64
+    matrix, little-endian: bit i of a fingerprint is bit i%64 of word i//64.
+    """
+    n_bytes = fp_size // 8
+    raw = b"".join(
+        fp.to_bytes(n_bytes, "little") if fp is not None else bytes(n_bytes)
+        for fp in fingerprints
+    )
+    return np.frombuffer(raw, dtype="<u8").reshape(len(fingerprints), fp_size // 64).copy()
+
+class TanimotoMatrix:
+    """
+    Batch Tanimoto scoring over a packed fingerprint matrix.
+
+    Args:
+        names (list): Structure name of each row.
+        bits (ndarray): (n, words) uint64 fingerprint matrix.
+        valid (ndarray): (n,) bool, False for rows without a fingerprint.
+        bit_counts (ndarray): Set bits per row, if already known (e.g.
+            stored with a catalog); counted from `bits` otherwise.
+    """
+
+    def __init__(self, names, bits, valid, bit_counts=None):
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.bits = bits
+        self.valid = np.asarray(valid, dtype=bool)
+        if bit_counts is None:
+            self.bit_counts = popcount_rows(bits)
+        else:
+            self.bit_counts = np.asarray(bit_counts, dtype=np.int64)
+
+    @classmethod
+    def from_registry(cls, registry):
+        """
+        Scores every structure of a FingerprintRegistry or StructureCatalog
+        (anything with a `packed()` method).
+        """
+        return cls(*registry.packed())
+
+    def _rows(self, selection):
+        """Row indices for a list of names, or all rows for None."""
+        if selection is None:
+            return np.arange(len(self.names))
+        return np.array([self.index[name] for name in selection], dtype=np.int64)
+
+    def _unpacked(self, rows):
+        """0/1 float32 matrix of the selected rows (one column per bit)."""
+        as_bytes = np.ascontiguousarray(self.bits[rows]).view(np.uint8)
+        return np.unpackbits(as_bytes, axis=1, bitorder="little").astype(np.float32)
+
+    def similarity_matrix(self, rows=None, cols=None):
+        """
+        Tanimoto similarities between two sets of structures.
+
+        Args:
+            rows (list): Names for the matrix rows (default: all).
+            cols (list): Names for the matrix columns (default: all).
+
+        Returns:
+            ndarray: (len(rows), len(cols)) float64; NaN where either
+            structure has no fingerprint.
+        """
+        row_idx, col_idx = self._rows(rows), self._rows(cols)
+        col_bits = self._unpacked(col_idx)
+        col_counts = self.bit_counts[col_idx]
+
+        result = np.empty((len(row_idx), len(col_idx)), dtype=np.float64)
+        for start in range(0, len(row_idx), BLOCK_SIZE):
+            block = row_idx[start:start + BLOCK_SIZE]
+            # Counts are at most fpSize, so the float32 product is exact
+            common = self._unpacked(block) @ col_bits.T
+            union = self.bit_counts[block][:, None] + col_counts[None, :] - common
+            with np.errstate(invalid="ignore", divide="ignore"):
+                sims = np.where(union > 0, common / union, 0.0)
+            sims[~self.valid[block], :] = np.nan
+            sims[:, ~self.valid[col_idx]] = np.nan
+            result[start:start + len(block)] = sims
+        return result
+
+    def score_pairs(self, pairs):
+        """
+        Tanimoto similarity of each (name1, name2) pair.
+
+        Returns:
+            dict: {(name1, name2): similarity} for the pairs where both
+            structures have a fingerprint; other pairs are left out.
+        """
+        pairs = [(a, b) for a, b in pairs if a in self.index and b in self.index]
+        if not pairs:
+            return {}
+
+        left = np.fromiter((self.index[a] for a, _ in pairs), dtype=np.int64, count=len(pairs))
+        right = np.fromiter((self.index[b] for _, b in pairs), dtype=np.int64, count=len(pairs))
+        keep = self.valid[left] & self.valid[right]
+
+        common = popcount_rows(self.bits[left] & self.bits[right])
+        union = self.bit_counts[left] + self.bit_counts[right] - common
+        with np.errstate(invalid="ignore", divide="ignore"):
+            sims = np.where(union > 0, common / union, 0.0)
+
+        return {pair: float(sim) for pair, sim, ok in zip(pairs, sims, keep) if ok}
@@ -1,62 +1,376 @@
 import os
+import re
+import sys
 import json
+import time
+import sqlite3
+import threading
+from array import array
+
+# ==========================================
+# AUDIT CACHE
+# ==========================================
+# Stores agent results per drug pair in an indexed SQLite table.
+# WAL mode lets several auditor processes read and write the cache at the
+# same time, and every lookup is a single primary-key probe, so the cost
+# of a lookup does not grow with the size of the cache.
+#
+# Each pair has one entry per source ('literature', 'structure'), so the
+# two agents never overwrite each other. Entries keep the raw inputs
+# behind the status text (citation count, similarity, fingerprint
+# parameters, query string) and an expiry time set by CACHE_TTL.
+#
+# The per-drug literature mode also keeps each drug's PubMed id set here,
+# as a sorted uint32 array, so pair counts can be computed locally.
+# ==========================================
 
 # Define path to the cache folder and file
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 CACHE_DIR = os.path.join(BASE_DIR, "outputs")
+CACHE_DB = os.path.join(CACHE_DIR, "audit_cache.db")
+
+# Legacy whole-file JSON cache, imported once into CACHE_DB
 CACHE_FILE = os.path.join(CACHE_DIR, "audit_cache.json")
 
-def _load_cache():
-    """Loads the interaction cache from disk."""
+# How long (ms) a writer waits for another process to release the lock
+BUSY_TIMEOUT_MS = 30000
+
+LITERATURE = "literature"
+STRUCTURE = "structure"
+PMID_SET = "pmid_set"
+
+# Time-to-live in seconds per source (None = never expires).
+# New papers appear all the time, so literature is refreshed monthly.
+# Structure scores only change with the fingerprint parameters, which are
+# stored with the entry and checked on lookup instead.
+CACHE_TTL = {
+    LITERATURE: 30 * 24 * 3600,
+    STRUCTURE: None,
+    PMID_SET: 30 * 24 * 3600,
+}
+
+SCHEMA_VERSION = 3
+
+# Fingerprint settings the pre-versioned caches were computed with
+LEGACY_STRUCTURE_PARAMS = {"type": "morgan", "radius": 2, "fpSize": 1024}
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+_stats = {}
+
+def _pair_key(drug1, drug2):
+    """Builds the cache key for a pair (A+B is same as B+A)."""
+    pair = tuple(sorted([drug1, drug2]))
+    return f"{pair[0]}|{pair[1]}"
+
+def _count(source, outcome):
+    """Increments a hit/miss/expired counter for a source."""
+    with _stats_lock:
+        counters = _stats.setdefault(source, {"hits": 0, "misses": 0, "expired": 0})
+        counters[outcome] += 1
+
+def get_cache_stats():
+    """
+    Returns the hit/miss/expired counters of this process, per source.
+    e.g. {'literature': {'hits': 10, 'misses': 2, 'expired': 1}, ...}
+    """
+    with _stats_lock:
+        return {source: dict(counters) for source, counters in _stats.items()}
+
+def reset_cache_stats():
+    """Clears the hit/miss/expired counters."""
+    with _stats_lock:
+        _stats.clear()
+
+def _connect():
+    """
+    Returns this thread's connection to the cache database, creating or
+    upgrading the schema and migrating the legacy JSON cache on first use.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None and getattr(_local, "path", None) == CACHE_DB:
+        return conn
+
     if not os.path.exists(CACHE_DIR):
         os.makedirs(CACHE_DIR)
-        
-    if not os.path.exists(CACHE_FILE):
-        return {}
-    
+
+    conn = sqlite3.connect(CACHE_DB, timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    _ensure_schema(conn)
+
+    _local.conn = conn
+    _local.path = CACHE_DB
+    return conn
+
+def _ensure_schema(conn):
+    """Creates the cache tables and upgrades older layouts in place."""
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
+
+    # BEGIN IMMEDIATE so two processes starting together upgrade only once
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        with open(CACHE_FILE, 'r') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, IOError):
-        return {}
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    pair_key TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    citation_count INTEGER,
+                    similarity REAL,
+                    params TEXT,
+                    query TEXT,
+                    created_at REAL NOT NULL,
+                    expires_at REAL,
+                    PRIMARY KEY (pair_key, source)
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS pmid_sets (
+                    term TEXT PRIMARY KEY,
+                    pmid_count INTEGER NOT NULL,
+                    pmids BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS cache_meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            ''')
+
+            # Version 1 stored both statuses in one row per pair
+            has_v1 = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'audit_cache'"
+            ).fetchone()
+            if has_v1:
+                _import_legacy_rows(conn, conn.execute(
+                    "SELECT pair_key, lit_status, chem_status FROM audit_cache"
+                ).fetchall())
+                conn.execute("DROP TABLE audit_cache")
+
+            _migrate_json_cache(conn)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def _migrate_json_cache(conn):
+    """Imports the legacy audit_cache.json exactly once."""
+    done = conn.execute("SELECT value FROM cache_meta WHERE key = 'json_migrated'").fetchone()
+    if done or not os.path.exists(CACHE_FILE):
+        return
 
-def _save_cache(cache_data):
-    """Saves the interaction cache to disk."""
-    if not os.path.exists(CACHE_DIR):
-        os.makedirs(CACHE_DIR)
-        
     try:
-        with open(CACHE_FILE, 'w') as f:
-            json.dump(cache_data, f, indent=4)
-    except IOError as e:
-        print(f"Error saving cache: {e}")
+        with open(CACHE_FILE, 'r') as f:
+            legacy = json.load(f)
+    except (json.JSONDecodeError, IOError) as e:
+        print(f"Skipping legacy cache migration: {e}")
+        legacy = {}
+
+    rows = [
+        (key, record.get('lit_status'), record.get('chem_status'))
+        for key, record in legacy.items()
+        if isinstance(record, dict)
+    ]
+    _import_legacy_rows(conn, rows)
+    conn.execute("INSERT INTO cache_meta (key, value) VALUES ('json_migrated', ?)", (str(len(rows)),))
+
+def _import_legacy_rows(conn, rows):
+    """
+    Splits legacy (pair_key, lit_status, chem_status) records into
+    per-source entries. The raw numbers are recovered from the status text;
+    half-empty records only produce the entry they actually hold.
+    Existing entries win, since they were written after the legacy data.
+    """
+    now = time.time()
+    entries = []
+    for key, lit_status, chem_status in rows:
+        if lit_status:
+            match = re.search(r"\((\d+) citations\)", lit_status)
+            count = int(match.group(1)) if match else (0 if "No obvious flag" in lit_status else None)
+            entries.append(_entry_row(key, LITERATURE, lit_status, count, None, None, None, now))
+        if chem_status:
+            match = re.search(r"\((\d+\.\d+)\)", chem_status)
+            similarity = float(match.group(1)) if match else None
+            entries.append(_entry_row(key, STRUCTURE, chem_status, None, similarity,
+                                      LEGACY_STRUCTURE_PARAMS, None, now))
+
+    conn.executemany('''
+        INSERT OR IGNORE INTO cache_entries
+        (pair_key, source, status, citation_count, similarity, params, query, created_at, expires_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', entries)
+
+def _entry_row(key, source, status, citation_count, similarity, params, query, now, ttl=None):
+    """Builds one cache_entries row, applying the source's TTL policy."""
+    if ttl is None:
+        ttl = CACHE_TTL.get(source)
+    expires_at = now + ttl if ttl is not None else None
+    params_json = json.dumps(params, sort_keys=True) if params is not None else None
+    return (key, source, status, citation_count, similarity, params_json, query, now, expires_at)
+
+def get_cached_entry(drug1, drug2, source, params=None):
+    """
+    Looks up the cached entry of one source for a drug pair.
+
+    Args:
+        drug1 (str): Name of first drug.
+        drug2 (str): Name of second drug.
+        source (str): LITERATURE or STRUCTURE.
+        params (dict): If given, the entry only counts as a hit when it was
+            computed with the same parameters (e.g. fingerprint settings).
+
+    Returns:
+        dict: The entry's fields, or None on a miss or an expired entry.
+    """
+    key = _pair_key(drug1, drug2)
+
+    row = _connect().execute('''
+        SELECT status, citation_count, similarity, params, query, created_at, expires_at
+        FROM cache_entries WHERE pair_key = ? AND source = ?
+    ''', (key, source)).fetchone()
+
+    if row is None:
+        _count(source, "misses")
+        return None
+
+    status, citation_count, similarity, params_json, query, created_at, expires_at = row
+    stored_params = json.loads(params_json) if params_json else None
+
+    if expires_at is not None and expires_at <= time.time():
+        _count(source, "expired")
+        return None
+    if params is not None and stored_params != params:
+        _count(source, "expired")
+        return None
+
+    _count(source, "hits")
+    return {
+        "status": status,
+        "citation_count": citation_count,
+        "similarity": similarity,
+        "params": stored_params,
+        "query": query,
+        "created_at": created_at,
+        "expires_at": expires_at,
+    }
+
+def save_cached_entry(drug1, drug2, source, status, citation_count=None, similarity=None,
+                      params=None, query=None, ttl=None):
+    """
+    Saves (or replaces) the entry of one source for a drug pair.
+    The other source's entry for the same pair is left untouched.
+
+    Args:
+        ttl (float): Overrides CACHE_TTL[source] for this entry, in seconds.
+    """
+    row = _entry_row(_pair_key(drug1, drug2), source, status, citation_count,
+                     similarity, params, query, time.time(), ttl)
+
+    conn = _connect()
+    with conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO cache_entries
+            (pair_key, source, status, citation_count, similarity, params, query, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', row)
+
+def save_cached_entries(entries):
+    """
+    Saves many entries in one transaction.
+
+    Args:
+        entries (iterable): dicts with the arguments of `save_cached_entry`
+            (drug1, drug2, source, status and optional fields).
+    """
+    now = time.time()
+    rows = [
+        _entry_row(_pair_key(e["drug1"], e["drug2"]), e["source"], e["status"],
+                   e.get("citation_count"), e.get("similarity"), e.get("params"),
+                   e.get("query"), now, e.get("ttl"))
+        for e in entries
+    ]
+
+    conn = _connect()
+    with conn:
+        conn.executemany('''
+            INSERT OR REPLACE INTO cache_entries
+            (pair_key, source, status, citation_count, similarity, params, query, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
 
 def get_cached_result(drug1, drug2):
     """
     Checks if an interaction between drug1 and drug2 has already been audited.
-    Returns (lit_status, chem_status) or (None, None).
+    Returns (lit_status, chem_status); a source that is missing or expired is None.
     """
-    # Sort names to ensure consistency (A+B is same as B+A)
-    pair = tuple(sorted([drug1, drug2]))
-    key = f"{pair[0]}|{pair[1]}"
-    
-    cache = _load_cache()
-    result = cache.get(key)
-    
-    if result:
-        return result.get('lit_status'), result.get('chem_status')
-    return None, None
+    lit_entry = get_cached_entry(drug1, drug2, LITERATURE)
+    chem_entry = get_cached_entry(drug1, drug2, STRUCTURE)
+
+    return (lit_entry["status"] if lit_entry else None,
+            chem_entry["status"] if chem_entry else None)
 
 def save_cached_result(drug1, drug2, lit_status, chem_status):
     """
     Saves the audit result for a drug pair.
+    A status passed as None leaves that source's cached entry untouched.
     """
-    pair = tuple(sorted([drug1, drug2]))
-    key = f"{pair[0]}|{pair[1]}"
-    
-    cache = _load_cache()
-    cache[key] = {
-        'lit_status': lit_status,
-        'chem_status': chem_status
-    }
-    _save_cache(cache)
+    if lit_status is not None:
+        save_cached_entry(drug1, drug2, LITERATURE, lit_status)
+    if chem_status is not None:
+        save_cached_entry(drug1, drug2, STRUCTURE, chem_status)
+
+def pmids_to_blob(pmids):
+    """Packs sorted PMIDs as little-endian uint32 values."""
+    packed = array('I', pmids)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+def blob_to_pmids(blob):
+    """Unpacks a blob written by `pmids_to_blob` into an array('I')."""
+    pmids = array('I')
+    pmids.frombytes(blob)
+    if sys.byteorder == 'big':
+        pmids.byteswap()
+    return pmids
+
+def get_pmid_set(term):
+    """
+    Looks up the cached PubMed id set of a search term.
+
+    Returns:
+        array: Sorted PMIDs (array of uint32), or None on a miss or expiry.
+    """
+    row = _connect().execute(
+        "SELECT pmids, expires_at FROM pmid_sets WHERE term = ?", (term,)
+    ).fetchone()
+
+    if row is None:
+        _count(PMID_SET, "misses")
+        return None
+    if row[1] is not None and row[1] <= time.time():
+        _count(PMID_SET, "expired")
+        return None
+
+    _count(PMID_SET, "hits")
+    return blob_to_pmids(row[0])
+
+def save_pmid_set(term, pmids):
+    """Saves the sorted PubMed id set of a search term."""
+    now = time.time()
+    ttl = CACHE_TTL.get(PMID_SET)
+    expires_at = now + ttl if ttl is not None else None
+
+    conn = _connect()
+    with conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO pmid_sets (term, pmid_count, pmids, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (term, len(pmids), pmids_to_blob(sorted(pmids)), now, expires_at))
@@ -0,0 +1,512 @@
+import os
+import sys
+import time
+import zlib
+import socket
+import asyncio
+import sqlite3
+import argparse
+import datetime
+import itertools
+import threading
+import subprocess
+import contextlib
+
+import database_agent
+import literature_agent
+import biochem_agent
+import audit_schema
+import audit_writer
+import pubmed_client
+
+# ==========================================
+# SHARDED WORK QUEUE
+# ==========================================
+# Role: Spread the agents' work over several worker processes, on one host
+# or several, with a plain SQLite file as the queue (no broker).
+#   plan      the coordinator collects the unique drug pairs of the audit
+#             and partitions them by a stable hash into work units
+#   worker    leases one unit at a time (BEGIN IMMEDIATE, lease timeout),
+#             runs the Literature and Bio-Chemist agents on its pairs and
+#             writes the results back; a heartbeat renews the lease while
+#             it works, so a unit is only leased again (up to MAX_ATTEMPTS
+#             times) once its worker died or lost touch with the queue
+#   assemble  streams the patients into audit_results.db with the results
+#             from the queue, like a normal run (see audit_writer.py)
+# Results are keyed by drug pair, so a unit finished twice (an expired
+# lease that was still running) writes the same rows again. Workers on
+# other hosts need the queue on a shared filesystem with working locks
+# (and roughly synchronized clocks). The workers share one PubMed rate
+# limit, kept in the queue (see QueueRateLimiter), so together they stay
+# within NCBI's requests per second.
+# ==========================================
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUEUE_PATH = os.path.join(BASE_DIR, "outputs", "work_queue.db")
+
+# Work units the pair space is split into
+DEFAULT_SHARDS = 64
+
+# Seconds a lease lasts unless its worker renews it; a dead worker's unit
+# is taken over this long after its last heartbeat
+LEASE_SECONDS = 120
+
+# Lease renewals per lease period while a unit is worked on
+HEARTBEATS_PER_LEASE = 4
+
+# Leases per unit before it is marked failed
+MAX_ATTEMPTS = 3
+
+# Seconds an idle worker waits before looking for expired leases again
+POLL_SECONDS = 2.0
+
+BUSY_TIMEOUT_MS = 30000
+
+# Result columns: pair_results without its id
+RESULT_COLUMNS = audit_schema.PAIR_COLUMNS[1:]
+
+def connect(path=QUEUE_PATH):
+    """Opens the queue database (rollback journal, so it also works on shared filesystems)."""
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    return conn
+
+def create_tables(conn):
+    """Creates the queue tables if they do not exist."""
+    conn.execute("CREATE TABLE IF NOT EXISTS queue_info (key TEXT PRIMARY KEY, value)")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS work_units (
+            id INTEGER PRIMARY KEY,
+            status TEXT NOT NULL DEFAULT 'pending',
+            pairs INTEGER NOT NULL,
+            worker TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            finished_at TEXT
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_work_units_status ON work_units (status, lease_expires)")
+    # The workers' shared PubMed token bucket (see QueueRateLimiter)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS rate_limit (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            rate REAL NOT NULL,
+            next_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS unit_pairs (
+            unit_id INTEGER NOT NULL REFERENCES work_units (id),
+            drug_1 TEXT NOT NULL,
+            drug_2 TEXT NOT NULL,
+            small_molecule INTEGER NOT NULL,
+            PRIMARY KEY (unit_id, drug_1, drug_2)
+        ) WITHOUT ROWID
+    ''')
+    # The typed result columns of audit_schema's pair_results
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS pair_results (
+            drug_1 TEXT NOT NULL,
+            drug_2 TEXT NOT NULL,
+            citation_count INTEGER,
+            literature_severity INTEGER,
+            literature_error TEXT,
+            summary TEXT,
+            similarity REAL,
+            structure_status INTEGER NOT NULL,
+            structure_severity INTEGER,
+            structure_error TEXT,
+            PRIMARY KEY (drug_1, drug_2)
+        ) WITHOUT ROWID
+    ''')
+
+def shard_of(drug_1, drug_2, shards):
+    """Stable work unit of a (sorted) drug name pair, the same on every host."""
+    return zlib.crc32(f"{drug_1}\0{drug_2}".encode("utf-8")) % shards
+
+def plan(path=QUEUE_PATH, shards=DEFAULT_SHARDS, literature_mode=None,
+         min_drugs=database_agent.MIN_DRUGS, db_path=database_agent.DB_PATH):
+    """
+    Replaces the queue with the unique drug pairs of the at-risk patients,
+    split into `shards` work units.
+
+    Returns:
+        dict: pairs and units queued.
+    """
+    drugs = database_agent.get_drug_dictionary(db_path)
+    change_id = database_agent.get_change_watermark(db_path)
+    seen = set()
+    units = {}
+    for batch in database_agent.iter_patient_batches(min_drugs=min_drugs, db_path=db_path):
+        for patient in batch:
+            for a, b in itertools.combinations(patient["drug_ids"], 2):
+                key = (a, b) if a < b else (b, a)
+                if key in seen:
+                    continue
+                seen.add(key)
+                drug_1, drug_2 = sorted([drugs[a]["name"], drugs[b]["name"]])
+                small = not drugs[a]["is_biological"] and not drugs[b]["is_biological"]
+                units.setdefault(shard_of(drug_1, drug_2, shards) + 1, []).append(
+                    (drug_1, drug_2, int(small))
+                )
+
+    conn = connect(path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for table in ("queue_info", "work_units", "unit_pairs", "pair_results", "rate_limit"):
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+        create_tables(conn)
+        conn.executemany("INSERT INTO queue_info (key, value) VALUES (?, ?)", [
+            ("created_at", datetime.datetime.now().isoformat(timespec="seconds")),
+            ("literature_mode", literature_mode),
+            ("min_drugs", min_drugs),
+            ("change_id", change_id),
+            ("db_path", os.path.abspath(db_path)),
+        ])
+        conn.executemany("INSERT INTO work_units (id, pairs) VALUES (?, ?)",
+                         [(unit_id, len(pairs)) for unit_id, pairs in sorted(units.items())])
+        conn.executemany(
+            "INSERT INTO unit_pairs (unit_id, drug_1, drug_2, small_molecule) VALUES (?, ?, ?, ?)",
+            [(unit_id, *pair) for unit_id, pairs in units.items() for pair in pairs],
+        )
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    print(f"[Coordinator] Queued {len(seen)} unique pairs in {len(units)} work units.")
+    return {"pairs": len(seen), "units": len(units)}
+
+def queue_info(conn):
+    """The plan's settings as a dict."""
+    return dict(conn.execute("SELECT key, value FROM queue_info"))
+
+def unit_counts(conn):
+    """{status: work units}"""
+    return dict(conn.execute("SELECT status, COUNT(*) FROM work_units GROUP BY status"))
+
+def lease_unit(conn, worker, lease_seconds=LEASE_SECONDS):
+    """
+    Leases the next pending unit, or one whose lease expired.
+
+    Returns:
+        int: Unit id, or None when nothing can be leased right now.
+    """
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Units whose last lease ran out too often are given up on
+        conn.execute('''
+            UPDATE work_units SET status = 'failed', error = COALESCE(error, 'lease expired')
+            WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?
+        ''', (now, MAX_ATTEMPTS))
+        row = conn.execute('''
+            SELECT id FROM work_units
+            WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?)
+            ORDER BY id LIMIT 1
+        ''', (now,)).fetchone()
+        if row:
+            conn.execute('''
+                UPDATE work_units
+                SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1
+                WHERE id = ?
+            ''', (worker, now + lease_seconds, row[0]))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return row[0] if row else None
+
+def renew_lease(conn, unit_id, worker, lease_seconds=LEASE_SECONDS):
+    """
+    Extends this worker's lease on a unit to `lease_seconds` from now.
+
+    Returns:
+        bool: False if the unit is no longer leased to this worker.
+    """
+    return conn.execute('''
+        UPDATE work_units SET lease_expires = ?
+        WHERE id = ? AND worker = ? AND status = 'leased'
+    ''', (time.time() + lease_seconds, unit_id, worker)).rowcount > 0
+
+@contextlib.contextmanager
+def lease_heartbeat(path, unit_id, worker, lease_seconds=LEASE_SECONDS):
+    """Renews the lease on a unit from a background thread while the block runs."""
+    stop = threading.Event()
+
+    def beat():
+        conn = connect(path)
+        try:
+            while not stop.wait(lease_seconds / HEARTBEATS_PER_LEASE):
+                try:
+                    if not renew_lease(conn, unit_id, worker, lease_seconds):
+                        print(f"[Worker {worker}] Lost the lease on unit {unit_id}")
+                        return
+                except sqlite3.OperationalError as e:
+                    # Retried at the next beat; the lease outlasts a few misses
+                    print(f"[Worker {worker}] Could not renew the lease on unit {unit_id}: {e}")
+        finally:
+            conn.close()
+
+    thread = threading.Thread(target=beat, name=f"lease-{unit_id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+class QueueRateLimiter:
+    """
+    PubMed token bucket shared through the queue database by every worker
+    (same interface as pubmed_client.TokenBucket). The next free request
+    time and the current rate live in the rate_limit row, so the workers
+    together send at most `rate` requests per second, and a 429 seen by
+    one slows them all down.
+    """
+
+    def __init__(self, path, rate):
+        self.max_rate = rate
+        self.min_rate = rate / 8
+        self._lock = threading.Lock()
+        # Used from the client's request threads and event loops
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None,
+                                    check_same_thread=False)
+        self.conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        create_tables(self.conn)
+        self.conn.execute("INSERT OR IGNORE INTO rate_limit (id, rate, next_at) VALUES (1, ?, 0)", (rate,))
+
+    def reserve(self):
+        """Takes the next request slot and returns how many seconds to wait for it."""
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                rate, next_at = self.conn.execute("SELECT rate, next_at FROM rate_limit WHERE id = 1").fetchone()
+                now = time.time()
+                slot = max(now, next_at)
+                self.conn.execute("UPDATE rate_limit SET next_at = ? WHERE id = 1", (slot + 1 / rate,))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return slot - now
+
+    def acquire(self):
+        """Blocks the calling thread until a request may be sent."""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        """Waits (without blocking the event loop) until a request may be sent."""
+        delay = await asyncio.get_running_loop().run_in_executor(None, self.reserve)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def slow_down(self):
+        """Halves the shared request rate (multiplicative decrease)."""
+        with self._lock:
+            self.conn.execute("UPDATE rate_limit SET rate = MAX(?, rate / 2) WHERE id = 1", (self.min_rate,))
+
+    def recover(self):
+        """Raises the shared request rate a little (additive increase)."""
+        with self._lock:
+            self.conn.execute("UPDATE rate_limit SET rate = MIN(?, rate + ?) WHERE id = 1 AND rate < ?",
+                              (self.max_rate, self.max_rate / 20, self.max_rate))
+
+def check_pairs(names, small, literature_mode=None, structure_workers=1):
+    """
+    Runs both agents on sorted drug name pairs (`small`: the small-molecule
+    ones, which get a structure comparison).
+
+    Returns:
+        dict: {(drug_1, drug_2): (LiteratureResult, StructureResult)}
+    """
+    literature = literature_agent.check_drug_interactions(names, mode=literature_mode) if names else {}
+    structure = biochem_agent.score_pairs(small, workers=structure_workers) if small else {}
+    return {pair: (literature[pair], structure.get(pair, audit_writer.BIOLOGICAL_RESULT)) for pair in names}
+
+def process_unit(conn, unit_id, literature_mode=None, structure_workers=1):
+    """Runs the agents on a leased unit and stores its results (one transaction)."""
+    pairs = conn.execute(
+        "SELECT drug_1, drug_2, small_molecule FROM unit_pairs WHERE unit_id = ?", (unit_id,)
+    ).fetchall()
+    results = check_pairs(
+        [(drug_1, drug_2) for drug_1, drug_2, _ in pairs],
+        [(drug_1, drug_2) for drug_1, drug_2, small_molecule in pairs if small_molecule],
+        literature_mode, structure_workers,
+    )
+    rows = [audit_schema.pair_row(None, drug_1, drug_2, *result)[1:] for (drug_1, drug_2), result in results.items()]
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Keyed by pair: a unit finished twice writes the same rows again
+        conn.executemany(
+            f"INSERT OR REPLACE INTO pair_results ({', '.join(RESULT_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(RESULT_COLUMNS))})",
+            rows,
+        )
+        conn.execute('''
+            UPDATE work_units SET status = 'done', finished_at = ?, error = NULL
+            WHERE id = ? AND status != 'done'
+        ''', (datetime.datetime.now().isoformat(timespec="seconds"), unit_id))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return len(rows)
+
+def _release_unit(conn, unit_id, worker, error):
+    """
+    Puts a unit this worker holds back for retry after an error (failed
+    once out of attempts); a unit another worker took over is left alone.
+    """
+    conn.execute('''
+        UPDATE work_units
+        SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+            worker = NULL, lease_expires = NULL, error = ?
+        WHERE id = ? AND worker = ? AND status = 'leased'
+    ''', (MAX_ATTEMPTS, error, unit_id, worker))
+
+def run_worker(path=QUEUE_PATH, worker=None, lease_seconds=LEASE_SECONDS, structure_workers=1):
+    """
+    Leases and processes units until none is pending or leased.
+
+    Returns:
+        int: Units this worker finished.
+    """
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    pubmed_client.use_limiter(lambda rate: QueueRateLimiter(path, rate))
+    conn = connect(path)
+    finished = 0
+    try:
+        literature_mode = queue_info(conn).get("literature_mode")
+        while True:
+            unit_id = lease_unit(conn, worker, lease_seconds)
+            if unit_id is None:
+                counts = unit_counts(conn)
+                if not counts.get("pending") and not counts.get("leased"):
+                    break
+                # Others still hold leases; take over any that expire
+                time.sleep(POLL_SECONDS)
+                continue
+            try:
+                with lease_heartbeat(path, unit_id, worker, lease_seconds):
+                    pairs = process_unit(conn, unit_id, literature_mode, structure_workers)
+            except Exception as e:
+                print(f"[Worker {worker}] Unit {unit_id} failed: {e}")
+                _release_unit(conn, unit_id, worker, str(e))
+                continue
+            finished += 1
+            print(f"[Worker {worker}] Unit {unit_id}: {pairs} pairs done.")
+    finally:
+        conn.close()
+    return finished
+
+def assemble(path=QUEUE_PATH, audit_db_path=audit_schema.AUDIT_DB_PATH, db_path=None):
+    """
+    Writes the audit from the finished queue: every at-risk patient with
+    the pair results the workers stored.
+
+    Returns:
+        dict: patients, pairs and rows written.
+    """
+    conn = connect(path)
+    try:
+        info = queue_info(conn)
+        counts = unit_counts(conn)
+        if set(counts) - {"done"}:
+            raise RuntimeError(f"Work units not finished: {counts}")
+        results = {}
+        for row in conn.execute(f"SELECT {', '.join(RESULT_COLUMNS)} FROM pair_results"):
+            results[(row[0], row[1])] = audit_schema.results_from_row((None,) + row)
+    finally:
+        conn.close()
+
+    db_path = db_path or info["db_path"]
+    min_drugs = info["min_drugs"]
+    drugs = database_agent.get_drug_dictionary(db_path)
+    with audit_writer.AuditWriter(audit_db_path, drugs, literature_mode=info["literature_mode"],
+                                  min_drugs=min_drugs, change_id=info["change_id"]) as writer:
+        for batch in database_agent.iter_patient_batches(min_drugs=min_drugs, db_path=db_path):
+            new_pairs = {
+                (a, b) if a < b else (b, a)
+                for patient in batch for a, b in itertools.combinations(patient["drug_ids"], 2)
+            }.difference(writer.pair_ids)
+            names = {(a, b): tuple(sorted([drugs[a]["name"], drugs[b]["name"]])) for a, b in new_pairs}
+            # Pairs prescribed after the plan are checked here
+            missing = [key for key in names.values() if key not in results]
+            if missing:
+                small = [key for (a, b), key in names.items() if key not in results
+                         and not drugs[a]["is_biological"] and not drugs[b]["is_biological"]]
+                results.update(check_pairs(missing, small, info["literature_mode"]))
+            writer.add_pair_results({pair: results[key] for pair, key in names.items()})
+            writer.add_patients(batch)
+        writer.close()
+    print(f"[Coordinator] Audit run {writer.run_id}: {writer.patients_written} patients, "
+          f"{writer.pairs_written} pairs, {writer.rows_written} rows.")
+    return {"patients": writer.patients_written, "pairs": writer.pairs_written, "rows": writer.rows_written}
+
+def run_coordinator(workers, path=QUEUE_PATH, shards=DEFAULT_SHARDS, literature_mode=None,
+                    min_drugs=database_agent.MIN_DRUGS, db_path=database_agent.DB_PATH,
+                    audit_db_path=audit_schema.AUDIT_DB_PATH):
+    """Plans the queue, runs `workers` local worker processes, then assembles the audit."""
+    started = time.perf_counter()
+    plan(path, shards, literature_mode, min_drugs, db_path)
+    processes = [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "--queue", path, "worker"])
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.wait()
+    conn = connect(path)
+    try:
+        counts = unit_counts(conn)
+    finally:
+        conn.close()
+    print(f"[Coordinator] Work units: {counts}")
+    if set(counts) - {"done"}:
+        print("[Coordinator] Some units did not finish; run more workers, then `work_queue.py assemble`.")
+        return None
+    stats = assemble(path, audit_db_path, db_path)
+    print(f"[Coordinator] {workers} workers finished in {time.perf_counter() - started:.2f}s wall-clock.")
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded multi-worker audit over a shared SQLite queue.")
+    parser.add_argument("--queue", default=QUEUE_PATH, help="Queue database (shared by every worker)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Plan, run local workers and assemble the audit")
+    run.add_argument("--workers", type=int, default=4)
+    run.add_argument("--shards", type=int, default=DEFAULT_SHARDS)
+    run.add_argument("--literature-mode", choices=literature_agent.LITERATURE_MODES)
+
+    plan_cmd = sub.add_parser("plan", help="Queue the work units (replaces the queue)")
+    plan_cmd.add_argument("--shards", type=int, default=DEFAULT_SHARDS)
+    plan_cmd.add_argument("--literature-mode", choices=literature_agent.LITERATURE_MODES)
+
+    worker_cmd = sub.add_parser("worker", help="Process work units until the queue is finished")
+    worker_cmd.add_argument("--lease-seconds", type=float, default=LEASE_SECONDS)
+    worker_cmd.add_argument("--structure-workers", type=int, default=1)
+
+    sub.add_parser("assemble", help="Write audit_results.db from a finished queue")
+    sub.add_parser("status", help="Work units by status")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run_coordinator(args.workers, args.queue, args.shards, args.literature_mode)
+    elif args.command == "plan":
+        plan(args.queue, args.shards, args.literature_mode)
+    elif args.command == "worker":
+        finished = run_worker(args.queue, lease_seconds=args.lease_seconds,
+                              structure_workers=args.structure_workers or None)
+        print(f"[Worker] Finished {finished} work units.")
+    elif args.command == "assemble":
+        assemble(args.queue)
+    else:
+        conn = connect(args.queue)
+        try:
+            print(unit_counts(conn))
+        finally:
+            conn.close()
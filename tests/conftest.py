@@ -0,0 +1,65 @@
+import os
+import sys
+import types
+
+import pytest
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts")
+sys.path.insert(0, SCRIPTS_DIR)
+
+import utils
+import biochem_agent
+import database_setup
+import literature_agent
+import literature_index
+import fingerprint_registry
+
+# ==========================================
+# TEST FIXTURES
+# ==========================================
+# Every test audits its own small generated hospital in a temporary
+# directory: literature comes from an offline index built from a synthetic
+# baseline (no network), and the agent cache and fingerprint registry live
+# next to it, so nothing in outputs/ is read or written.
+# ==========================================
+
+TEST_PATIENTS = 120
+TEST_SEED = 7
+
+# Prescribed by the tests on top of the generated formulary
+EXTRA_DRUGS = ["Warfarin"]
+
+def formulary():
+    """Every drug name the generator prescribes, plus EXTRA_DRUGS."""
+    names = {name for department in database_setup.department_data.values() for name in department["medications"]}
+    return sorted(names) + EXTRA_DRUGS
+
+@pytest.fixture
+def audit_env(tmp_path, monkeypatch):
+    """
+    Paths of a generated patients.db, an (absent) audit database and the
+    directory holding them, with the agents pointed at per-test state.
+    """
+    patients_db = str(tmp_path / "patients.db")
+    database_setup.generate_hospital(patients_db, patients=TEST_PATIENTS, seed=TEST_SEED)
+
+    monkeypatch.setattr(utils, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(utils, "CACHE_DB", str(tmp_path / "audit_cache.db"))
+    monkeypatch.setattr(utils, "CACHE_FILE", str(tmp_path / "audit_cache.json"))
+
+    baseline = str(tmp_path / "baseline.xml.gz")
+    index_path = str(tmp_path / "literature_index.db")
+    literature_index.write_synthetic_baseline(baseline, formulary(), n_articles=600)
+    literature_index.build_index([baseline], formulary(), index_path)
+    monkeypatch.setattr(literature_agent, "LITERATURE_INDEX", index_path)
+    monkeypatch.setattr(literature_agent, "LITERATURE_MODE", "offline")
+    monkeypatch.setattr(literature_agent, "_offline_backend", None)
+
+    registry = fingerprint_registry.FingerprintRegistry.build(
+        biochem_agent.DRUG_SMILES, biochem_agent.FINGERPRINT_PARAMS, path=str(tmp_path / "fingerprints.bin"))
+    monkeypatch.setattr(biochem_agent, "_registry", registry)
+    monkeypatch.setattr(biochem_agent, "_engine", None)
+    monkeypatch.setattr(biochem_agent, "_similarity_index", None)
+
+    return types.SimpleNamespace(dir=str(tmp_path), patients_db=patients_db,
+                                 audit_db=str(tmp_path / "audit_results.db"))
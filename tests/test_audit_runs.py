@@ -0,0 +1,84 @@
+import sqlite3
+
+import pytest
+
+import pipeline
+import audit_schema
+import audit_writer
+import database_agent
+
+def _rows(audit_db):
+    conn = sqlite3.connect(audit_db)
+    try:
+        return sorted(conn.execute(
+            "SELECT patient_id, department, drug_1, drug_2, literature_risk, biochem_risk FROM patient_safety_audit"))
+    finally:
+        conn.close()
+
+def _runs(audit_db):
+    conn = sqlite3.connect(audit_db)
+    try:
+        return conn.execute("SELECT id, status FROM audit_runs ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+def _fail_after_first_batch(monkeypatch):
+    """Makes the next audit lose its patient database after one batch."""
+    original = database_agent.iter_patient_batches
+
+    def batches(*args, **kwargs):
+        patients = original(*args, **kwargs)
+        yield next(patients)
+        patients.close()
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(database_agent, "iter_patient_batches", batches)
+    return original
+
+def test_failed_full_run_keeps_the_previous_results(audit_env, monkeypatch):
+    pipeline.run_audit(audit_env.audit_db, literature_mode="offline", db_path=audit_env.patients_db)
+    completed = _rows(audit_env.audit_db)
+    monkeypatch.setattr(audit_writer, "CHECKPOINT_SECONDS", 0)
+    _fail_after_first_batch(monkeypatch)
+
+    with pytest.raises(pipeline.PipelineError):
+        pipeline.run_audit(audit_env.audit_db, literature_mode="offline", db_path=audit_env.patients_db,
+                           batch_size=20)
+
+    assert _rows(audit_env.audit_db) == completed
+    assert [status for _, status in _runs(audit_env.audit_db)] == ["completed", "failed"]
+    conn = audit_schema.connect_readonly(audit_env.audit_db)
+    try:
+        assert audit_schema.latest_full_run(conn, completed=True)["id"] == 1
+        assert audit_schema.has_staging_tables(conn)
+    finally:
+        conn.close()
+
+def test_resumed_run_replaces_the_results(audit_env, monkeypatch):
+    pipeline.run_audit(audit_env.audit_db, literature_mode="offline", db_path=audit_env.patients_db)
+    completed = _rows(audit_env.audit_db)
+    monkeypatch.setattr(audit_writer, "CHECKPOINT_SECONDS", 0)
+    original = _fail_after_first_batch(monkeypatch)
+    with pytest.raises(pipeline.PipelineError):
+        pipeline.run_audit(audit_env.audit_db, literature_mode="offline", db_path=audit_env.patients_db,
+                           batch_size=20)
+    monkeypatch.setattr(database_agent, "iter_patient_batches", original)
+
+    pipeline.run_audit(audit_env.audit_db, literature_mode="offline", db_path=audit_env.patients_db,
+                       batch_size=20, resume_run=2)
+
+    assert _rows(audit_env.audit_db) == completed
+    assert _runs(audit_env.audit_db) == [(1, "completed"), (2, "completed")]
+    conn = sqlite3.connect(audit_env.audit_db)
+    try:
+        assert not audit_schema.has_staging_tables(conn)
+        assert conn.execute("SELECT DISTINCT run_id FROM audited_patients").fetchall() == [(2,)]
+    finally:
+        conn.close()
+
+def test_resuming_a_completed_run_is_refused(audit_env):
+    pipeline.run_audit(audit_env.audit_db, literature_mode="offline", db_path=audit_env.patients_db)
+
+    with pytest.raises(pipeline.PipelineError, match="already completed"):
+        pipeline.run_audit(audit_env.audit_db, literature_mode="offline", db_path=audit_env.patients_db,
+                           resume_run=1)
@@ -0,0 +1,85 @@
+import sqlite3
+
+import pipeline
+import audit_schema
+import incremental_audit
+
+def _runs(audit_db):
+    conn = sqlite3.connect(audit_db)
+    try:
+        return conn.execute("SELECT mode, status FROM audit_runs ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+def _audited_patients(audit_db):
+    conn = sqlite3.connect(audit_db)
+    try:
+        return [row[0] for row in conn.execute("SELECT id FROM audited_patients ORDER BY id")]
+    finally:
+        conn.close()
+
+def _audited_pairs(audit_db, patient_id):
+    conn = sqlite3.connect(audit_db)
+    try:
+        return set(conn.execute(
+            "SELECT drug_1, drug_2 FROM patient_safety_audit WHERE patient_id = ?", (patient_id,)))
+    finally:
+        conn.close()
+
+def _prescribe_by_name(patients_db, patient_id, drug_name):
+    """Adds a prescription the way the original scripts did: no drug_id."""
+    conn = sqlite3.connect(patients_db)
+    try:
+        conn.execute("INSERT INTO prescriptions (patient_id, drug_name) VALUES (?, ?)", (patient_id, drug_name))
+        conn.commit()
+    finally:
+        conn.close()
+
+def test_incremental_audit_picks_up_prescriptions_added_by_name(audit_env):
+    pipeline.run_audit(audit_env.audit_db, literature_mode="offline", db_path=audit_env.patients_db)
+    first, second = _audited_patients(audit_env.audit_db)[:2]
+
+    _prescribe_by_name(audit_env.patients_db, first, "Aspirin")
+    _prescribe_by_name(audit_env.patients_db, second, "Warfarin")
+    stats = incremental_audit.run_incremental_audit(audit_env.audit_db, literature_mode="offline",
+                                                    db_path=audit_env.patients_db)
+
+    assert stats is not None
+    assert stats["changed"] == 2
+    assert any("Warfarin" in pair for pair in _audited_pairs(audit_env.audit_db, second))
+    assert _runs(audit_env.audit_db) == [("full", "completed"), ("incremental", "completed")]
+
+def test_full_audit_after_prescription_added_by_name(audit_env):
+    pipeline.run_audit(audit_env.audit_db, literature_mode="offline", db_path=audit_env.patients_db)
+    patient = _audited_patients(audit_env.audit_db)[0]
+
+    _prescribe_by_name(audit_env.patients_db, patient, "Warfarin")
+    pipeline.run_audit(audit_env.audit_db, literature_mode="offline", db_path=audit_env.patients_db)
+
+    assert any("Warfarin" in pair for pair in _audited_pairs(audit_env.audit_db, patient))
+    assert [status for _, status in _runs(audit_env.audit_db)] == ["completed", "completed"]
+
+def test_prescription_without_a_drug_is_skipped(audit_env):
+    pipeline.run_audit(audit_env.audit_db, literature_mode="offline", db_path=audit_env.patients_db)
+    patient = _audited_patients(audit_env.audit_db)[0]
+    before = _audited_pairs(audit_env.audit_db, patient)
+
+    conn = sqlite3.connect(audit_env.patients_db)
+    conn.execute("INSERT INTO prescriptions (patient_id) VALUES (?)", (patient,))
+    conn.commit()
+    conn.close()
+    stats = incremental_audit.run_incremental_audit(audit_env.audit_db, literature_mode="offline",
+                                                    db_path=audit_env.patients_db)
+
+    assert stats["changed"] == 1
+    assert _audited_pairs(audit_env.audit_db, patient) == before
+
+def test_stale_full_run_falls_back_to_a_full_audit(audit_env):
+    pipeline.run_audit(audit_env.audit_db, literature_mode="offline", db_path=audit_env.patients_db)
+    conn = audit_schema.connect(audit_env.audit_db)
+    conn.execute("UPDATE audit_runs SET started_at = '2000-01-01T00:00:00'")
+    conn.commit()
+    conn.close()
+
+    assert incremental_audit.run_incremental_audit(audit_env.audit_db, literature_mode="offline",
+                                                   db_path=audit_env.patients_db) is None
@@ -0,0 +1,52 @@
+import json
+import os
+import time
+
+import utils
+import literature_agent
+import literature_index
+import interaction_matrix
+
+from conftest import formulary
+
+def _build(audit_env):
+    matrix_dir = os.path.join(audit_env.dir, "matrix")
+    interaction_matrix.build_matrix(matrix_dir, literature_mode="offline", db_path=audit_env.patients_db)
+    return matrix_dir
+
+def _edit_meta(matrix_dir, **changes):
+    meta_path = os.path.join(matrix_dir, "matrix.json")
+    with open(meta_path) as f:
+        meta = json.load(f)
+    meta.update(changes)
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+
+def test_fresh_matrix_is_used(audit_env):
+    matrix = interaction_matrix.load_matrix(_build(audit_env), "offline")
+
+    assert matrix is not None
+    literature = literature_agent.check_drug_interactions([("Aspirin", "Ibuprofen")], mode="offline")
+    assert matrix.pair("Aspirin", "Ibuprofen")[0] == literature[("Aspirin", "Ibuprofen")]
+
+def test_matrix_older_than_the_literature_ttl_is_not_used(audit_env):
+    matrix_dir = _build(audit_env)
+    _edit_meta(matrix_dir, built_at=time.time() - utils.CACHE_TTL[utils.LITERATURE] - 60)
+
+    assert "literature TTL" in interaction_matrix.InteractionMatrix(matrix_dir).mismatch("offline")
+    assert interaction_matrix.load_matrix(matrix_dir, "offline") is None
+
+def test_matrix_of_another_literature_index_is_not_used(audit_env, monkeypatch):
+    matrix_dir = _build(audit_env)
+    baseline = os.path.join(audit_env.dir, "baseline_2.xml.gz")
+    index_path = os.path.join(audit_env.dir, "literature_index_2.db")
+    literature_index.write_synthetic_baseline(baseline, formulary(), n_articles=300)
+    literature_index.build_index([baseline], formulary(), index_path)
+    monkeypatch.setattr(literature_agent, "LITERATURE_INDEX", index_path)
+    monkeypatch.setattr(literature_agent, "_offline_backend", None)
+
+    assert "literature source" in interaction_matrix.InteractionMatrix(matrix_dir).mismatch("offline")
+    assert interaction_matrix.load_matrix(matrix_dir, "offline") is None
+
+def test_matrix_of_another_literature_mode_is_not_used(audit_env):
+    assert interaction_matrix.load_matrix(_build(audit_env), "per-drug") is None
@@ -0,0 +1,46 @@
+import time
+
+import pipeline
+import audit_schema
+import literature_agent
+import interaction_service
+
+def _service(audit_env):
+    return interaction_service.InteractionService(audit_env.audit_db, db_path=audit_env.patients_db,
+                                                  literature_mode="offline")
+
+def test_audit_literature_is_preloaded(audit_env):
+    pipeline.run_audit(audit_env.audit_db, literature_mode="offline", db_path=audit_env.patients_db)
+
+    service = _service(audit_env)
+
+    assert service.literature
+    pair = next(iter(service.literature))
+    assert service.check(list(pair))["literature_pending"] == 0
+    assert service.health()["literature_queued"] == 0
+
+def test_audit_literature_older_than_the_ttl_is_not_preloaded(audit_env):
+    pipeline.run_audit(audit_env.audit_db, literature_mode="offline", db_path=audit_env.patients_db)
+    conn = audit_schema.connect(audit_env.audit_db)
+    conn.execute("UPDATE audit_runs SET started_at = '2000-01-01T00:00:00'")
+    conn.commit()
+    conn.close()
+
+    service = _service(audit_env)
+
+    assert not service.literature
+    assert service.structure
+
+def test_expired_literature_is_queried_again(audit_env, monkeypatch):
+    pipeline.run_audit(audit_env.audit_db, literature_mode="offline", db_path=audit_env.patients_db)
+    service = _service(audit_env)
+    pair = next(iter(service.literature))
+    service._literature_expires[pair] = time.time() - 1
+    # The agent cache has expired too
+    monkeypatch.setattr(literature_agent, "cached_interaction", lambda *args, **kwargs: None)
+
+    assert service.check(list(pair))["literature_pending"] == 1
+    assert service.wait_for_literature(timeout=10)
+    assert service.health()["literature_fetched"] == 1
+    assert service._literature_expires[pair] > time.time()
+    assert service.check(list(pair))["literature_pending"] == 0
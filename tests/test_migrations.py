@@ -0,0 +1,155 @@
+import sqlite3
+
+import risk
+import pipeline
+import audit_schema
+import patient_schema
+import database_agent
+
+def _patients_v0(path):
+    """A patients.db as the original database_setup.py wrote it (no drug dictionary, no indexes)."""
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE patients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            age INTEGER,
+            department TEXT,
+            diagnosis TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE prescriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_id INTEGER,
+            drug_name TEXT,
+            FOREIGN KEY (patient_id) REFERENCES patients (id)
+        )
+    ''')
+    conn.executemany("INSERT INTO patients (id, name, age, department, diagnosis) VALUES (?, ?, ?, ?, ?)", [
+        (1, "Ada", 71, "Cardiology", "Atrial fibrillation"),
+        (2, "Ben", 64, None, "Hypertension"),
+    ])
+    conn.executemany("INSERT INTO prescriptions (patient_id, drug_name) VALUES (?, ?)", [
+        (1, "Warfarin"), (1, "Aspirin"), (1, "Metoprolol"),
+        (2, "warfarin "), (2, "Lisinopril"), (2, "Amlodipine"),
+    ])
+    conn.commit()
+    conn.close()
+
+def _audit_v0(path):
+    """An audit_results.db as the original main.py wrote it: one table per department."""
+    conn = sqlite3.connect(path)
+    rows = {
+        "Cardiology": [
+            ("Ada", 71, "Atrial fibrillation", "Warfarin, Aspirin, Metoprolol", "Warfarin", "Aspirin",
+             str(risk.LiteratureResult(risk.LiteratureSeverity.KNOWN, 42, "Bleeding risk.")),
+             str(risk.StructureResult.scored(0.12))),
+            ("Ada", 71, "Atrial fibrillation", "Warfarin, Aspirin, Metoprolol", "Aspirin", "Metoprolol",
+             str(risk.LiteratureResult(risk.LiteratureSeverity.NONE, 0)),
+             str(risk.StructureResult.scored(0.81))),
+        ],
+        "General_Medicine": [
+            ("Ben", 64, "Hypertension", "Warfarin, Lisinopril, Amlodipine", "Lisinopril", "Amlodipine",
+             str(risk.LiteratureResult(risk.LiteratureSeverity.POTENTIAL, 3)),
+             str(risk.StructureResult.scored(0.05))),
+        ],
+    }
+    for table, table_rows in rows.items():
+        conn.execute(f'''
+            CREATE TABLE {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                patient_name TEXT,
+                age INTEGER,
+                diagnosis TEXT,
+                medication_list TEXT,
+                drug_1 TEXT,
+                drug_2 TEXT,
+                literature_risk TEXT,
+                biochem_risk TEXT
+            )
+        ''')
+        conn.executemany(f'''
+            INSERT INTO {table} (patient_name, age, diagnosis, medication_list, drug_1, drug_2,
+                                 literature_risk, biochem_risk)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', table_rows)
+    conn.commit()
+    conn.close()
+    return rows
+
+def test_original_patient_database_is_upgraded(tmp_path):
+    path = str(tmp_path / "patients.db")
+    _patients_v0(path)
+
+    conn = database_agent.connect(path)
+    try:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == patient_schema.SCHEMA_VERSION
+        # Spelling variants share one dictionary entry
+        drugs = patient_schema.load_drugs(conn)
+        assert sorted(drug["name"] for drug in drugs.values()) == [
+            "Amlodipine", "Aspirin", "Lisinopril", "Metoprolol", "Warfarin"]
+        assert conn.execute("SELECT COUNT(*) FROM prescriptions WHERE drug_id IS NULL").fetchone()[0] == 0
+        assert conn.execute('''
+            SELECT COUNT(DISTINCT drug_id) FROM prescriptions WHERE drug_name IN ('Warfarin', 'warfarin ')
+        ''').fetchone()[0] == 1
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert set(patient_schema.INDEXES) <= indexes
+
+        # Changes after the upgrade are logged; the loaded rows are not
+        assert patient_schema.latest_change(conn) == 0
+        conn.execute("INSERT INTO prescriptions (patient_id, drug_name) VALUES (2, 'Aspirin')")
+        conn.commit()
+        assert patient_schema.changed_patients(conn, 0, patient_schema.latest_change(conn)) == [2]
+    finally:
+        conn.close()
+
+    # Upgrading is done once; reconnecting resolves the name added without a drug_id
+    conn = database_agent.connect(path)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM prescriptions WHERE drug_id IS NULL").fetchone()[0] == 0
+    finally:
+        conn.close()
+
+def test_original_audit_database_is_upgraded(tmp_path):
+    path = str(tmp_path / "audit_results.db")
+    rows = _audit_v0(path)
+
+    conn = audit_schema.connect(path)
+    try:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == audit_schema.SCHEMA_VERSION
+        assert conn.execute("SELECT status, mode FROM audit_runs").fetchall() == [("imported", "full")]
+        # The department tables became views with the same rows
+        assert audit_schema.department_views(conn) == sorted(rows)
+        for view, view_rows in rows.items():
+            assert conn.execute(f'''
+                SELECT patient_name, age, diagnosis, medication_list, drug_1, drug_2, literature_risk, biochem_risk
+                FROM "{view}" ORDER BY id
+            ''').fetchall() == [
+                row[:4] + tuple(sorted(row[4:6])) + row[6:] for row in view_rows
+            ]
+        severities = dict(conn.execute(
+            "SELECT drug_1 || '+' || drug_2, severity FROM patient_safety_audit"
+        ).fetchall())
+        assert severities["Aspirin+Warfarin"] > severities["Amlodipine+Lisinopril"]
+    finally:
+        conn.close()
+
+    readonly = audit_schema.connect_readonly(path)
+    readonly.close()
+
+def test_audit_runs_on_an_upgraded_audit_database(audit_env):
+    _audit_v0(audit_env.audit_db)
+
+    pipeline.run_audit(audit_env.audit_db, literature_mode="offline", db_path=audit_env.patients_db)
+
+    conn = audit_schema.connect_readonly(audit_env.audit_db)
+    try:
+        assert [status for (status,) in conn.execute("SELECT status FROM audit_runs ORDER BY id")] == [
+            "imported", "completed"]
+        # The full run replaced the imported rows
+        assert conn.execute("SELECT COUNT(*) FROM patient_safety_audit WHERE patient_name IN ('Ada', 'Ben')"
+                            ).fetchone()[0] == 0
+        assert not audit_schema.has_staging_tables(conn)
+    finally:
+        conn.close()
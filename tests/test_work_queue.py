@@ -0,0 +1,62 @@
+import time
+
+import work_queue
+
+def _queue(tmp_path, units=2):
+    path = str(tmp_path / "work_queue.db")
+    conn = work_queue.connect(path)
+    work_queue.create_tables(conn)
+    conn.executemany("INSERT INTO work_units (id, pairs) VALUES (?, 0)", [(unit_id,) for unit_id in range(1, units + 1)])
+    return path, conn
+
+def _unit(conn, unit_id):
+    return conn.execute("SELECT status, worker, lease_expires, attempts FROM work_units WHERE id = ?",
+                        (unit_id,)).fetchone()
+
+def test_expired_lease_is_taken_over(tmp_path):
+    path, conn = _queue(tmp_path, units=1)
+
+    assert work_queue.lease_unit(conn, "a", lease_seconds=-1) == 1
+    assert work_queue.lease_unit(conn, "b") == 1
+    assert _unit(conn, 1)[:2] == ("leased", "b")
+    assert _unit(conn, 1)[3] == 2
+
+def test_renewed_lease_is_not_taken_over(tmp_path):
+    path, conn = _queue(tmp_path, units=1)
+    work_queue.lease_unit(conn, "a", lease_seconds=0.2)
+
+    with work_queue.lease_heartbeat(path, 1, "a", lease_seconds=0.2):
+        time.sleep(0.5)
+        assert work_queue.lease_unit(conn, "b") is None
+    assert _unit(conn, 1)[:2] == ("leased", "a")
+    assert not work_queue.renew_lease(conn, 1, "b")
+
+def test_release_leaves_a_unit_taken_over_by_another_worker(tmp_path):
+    path, conn = _queue(tmp_path, units=1)
+    work_queue.lease_unit(conn, "a", lease_seconds=-1)
+    work_queue.lease_unit(conn, "b")
+
+    work_queue._release_unit(conn, 1, "a", "timed out")
+    assert _unit(conn, 1)[:2] == ("leased", "b")
+
+    work_queue._release_unit(conn, 1, "b", "timed out")
+    assert _unit(conn, 1)[:2] == ("pending", None)
+
+def test_workers_share_one_rate_limit(tmp_path):
+    path, _ = _queue(tmp_path)
+    limiters = [work_queue.QueueRateLimiter(path, rate=10.0) for _ in range(3)]
+
+    delays = [limiter.reserve() for limiter in limiters * 2]
+
+    # Six requests from three workers at 10/s: one slot every 0.1 s
+    assert delays[0] <= 0.01
+    assert 0.45 <= delays[-1] <= 0.55
+
+def test_slow_down_applies_to_every_worker(tmp_path):
+    path, conn = _queue(tmp_path)
+    first, second = work_queue.QueueRateLimiter(path, rate=10.0), work_queue.QueueRateLimiter(path, rate=10.0)
+
+    first.slow_down()
+    second.reserve()
+    assert 0.15 <= second.reserve() <= 0.21
+    assert conn.execute("SELECT rate FROM rate_limit").fetchone()[0] == 5.0